@@ -2,14 +2,32 @@
 
 import datetime
 import glob
+import json
 import subprocess
+import threading
+import time
+import zlib
 
 from logging import getLogger, DEBUG
 from pathlib import Path
-from typing import Callable, Optional, List
-
-from nftest.common import calculate_checksum, popen_with_logger
+from typing import Callable, Dict, Optional, List, Tuple
+
+from nftest.common import (
+    CHECKSUM_ALGORITHMS,
+    bytes_hashed,
+    calculate_checksum,
+    count_hashed,
+    popen_with_logger,
+)
+from nftest.comparators import (
+    file_chunks,
+    first_difference,
+    get_comparator,
+    gzip_chunks,
+    threaded_chunks,
+)
 from nftest.NFTestENV import NFTestENV
+from nftest.watch import OutputChecksums
 
 
 class NFTestAssertionError(Exception):
@@ -26,12 +44,37 @@ class NotUpdatedError(NFTestAssertionError):
 
 class MismatchedContentsError(NFTestAssertionError):
     """An exception that the contents are mismatched."""
-    def __init__(self, actual: Path, expect: Path):
+    def __init__(
+        self,
+        actual: Path,
+        expect: Path,
+        offset: Optional[int] = None,
+        reason: Optional[str] = None,
+    ):
         self.actual = actual
         self.expect = expect
+        self.offset = offset
+        self.reason = reason
+
+    def __str__(self) -> str:
+        message = f"File comparison failed between {self.actual} and {self.expect}"
+        details = []
+        if self.offset is not None:
+            details.append(f"first difference at byte {self.offset}")
+        if self.reason is not None:
+            details.append(self.reason)
+        if details:
+            message += ": " + ", ".join(details)
+        return message
+
+class ScriptTimeoutError(NFTestAssertionError):
+    """An exception that an assertion script did not finish in time."""
+    def __init__(self, script: str, timeout: float):
+        self.script = script
+        self.timeout = timeout
 
     def __str__(self) -> str:
-        return f"File comparison failed between {self.actual} and {self.expect}"
+        return f"{self.script} did not finish within {self.timeout} seconds"
 
 class NonSpecificGlobError(NFTestAssertionError):
     """An exception that the glob did not resolve to a single file."""
@@ -46,6 +89,10 @@ class NonSpecificGlobError(NFTestAssertionError):
         return f"Expression `{self.globstr}` did not resolve to any files"
 
 
+# Compressed files at least this large are decompressed in worker threads
+THREADED_GZIP_SIZE = 16 * 1024 * 1024
+
+
 def resolve_single_path(path: str) -> Path:
     """Resolve wildcards in path and ensure only a single path is identified"""
     expanded_paths = glob.glob(path)
@@ -65,6 +112,8 @@ class NFTestAssert:
         expect: str,
         method: str = "md5",
         script: Optional[str] = None,
+        batch: bool = False,
+        timeout: Optional[float] = None,
     ):
         """Constructor"""
         self._env = NFTestENV()
@@ -73,11 +122,51 @@ class NFTestAssert:
         self.expect = expect
         self.method = method
         self.script = script
+        self.batch = batch
+        # Seconds the script may run before it is killed, if limited
+        self.timeout = timeout
+        self.script_batch: Optional[ScriptBatch] = None
+        # Checksums of outputs taken while Nextflow ran, if watched
+        self.output_checksums: Optional[OutputChecksums] = None
+        # The time taken and bytes hashed by perform_assertions
+        self.timing: Dict[str, float] = {}
 
         self.startup_time = datetime.datetime.now(tz=datetime.timezone.utc)
 
     def perform_assertions(self):
         "Perform the appropriate assertions on the named files."
+        start_time = time.monotonic()
+        start_bytes = bytes_hashed()
+        try:
+            self._perform_assertions()
+        finally:
+            seconds = time.monotonic() - start_time
+            hashed = bytes_hashed() - start_bytes
+            self.timing = {
+                "seconds": seconds,
+                "bytes_hashed": hashed,
+                "bytes_per_second": hashed / seconds if seconds else 0.0,
+            }
+
+    def _perform_assertions(self):
+        "Resolve the files and assert that they match."
+        actual_path, expect_path = self.resolve_paths()
+
+        # Assert that the files match. Methods may raise a more detailed
+        # MismatchedContentsError themselves.
+        try:
+            if not self.get_assert_method()(actual_path, expect_path):
+                raise MismatchedContentsError(actual_path, expect_path)
+        except MismatchedContentsError:
+            self._logger.error("Assertion failed")
+            self._logger.error("Actual: %s", self.actual)
+            self._logger.error("Expect: %s", self.expect)
+            raise
+
+        self._logger.debug("Assertion passed")
+
+    def resolve_paths(self) -> Tuple[Path, Path]:
+        "Resolve the actual and expected files and check they can be compared."
         # Ensure that there is exactly one file for each input glob pattern
         actual_path = resolve_single_path(self.actual)
         self._logger.debug(
@@ -99,39 +188,273 @@ class NFTestAssert:
         if self.startup_time >= file_mod_time:
             raise NotUpdatedError(actual_path)
 
-        # Assert that the files match
-        if not self.get_assert_method()(actual_path, expect_path):
-            self._logger.error("Assertion failed")
-            self._logger.error("Actual: %s", self.actual)
-            self._logger.error("Expect: %s", self.expect)
-            raise MismatchedContentsError(actual_path, expect_path)
-
-        self._logger.debug("Assertion passed")
+        return actual_path, expect_path
 
     def get_assert_method(self) -> Callable:
         """Get the assert method"""
+        if self.script is not None and self.script_batch is not None:
+            return self._make_batch_function()
+
         if self.script is not None:
+            return self._make_script_function()
+
+        if self.method in CHECKSUM_ALGORITHMS:
+            return self._make_checksum_function()
+
+        if self.method == "bytes":
+            return self._make_bytes_function()
+
+        if self.method == "gzip-content":
+            return self._make_gzip_function()
 
-            def script_function(actual, expect):
-                cmd = [self.script, actual, expect]
-                self._logger.debug(subprocess.list2cmdline(cmd))
+        return self._make_plugin_function()
 
+    def _make_batch_function(self) -> Callable:
+        """Look up the result of this pair in the batched script run"""
+        def batch_function(actual, expect):
+            result = self.script_batch.result(actual, expect)
+            if result.get("passed") is not True:
+                raise MismatchedContentsError(
+                    actual, expect, reason=result.get("message")
+                )
+            return True
+
+        return batch_function
+
+    def _make_script_function(self) -> Callable:
+        """Run the script on this pair"""
+        def script_function(actual, expect):
+            cmd = [self.script, actual, expect]
+            self._logger.debug(subprocess.list2cmdline(cmd))
+
+            try:
                 process = popen_with_logger(
-                    cmd, logger=self._logger, stdout_level=DEBUG
+                    cmd,
+                    logger=self._logger,
+                    stdout_level=DEBUG,
+                    timeout=self.timeout,
+                    start_new_session=self.timeout is not None,
+                )
+            except subprocess.TimeoutExpired as error:
+                raise ScriptTimeoutError(self.script, self.timeout) from error
+            return process.returncode == 0
+
+        return script_function
+
+    def _make_checksum_function(self) -> Callable:
+        """Compare the checksums of the files"""
+        def checksum_function(actual, expect):
+            self._logger.debug("%s %s %s", self.method, actual, expect)
+            actual_value = None
+            if self.output_checksums is not None:
+                # The output may have been hashed while Nextflow ran
+                actual_value = self.output_checksums.lookup(actual, self.method)
+            if actual_value is None:
+                # Outputs are rewritten by every run, so caching them is futile
+                actual_value = calculate_checksum(
+                    actual, self.method, use_cache=False
                 )
-                return process.returncode == 0
+            expect_value = calculate_checksum(expect, self.method)
+            return actual_value == expect_value
+
+        return checksum_function
+
+    def _make_bytes_function(self) -> Callable:
+        """Compare the files byte by byte"""
+        def bytes_function(actual, expect):
+            self._logger.debug("cmp %s %s", actual, expect)
+            actual_size = actual.stat().st_size
+            expect_size = expect.stat().st_size
+            if actual_size != expect_size:
+                raise MismatchedContentsError(
+                    actual,
+                    expect,
+                    reason=f"sizes differ ({actual_size} != {expect_size} bytes)",
+                )
+
+            offset = first_difference(file_chunks(actual), file_chunks(expect))
+            if offset is not None:
+                raise MismatchedContentsError(actual, expect, offset=offset)
+
+            return True
 
-            return script_function
+        return bytes_function
 
-        if self.method == "md5":
+    def _make_gzip_function(self) -> Callable:
+        """Compare the decompressed contents of the files"""
+        def gzip_function(actual, expect):
+            self._logger.debug("zcmp %s %s", actual, expect)
+            streams = [gzip_chunks(actual), gzip_chunks(expect)]
+            if max(actual.stat().st_size, expect.stat().st_size) >= THREADED_GZIP_SIZE:
+                streams = [threaded_chunks(stream) for stream in streams]
 
-            def md5_function(actual, expect):
-                self._logger.debug("md5 %s %s", actual, expect)
-                actual_value = calculate_checksum(actual)
-                expect_value = calculate_checksum(expect)
-                return actual_value == expect_value
+            try:
+                offset = first_difference(*streams)
+            except (OSError, EOFError, zlib.error) as error:
+                raise MismatchedContentsError(
+                    actual, expect, reason=f"unable to decompress: {error}"
+                ) from error
+
+            if offset is not None:
+                raise MismatchedContentsError(
+                    actual, expect, offset=offset, reason="in decompressed contents"
+                )
 
-            return md5_function
+            return True
+
+        return gzip_function
+
+    def _make_plugin_function(self) -> Callable:
+        """Compare the files with a registered or plugin comparator"""
+        try:
+            comparator = get_comparator(self.method)
+        except Exception as error:
+            self._logger.error("assert method %s failed to load.", self.method)
+            raise NFTestAssertionError(
+                f"assert method {self.method} failed to load: {error}"
+            ) from error
+
+        if comparator is None:
+            self._logger.error("assert method %s unknown.", self.method)
+            raise NFTestAssertionError(f"assert method {self.method} unknown.")
+
+        def plugin_function(actual, expect):
+            self._logger.debug("%s %s %s", self.method, actual, expect)
+            try:
+                return comparator(actual, expect)
+            except NFTestAssertionError:
+                raise
+            except Exception as error:
+                # A broken plugin fails its case rather than the run
+                raise NFTestAssertionError(
+                    f"assert method {self.method} raised"
+                    f" {type(error).__name__}: {error}"
+                ) from error
+            finally:
+                # Plugins read the files themselves, so credit them with
+                # both files
+                try:
+                    count_hashed(actual.stat().st_size + expect.stat().st_size)
+                except OSError:
+                    pass
+
+        return plugin_function
+
+
+class ScriptBatch:
+    """
+    Compare many file pairs with a single run of a comparison script.
+
+    The script is started with no arguments and receives one JSON object per
+    line on stdin, `{"id": 0, "actual": "...", "expect": "..."}`, until stdin
+    is closed. For each pair it must print one JSON object per line to
+    stdout, in any order: `{"id": 0, "passed": true, "message": "..."}`,
+    where `message` is optional. Any other output is logged. A pair without a
+    valid result, whose `id` is one that was sent and whose `passed` is a
+    boolean, fails.
+    """
+
+    def __init__(self, script: str, assertions: List[NFTestAssert]):
+        """Constructor"""
+        self._logger = getLogger("NFTest")
+        self._lock = threading.Lock()
+        self._results: Optional[Dict[Tuple[str, str], dict]] = None
+        self.script = script
+        self.assertions = assertions
+
+    @property
+    def timeout(self) -> Optional[float]:
+        """The longest timeout of the assertions, or None if any is unlimited."""
+        timeouts = [assertion.timeout for assertion in self.assertions]
+        if None in timeouts:
+            return None
+        return max(timeouts)
+
+    @classmethod
+    def attach(cls, assertions: List[NFTestAssert]) -> List["ScriptBatch"]:
+        """Group batch-mode assertions by script and attach a batch to each."""
+        groups: Dict[str, List[NFTestAssert]] = {}
+        for assertion in assertions:
+            if assertion.script is not None and assertion.batch:
+                groups.setdefault(assertion.script, []).append(assertion)
+
+        batches = []
+        for script, members in groups.items():
+            batch = cls(script, members)
+            for assertion in members:
+                assertion.script_batch = batch
+            batches.append(batch)
+
+        return batches
+
+    def result(self, actual: Path, expect: Path) -> dict:
+        """Return the script's result for this pair, running it if needed."""
+        with self._lock:
+            if self._results is None:
+                self._results = self._run()
+
+        return self._results.get(
+            (str(actual), str(expect)),
+            {"passed": False, "message": f"{self.script} returned no result"},
+        )
 
-        self._logger.error("assert method %s unknown.", self.method)
-        raise NFTestAssertionError(f"assert method {self.method} unknown.")
+    def _run(self) -> Dict[Tuple[str, str], dict]:
+        """Run the script once over every pair that can be compared."""
+        pairs = []
+        for assertion in self.assertions:
+            try:
+                pairs.append(tuple(str(path) for path in assertion.resolve_paths()))
+            except NFTestAssertionError:
+                # This assertion will raise the same error when it is performed
+                continue
+
+        self._logger.debug("%s (batch of %d pairs)", self.script, len(pairs))
+
+        results = {}
+
+        def record_result(line):
+            try:
+                result = json.loads(line)
+            except ValueError:
+                self._logger.debug(line)
+                return
+
+            if not isinstance(result, dict) or "id" not in result:
+                self._logger.debug(line)
+                return
+
+            # A bool is an int, and a negative id would index from the end
+            pair_id, passed = result["id"], result.get("passed")
+            if (
+                type(pair_id) is not int  # pylint: disable=unidiomatic-typecheck
+                or not 0 <= pair_id < len(pairs)
+                or not isinstance(passed, bool)
+            ):
+                self._logger.warning("%s returned an invalid result: %s", self.script, line)
+                return
+
+            results[pairs[pair_id]] = result
+
+        # Results are consumed as they are streamed back
+        timeout = self.timeout
+        try:
+            process = popen_with_logger(
+                [self.script],
+                logger=self._logger,
+                stdin_data="".join(
+                    json.dumps({"id": index, "actual": actual, "expect": expect}) + "\n"
+                    for index, (actual, expect) in enumerate(pairs)
+                ).encode("utf-8"),
+                stdout_handler=record_result,
+                timeout=timeout,
+                start_new_session=timeout is not None,
+            )
+        except subprocess.TimeoutExpired as error:
+            raise ScriptTimeoutError(self.script, timeout) from error
+
+        if process.returncode != 0:
+            self._logger.error(
+                "%s exited with code %d", self.script, process.returncode
+            )
+
+        return results
@@ -9,17 +9,39 @@ import shlex
 import shutil
 import subprocess as sp
 import threading
+import time
 
-from contextlib import ExitStack
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
-from typing import Callable, List, TYPE_CHECKING, Tuple
-
-from nftest.common import remove_nextflow_logs, popen_with_logger, TestResult
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TYPE_CHECKING,
+    Tuple,
+    Union,
+)
+
+from nftest.common import (
+    CHECKSUM_ALGORITHMS,
+    remove_nextflow_logs,
+    popen_with_logger,
+    TestResult,
+)
+from nftest.NFTestAssert import ScriptBatch, ScriptTimeoutError
 from nftest.NFTestENV import NFTestENV
-from nftest.syslog import SyslogServer
+from nftest.resources import ResourceSampler
+from nftest.scheduler import memory_bytes
+from nftest.session import SharedSession
+from nftest.syslog import SyslogReceiver
+from nftest.trace import TRACE_FILE_NAME, read_trace, summarize_trace
+from nftest.watch import OutputChecksums, OutputWatcher
 
 
 if TYPE_CHECKING:
+    from nftest.incremental import IncrementalState
     from nftest.NFTestGlobal import NFTestGlobal
     from nftest.NFTestAssert import NFTestAssert
 
@@ -28,15 +50,19 @@ class NFTestCase:
     """Defines the NF test case"""
 
     # pylint: disable=too-many-instance-attributes
-    def __init__(
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
         self,
         name: str = None,
         message: str = None,
         nf_script: str = None,
         nf_configs: List[str] = None,
         profiles: List[str] = None,
+        cpus: int = None,
+        memory: Union[int, str] = None,
+        timeout: float = None,
         params_file: str = None,
         reference_params: List[Tuple[str, str]] = None,
+        reference_files: List[Dict[str, str]] = None,
         output_directory_param_name: str = "output_dir",
         asserts: List[NFTestAssert] = None,
         temp_dir: str = None,
@@ -57,7 +83,13 @@ class NFTestCase:
         self.nf_script = nf_script
         self.nf_configs = nf_configs or []
         self.reference_params = reference_params or []
+        self.reference_files = reference_files or []
         self.profiles = profiles or []
+        # Resources that the case needs, for scheduling parallel cases
+        self.cpus = cpus
+        self.memory = memory_bytes(memory)
+        # Seconds that Nextflow may run before it is killed, if limited
+        self.timeout = timeout
         self.params_file = params_file
         self.output_directory_param_name = output_directory_param_name
         self.asserts = self.resolve_actual(asserts)
@@ -67,6 +99,28 @@ class NFTestCase:
         self.skip = skip
         self.verbose = verbose
         self.status = TestResult.PENDING
+        self.launch_dir: Optional[Path] = None
+        self.syslog_receiver: Optional[SyslogReceiver] = None
+        # Whether to hash asserted outputs as soon as Nextflow writes them
+        self.watch_outputs = False
+        # The files and bytes hashed while Nextflow ran, if watched
+        self.watched_outputs: Optional[Dict[str, int]] = None
+        # Set by the runner to stop this case once too many cases have failed
+        self.cancel_event: Optional[threading.Event] = None
+        self.shared_session: Optional[SharedSession] = None
+        self.incremental: Optional[IncrementalState] = None
+        self.cached = False
+        # Seconds spent in each phase of the test
+        self.timings: Dict[str, float] = {}
+        # Seconds between samples of Nextflow's resource usage, if sampled
+        self.resource_interval: Optional[float] = None
+        self.resource_usage: Optional[dict] = None
+        # Whether to ask Nextflow for a trace, and how many tasks to summarize
+        self.trace = False
+        self.trace_top = 10
+        self.trace_summary: Optional[dict] = None
+        # The type and message of the error that failed the test, if any
+        self.failure: Optional[Dict[str, str]] = None
 
     def resolve_actual(self, asserts: List[NFTestAssert] = None):
         """Resolve the file path for actual file"""
@@ -88,10 +142,15 @@ class NFTestCase:
             # pylint: disable=E1102
             self.print_prolog()
             result = func(self)
-            if self.remove_temp:
-                shutil.rmtree(self.temp_dir, ignore_errors=True)
-            if self.clean_logs:
-                remove_nextflow_logs()
+            # A shared session is cleaned up once every case has finished
+            if self.shared_session is None:
+                with self.timed("cleanup"):
+                    if self.remove_temp:
+                        shutil.rmtree(self.temp_dir, ignore_errors=True)
+                    if self.clean_logs:
+                        remove_nextflow_logs(self.launch_dir or Path("."))
+                    if self.remove_temp and self.launch_dir is not None:
+                        self.remove_launch_dir()
 
             return result
 
@@ -100,80 +159,149 @@ class NFTestCase:
     @test_wrapper
     def test(self) -> bool:
         """Run test cases."""
-        if self.skip:
-            self._logger.info(" [ skipped ]")
-            self.status = TestResult.SKIPPED
+        if self.not_needed() or self.cancelled():
+            return True
+
+        try:
+            with self.watching_outputs():
+                nextflow_process = self.submit()
+        except sp.TimeoutExpired:
+            self._logger.error("Nextflow did not finish within %s seconds", self.timeout)
+            self._logger.error(" [ timed out ]")
+            self.status = TestResult.TIMEOUT
+            self.failure = {
+                "type": "TimeoutExpired",
+                "message": f"Nextflow did not finish within {self.timeout} seconds",
+            }
+            return False
+
+        if nextflow_process.returncode != 0 and self.cancelled():
             return True
 
-        nextflow_process = self.submit()
         if nextflow_process.returncode != 0:
             self.status = TestResult.ERRORED
+            self.failure = {
+                "type": "NextflowError",
+                "message": f"Nextflow exited with code {nextflow_process.returncode}",
+            }
             self._logger.error(" [ failed ]")
             return False
 
+        # Batch-mode scripts run once for all of their assertions
+        ScriptBatch.attach(self.asserts)
+
         for assertion in self.asserts:
             try:
-                assertion.perform_assertions()
+                with self.timed("script_asserts" if assertion.script else "asserts"):
+                    assertion.perform_assertions()
             except Exception as error:
                 self._logger.error(error.args)
-                self._logger.error(" [ failed ]")
-                self.status = TestResult.FAILED
+                if isinstance(error, ScriptTimeoutError):
+                    self._logger.error(" [ timed out ]")
+                    self.status = TestResult.TIMEOUT
+                else:
+                    self._logger.error(" [ failed ]")
+                    self.status = TestResult.FAILED
+                self.failure = {"type": type(error).__name__, "message": str(error)}
                 raise error
         self._logger.info(" [ succeed ]")
         self.status = TestResult.PASSED
         return True
 
-    def submit(self) -> sp.CompletedProcess:
-        """Submit a nextflow run"""
-        # Use ExitStack to handle the multiple nested context managers
-        with ExitStack() as stack:
-            # Create a server with a random port to accept syslogs from
-            # Nextflow
-            syslog_server = stack.enter_context(SyslogServer.make_server())
-
-            # Shut down the server when we exit this context manager
-            stack.callback(syslog_server.shutdown)
-
-            # Run the server in a thread. This thread will die once
-            # serve_forever returns, which will happen after a call to
-            # syslog_server.shutdown()
-            threading.Thread(
-                name="SyslogThread",
-                target=syslog_server.serve_forever,
-                kwargs={"poll_interval": 1},
-            ).start()
-
-            syslog_address = ":".join(
-                str(item) for item in syslog_server.server_address
-            )
+    @contextmanager
+    def watching_outputs(self) -> Iterator[None]:
+        """Hash the outputs of checksum assertions while Nextflow runs."""
+        patterns = [
+            (os.path.abspath(assertion.actual), assertion.method)
+            for assertion in self.asserts
+            if assertion.script is None and assertion.method in CHECKSUM_ALGORITHMS
+        ]
+        if not self.watch_outputs or not patterns:
+            yield
+            return
+
+        checksums = OutputChecksums()
+        for assertion in self.asserts:
+            assertion.output_checksums = checksums
+
+        # The directory, like the globs and the paths that assertions look
+        # up, is made absolute without resolving symlinks, so that the paths
+        # that the watcher reports match them
+        watcher = OutputWatcher(
+            Path(os.path.abspath(Path(self._env.NFT_OUTPUT, self.name_for_output))),
+            patterns,
+            checksums,
+        )
+        with watcher:
+            yield
+
+        self.watched_outputs = {
+            "files_hashed": watcher.files_hashed,
+            "bytes_hashed": watcher.bytes_hashed,
+        }
+        self._logger.info(
+            "Hashed %d outputs (%d bytes) while Nextflow ran%s",
+            watcher.files_hashed,
+            watcher.bytes_hashed,
+            " (polling)" if watcher.poll else "",
+        )
 
-            nextflow_command = [
-                "nextflow",
-                "-quiet",
-                "-syslog",
-                syslog_address,
-                "run",
-                self.nf_script,
-            ]
+    def not_needed(self) -> bool:
+        """Mark the case as skipped, or as passed if its result is cached."""
+        if self.skip:
+            self._logger.info(" [ skipped ]")
+            self.status = TestResult.SKIPPED
+            return True
 
-            if self.profiles:
-                nextflow_command.extend(["-profile", ",".join(self.profiles)])
+        if self.incremental is not None and self.incremental.is_passing(self):
+            self._logger.info(" [ succeed (cached) ]")
+            self.cached = True
+            self.status = TestResult.PASSED
+            return True
 
-            for config in self.nf_configs:
-                nextflow_command.extend(["-c", config])
+        return False
 
-            if self.params_file:
-                nextflow_command.extend(["-params-file", self.params_file])
+    def cancelled(self) -> bool:
+        """Mark the case as not run if the runner has cancelled it."""
+        if self.cancel_event is None or not self.cancel_event.is_set():
+            return False
 
-            for param_name, path in self.reference_params:
-                nextflow_command.extend([f"--{param_name}", path])
+        self._logger.warning(" [ not run ]")
+        self.status = TestResult.NOT_RUN
+        return True
 
-            nextflow_command.extend([
-                f"--{self.output_directory_param_name}",
-                Path(self._env.NFT_OUTPUT, self.name_for_output),
-            ])
+    def submit(self) -> sp.CompletedProcess:
+        """Submit a nextflow run"""
+        # Use ExitStack to handle the multiple nested context managers
+        with ExitStack() as stack:
+            # Use the runner's syslog receiver if there is one, otherwise
+            # start a receiver just for this case
+            receiver = self.syslog_receiver
+            if receiver is None:
+                receiver = stack.enter_context(SyslogReceiver())
+
+            # Open a channel with a random port to accept syslogs from
+            # Nextflow, and close it when we exit this context manager
+            channel = receiver.open_channel(self.name)
+            stack.callback(receiver.close_channel, channel)
+
+            if self.launch_dir:
+                # Nextflow is launched from another directory, so every
+                # relative path must be resolved against the current one
+                self.launch_dir.mkdir(parents=True, exist_ok=True)
+                resolve = os.path.abspath
+            else:
+                resolve = str
+
+            trace_path = Path(self._env.NFT_OUTPUT, self.name_for_output, TRACE_FILE_NAME)
+            nextflow_command = self.nextflow_command(
+                ":".join(str(item) for item in channel.address),
+                self.join_shared_session(stack),
+                trace_path,
+                resolve,
+            )
 
-            envmod = {"NXF_WORK": self.temp_dir}
+            envmod = {"NXF_WORK": resolve(self.temp_dir)}
 
             # Log the shell equivalent of this command
             self._logger.info(
@@ -182,12 +310,151 @@ class NFTestCase:
                 sp.list2cmdline(nextflow_command),
             )
 
-            process = popen_with_logger(
-                nextflow_command, env={**os.environ, **envmod}, logger=self._nflogger
-            )
+            on_start = None
+            if self.resource_interval:
+                sampler = ResourceSampler(self.resource_interval)
+                stack.callback(self.record_resource_usage, sampler)
+                on_start = sampler.start
+
+            start_time = time.monotonic()
+            process = self.run_nextflow(nextflow_command, envmod, on_start)
+            end_time = time.monotonic()
+
+        if self.trace:
+            self.read_trace(trace_path)
+
+        # The first syslog message marks the end of JVM and Nextflow startup
+        if channel.first_message is not None:
+            self.timings["startup"] = channel.first_message - start_time
+            self.timings["pipeline"] = end_time - channel.first_message
+        else:
+            self.timings["pipeline"] = end_time - start_time
 
         return process
 
+    def join_shared_session(self, stack: ExitStack) -> List[str]:
+        """
+        Hold the shared session, if any, until the stack exits.
+
+        Only one case at a time may use a shared session. Returns the
+        arguments that resume Nextflow in it.
+        """
+        if self.shared_session is None:
+            return []
+
+        return stack.enter_context(self.shared_session.run())
+
+    def nextflow_command(
+        self,
+        syslog_address: str,
+        resume_args: List[str],
+        trace_path: Path,
+        resolve: Callable[[Union[str, Path]], str],
+    ) -> List[str]:
+        """Return the command that runs this case's pipeline."""
+        nextflow_command = [
+            "nextflow",
+            "-quiet",
+            "-syslog",
+            syslog_address,
+            "run",
+            resolve(self.nf_script),
+            *resume_args,
+        ]
+
+        if self.trace:
+            # Nextflow refuses to overwrite an existing trace file
+            if trace_path.exists():
+                trace_path.unlink()
+            nextflow_command.extend(["-with-trace", resolve(trace_path)])
+
+        if self.profiles:
+            nextflow_command.extend(["-profile", ",".join(self.profiles)])
+
+        for config in self.nf_configs:
+            nextflow_command.extend(["-c", resolve(config)])
+
+        if self.params_file:
+            nextflow_command.extend(["-params-file", resolve(self.params_file)])
+
+        for param_name, path in self.reference_params:
+            nextflow_command.extend([f"--{param_name}", resolve(path)])
+
+        nextflow_command.extend([
+            f"--{self.output_directory_param_name}",
+            resolve(Path(self._env.NFT_OUTPUT, self.name_for_output)),
+        ])
+
+        return nextflow_command
+
+    def run_nextflow(
+        self,
+        nextflow_command: List[str],
+        envmod: Dict[str, str],
+        on_start: Optional[Callable],
+    ) -> sp.CompletedProcess:
+        """
+        Run Nextflow until it exits, is cancelled, or runs out of time.
+
+        Raises subprocess.TimeoutExpired if the case has a timeout and
+        Nextflow is still running when it expires.
+        """
+        # Nextflow and its tasks are started in their own process group,
+        # so that all of them can be stopped if the case is cancelled
+        return popen_with_logger(
+            nextflow_command,
+            env={**os.environ, **envmod},
+            cwd=self.launch_dir,
+            logger=self._nflogger,
+            on_start=on_start,
+            timeout=self.timeout,
+            cancel=self.cancel_event,
+            start_new_session=(
+                self.cancel_event is not None or self.timeout is not None
+            ),
+        )
+
+    def read_trace(self, trace_path: Path) -> None:
+        """Summarize the trace file written by Nextflow."""
+        try:
+            tasks = read_trace(trace_path)
+        except OSError as error:
+            self._logger.warning("Unable to read trace file: %s", error)
+            return
+
+        self.trace_summary = summarize_trace(tasks, self.trace_top)
+        self._logger.info(
+            "%d tasks (%d cached); slowest:",
+            self.trace_summary["tasks"],
+            self.trace_summary["cached"],
+        )
+        for task in self.trace_summary["slowest"]:
+            self._logger.info("  %8.1fs  %s", task["realtime"], task["name"])
+
+    def record_resource_usage(self, sampler: ResourceSampler) -> None:
+        """Stop sampling and keep the resource usage of the Nextflow run."""
+        sampler.stop()
+        self.resource_usage = {
+            "summary": sampler.summary(),
+            "samples": sampler.samples,
+        }
+        self._logger.info(
+            "Nextflow peak RSS %.1f MiB, %.1f CPU seconds",
+            self.resource_usage["summary"]["peak_rss_bytes"] / 2**20,
+            self.resource_usage["summary"]["cpu_seconds"],
+        )
+
+    @contextmanager
+    def timed(self, phase: str) -> Iterator[None]:
+        """Add the time spent in this context to the named phase."""
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[phase] = (
+                self.timings.get(phase, 0.0) + time.monotonic() - start_time
+            )
+
     def combine_global(self, _global: NFTestGlobal) -> None:
         """Combine test case configs with the global configs."""
         if _global.nf_config:
@@ -205,6 +472,51 @@ class NFTestCase:
         if self.clean_logs is None:
             self.clean_logs = _global.clean_logs
 
+        if self.timeout is None:
+            self.timeout = _global.timeout
+
+        # Assertion scripts are limited like the case unless they say otherwise
+        for assertion in self.asserts:
+            if assertion.timeout is None:
+                assertion.timeout = self.timeout
+
+    def isolate_directories(self) -> None:
+        """
+        Give this case private launch and work directories.
+
+        Required when cases run concurrently: Nextflow keeps its `.nextflow*`
+        state in the launch directory, and `remove_temp` deletes the whole
+        work directory.
+        """
+        case_root = Path(self.temp_dir, self.name_for_output)
+        self.launch_dir = case_root / "launch"
+        self.temp_dir = str(case_root / "work")
+
+    def remove_launch_dir(self) -> None:
+        """
+        Remove the Nextflow state in the private launch directory.
+
+        The Nextflow logs are kept unless `clean_logs` is set, along with the
+        directories that hold them.
+        """
+        shutil.rmtree(self.launch_dir / ".nextflow", ignore_errors=True)
+        for directory in (self.launch_dir, self.launch_dir.parent):
+            try:
+                directory.rmdir()
+            except OSError:
+                break
+
+    def share_session(self, session: SharedSession) -> None:
+        """
+        Launch this case in a session shared with other cases.
+
+        Tasks already run by an earlier case with the same inputs are
+        resumed from the shared work directory rather than run again.
+        """
+        self.shared_session = session
+        self.launch_dir = session.launch_dir
+        self.temp_dir = str(session.work_dir)
+
     def print_prolog(self):
         """Print prolog message"""
         prolog = f"{self.name}: {self.message}"
@@ -19,6 +19,8 @@ class NFTestENV(metaclass=Singleton):
     NFT_TESTDIR: str = field(init=False)
     NFT_LOG_LEVEL: str = field(init=False)
     NFT_LOG: str = field(init=False)
+    NFT_CACHE: str = field(init=False)
+    NFT_HISTORY: str = field(init=False)
     test_yaml: InitVar[str] = None
 
     def __post_init__(self, test_yaml: str = None):
@@ -40,6 +42,12 @@ class NFTestENV(metaclass=Singleton):
                 f'log-nftest-{datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")}.log',
             ),
         )
+        self.NFT_CACHE = os.getenv(
+            "NFT_CACHE", default=os.path.join(self.NFT_TEMP, ".nftest")
+        )
+        self.NFT_HISTORY = os.getenv(
+            "NFT_HISTORY", default=os.path.join(self.NFT_CACHE, "history.json")
+        )
 
     @staticmethod
     def load_env(yaml_dir: str = None):
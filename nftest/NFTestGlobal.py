@@ -1,6 +1,7 @@
 """Global settings"""
 
 import os
+from typing import Optional
 from nftest.NFTestENV import NFTestENV
 
 
@@ -15,6 +16,8 @@ class NFTestGlobal:
         nf_config: str,
         remove_temp: bool = True,
         clean_logs: bool = True,
+        shared_work: bool = False,
+        timeout: Optional[float] = None,
     ):
         """constructor"""
         self._env = NFTestENV()
@@ -22,3 +25,5 @@ class NFTestGlobal:
         self.nf_config = os.path.join(self._env.NFT_TESTDIR, nf_config)
         self.remove_temp = remove_temp
         self.clean_logs = clean_logs
+        self.shared_work = shared_work
+        self.timeout = timeout
@@ -3,11 +3,12 @@
 import datetime
 import json
 import os
+import threading
 
 from contextlib import contextmanager
 from dataclasses import dataclass, field, asdict
 from pathlib import Path
-from typing import Dict
+from typing import ClassVar, Dict, List, Optional
 
 from nftest.common import TestResult
 from nftest.NFTestCase import NFTestCase
@@ -35,36 +36,139 @@ class NFTestReport:
     errored_tests: Dict[str, float] = field(default_factory=dict)
     failed_tests: Dict[str, float] = field(default_factory=dict)
 
+    # Tests that were stopped because they ran out of time
+    timed_out_tests: Dict[str, float] = field(default_factory=dict)
+
+    # Tests that were not started, or were stopped, once too many had failed
+    not_run_tests: Dict[str, float] = field(default_factory=dict)
+
+    # Passed tests that were not run because their inputs had not changed
+    cached_tests: List[str] = field(default_factory=list)
+
+    # Time spent in each phase of each test, and by each of its assertions
+    timings: Dict[str, dict] = field(default_factory=dict)
+
+    # Resource usage of each test's Nextflow process tree, if sampled
+    resources: Dict[str, dict] = field(default_factory=dict)
+
+    # Summaries of the Nextflow trace of each test, if traced
+    traces: Dict[str, dict] = field(default_factory=dict)
+
+    # Time and bytes spent validating reference files before any test ran
+    reference_validation: Dict[str, float] = field(default_factory=dict)
+
+    # The type and message of the error that failed each failed test
+    failures: Dict[str, Dict[str, str]] = field(default_factory=dict)
+
+    # This shard of a sharded run, as `index/count`
+    shard: Optional[str] = None
+
+    # Cases may finish concurrently and in any order
+    _lock: ClassVar[threading.Lock] = threading.Lock()
+
+    # The file that each test's record is appended to, if any
+    _stream_path: Optional[Path] = field(default=None, repr=False, compare=False)
+
     def __bool__(self):
         return not self.failed_tests
 
     @contextmanager
     def track_test(self, test: NFTestCase):
         """Context manager to track test statuses and runtimes."""
-        start_time = datetime.datetime.now()
+        start_time = datetime.datetime.now(tz=datetime.timezone.utc)
 
         result_map = {
             TestResult.PASSED: self.passed_tests,
             TestResult.SKIPPED: self.skipped_tests,
             TestResult.ERRORED: self.errored_tests,
             TestResult.FAILED: self.failed_tests,
+            TestResult.NOT_RUN: self.not_run_tests,
+            TestResult.TIMEOUT: self.timed_out_tests,
             TestResult.PENDING: {}
         }
 
         try:
             yield
         finally:
-            duration = (datetime.datetime.now() - start_time).total_seconds()
-            result_map[test.status][test.name] = duration
+            duration = (
+                datetime.datetime.now(tz=datetime.timezone.utc) - start_time
+            ).total_seconds()
+            with self._lock:
+                result_map[test.status][test.name] = duration
+                if test.cached:
+                    self.cached_tests.append(test.name)
+                if test.failure is not None:
+                    self.failures[test.name] = test.failure
+                self.timings[test.name] = {
+                    "total": duration,
+                    "phases": dict(test.timings),
+                    "asserts": [
+                        {
+                            "actual": assertion.actual,
+                            "expect": assertion.expect,
+                            "method": assertion.method,
+                            **assertion.timing,
+                        }
+                        for assertion in test.asserts
+                        if assertion.timing
+                    ],
+                }
+                if test.watched_outputs is not None:
+                    self.timings[test.name]["watched_outputs"] = test.watched_outputs
+                if test.resource_usage is not None:
+                    self.resources[test.name] = test.resource_usage
+                if test.trace_summary is not None:
+                    self.traces[test.name] = test.trace_summary
+
+                if self._stream_path is not None:
+                    self._append_case(test.name, test.status, start_time)
+
+    def stream_to(self, path: Path):
+        """
+        Append a line of JSON to the given file as each test finishes.
+
+        The file is replaced. Each line is a case record (see case_record),
+        so the results of finished tests survive a run that never finishes.
+        """
+        self._stream_path = Path(path)
+        self._stream_path.write_text("", encoding="utf-8")
+
+    def case_record(
+        self, name: str, status: TestResult, start: Optional[datetime.datetime] = None
+    ) -> dict:
+        """Return everything the report knows about a single test."""
+        return {
+            "name": name,
+            "status": status.name,
+            "start": start,
+            "duration": self.timings.get(name, {}).get("total"),
+            "cached": name in self.cached_tests,
+            "failure": self.failures.get(name),
+            "shard": self.shard,
+            "timings": self.timings.get(name),
+            "resources": self.resources.get(name),
+            "trace": self.traces.get(name),
+        }
+
+    def _append_case(
+        self, name: str, status: TestResult, start: datetime.datetime
+    ):
+        """Append the record of a finished test to the stream file."""
+        line = json.dumps(self.case_record(name, status, start), cls=DateEncoder)
+        with self._stream_path.open(mode="at", encoding="utf-8") as outfile:
+            outfile.write(line + "\n")
 
     def write_report(self, reportfile: Path):
         """Write the report out to the given file."""
         data = asdict(self)
+        del data["_stream_path"]
 
         # Add extra parameters
         data["cpus"] = os.cpu_count()
         data["end"] = datetime.datetime.now(tz=datetime.timezone.utc)
-        data["success"] = not self.failed_tests and not self.errored_tests
+        data["success"] = not (
+            self.failed_tests or self.errored_tests or self.timed_out_tests
+        )
 
         with reportfile.open(mode="wt", encoding="utf-8") as outfile:
             json.dump(data, outfile, indent=2, cls=DateEncoder)
@@ -2,28 +2,77 @@
 
 import shutil
 import os
+import signal
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from logging import getLogger
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 import yaml
+from nftest.history import CaseHistory, makespan
+from nftest.incremental import IncrementalState
 from nftest.NFTestGlobal import NFTestGlobal
 from nftest.NFTestAssert import NFTestAssert, NFTestAssertionError
 from nftest.NFTestCase import NFTestCase
 from nftest.NFTestENV import NFTestENV
 from nftest.NFTestReport import NFTestReport
-from nftest.common import validate_yaml, validate_reference
+from nftest.scheduler import ResourceScheduler
+from nftest.session import SharedSession
+from nftest.syslog import SyslogReceiver
+from nftest.common import (
+    TestResult,
+    format_duration,
+    validate_yaml,
+    validate_reference_name,
+    validate_references,
+)
 
 
 class NFTestRunner:
     """This holds all test cases and global settings from a single yaml file."""
 
-    def __init__(self, cases: List[NFTestCase] = None, report: bool = False):
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        cases: List[NFTestCase] = None,
+        report: bool = False,
+        jobs: int = 1,
+        incremental: bool = False,
+        resource_interval: float = 0,
+        trace_top: Optional[int] = None,
+        max_cpus: Optional[int] = None,
+        max_memory: Optional[int] = None,
+        shard: Optional[Tuple[int, int]] = None,
+        max_failures: Optional[int] = None,
+        watch_outputs: bool = False,
+        repetition: bool = False,
+    ):
         """Constructor"""
         self._global = None
         self._env = NFTestENV()
         self._logger = getLogger("NFTest")
         self.cases = cases or []
         self.save_report = report
+        self.jobs = max(1, jobs)
+        self.incremental = incremental
+        self.resource_interval = resource_interval
+        self.trace_top = trace_top
+        self.report: Optional[NFTestReport] = None
+        self.max_cpus = max_cpus
+        self.max_memory = max_memory
+        # The 1-based index of this shard, and the number of shards
+        self.shard = shard
+        # Stop once this many cases have failed, if set
+        self.max_failures = max_failures
+        self.watch_outputs = watch_outputs
+        # Set for repeated runs of the same cases, as by `nftest bench`: the
+        # prolog is not printed and NFT_HISTORY is not updated
+        self.repetition = repetition
+        # Set to stop the running cases and start no more
+        self.cancel = threading.Event()
 
     def combine_with_dir(self, path_to_combine: str, base_dir: str):
         """ Combine given path with NFT_INIT """
@@ -72,10 +121,17 @@ class NFTestRunner:
                     if case.get("params_file", None) else None
                 )
 
+                # The reference checksums are validated later, once the
+                # cases to run are known
                 if "reference_files" in case:
+                    for reference_file in case["reference_files"]:
+                        validate_reference_name(reference_file["reference_parameter_name"])
                     case["reference_params"] = [
-                        validate_reference(**reference_file)
-                        for reference_file in case.pop("reference_files")
+                        (
+                            reference_file["reference_parameter_name"],
+                            reference_file["reference_parameter_path"],
+                        )
+                        for reference_file in case["reference_files"]
                     ]
                 test_case = NFTestCase(**case)
                 test_case.combine_global(self._global)
@@ -88,31 +144,430 @@ class NFTestRunner:
 
     def main(self) -> int:
         """Main entrance"""
-        self.print_prolog()
+        if not self.repetition:
+            self.print_prolog()
 
-        failure_count = 0
+        history = CaseHistory()
+        if self.shard is not None:
+            self.select_shard(history)
+
+        self.report = self.setup_report()
+        incremental_state = self.setup_incremental()
+        shared_session = self.setup_shared_session()
+
+        self.check_output_names()
+        scheduler = self.setup_scheduler(shared_work=shared_session is not None)
+
+        pending = list(self.cases)
+        if self.jobs > 1:
+            # Start the longest cases first so that none is left running alone
+            pending = history.longest_first(pending)
+
+        estimates = history.estimates(case.name for case in self.cases if not case.skip)
+        if any(estimates.values()):
+            self._logger.info(
+                "Expected to finish in %s",
+                format_duration(makespan(
+                    (estimates.get(case.name, 0.0) for case in pending), self.jobs
+                )),
+            )
+
+        # All cases share a single syslog receiver
+        with ExitStack() as cleanup, SyslogReceiver() as syslog_receiver, ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="NFTestWorker"
+        ) as executor:
+            cleanup.enter_context(self.cancel_on_signals())
+            if shared_session is not None:
+                # Clean up once every case has stopped, even after an error
+                cleanup.callback(
+                    shared_session.close,
+                    remove_temp=self._global.remove_temp,
+                    clean_logs=self._global.clean_logs,
+                )
+
+            self.setup_cases(syslog_receiver)
+
+            try:
+                failure_count = self.dispatch(executor, scheduler, pending, estimates)
+            except BaseException:
+                # Don't leave Nextflow running, as it no longer shares the
+                # terminal's process group
+                self.cancel.set()
+                raise
+
+        self.finalize(pending, failure_count, history, incremental_state)
+
+        return failure_count
+
+    def setup_report(self) -> NFTestReport:
+        """Create the report of this run and validate the references."""
         report = NFTestReport()
+        if self.shard is not None:
+            report.shard = f"{self.shard[0]}/{self.shard[1]}"
+        if self.save_report:
+            report.stream_to(self.report_path(".cases.jsonl"))
+        report.reference_validation = self.validate_references()
+
+        return report
+
+    def setup_incremental(self) -> Optional[IncrementalState]:
+        """Load the incremental state for the cases, if enabled."""
+        if not self.incremental:
+            return None
+
+        incremental_state = IncrementalState()
+        self._logger.info(
+            "Skipping cases that passed with the same inputs (%s)",
+            incremental_state.path,
+        )
+        for case in self.cases:
+            case.incremental = incremental_state
+
+        return incremental_state
+
+    def setup_shared_session(self) -> Optional[SharedSession]:
+        """Share one Nextflow session between the cases, if configured."""
+        if self._global is None or not self._global.shared_work:
+            return None
+
+        shared_session = SharedSession(Path(self._global.temp_dir, "shared"))
+        self._logger.info(
+            "Cases share the Nextflow session in %s", shared_session.root
+        )
+        for case in self.cases:
+            if case.temp_dir != self._global.temp_dir or (
+                bool(case.remove_temp) != bool(self._global.remove_temp)
+            ):
+                self._logger.warning(
+                    "%s: shared_work ignores the case's temp_dir and remove_temp",
+                    case.name,
+                )
+            case.share_session(shared_session)
+
+        return shared_session
+
+    def setup_scheduler(self, shared_work: bool) -> ResourceScheduler:
+        """Create the scheduler and prepare the cases to run in parallel."""
+        scheduler = ResourceScheduler(self.max_cpus, self.max_memory, self.jobs)
+        if self.jobs > 1:
+            self._logger.info(
+                "Running up to %d cases in parallel, within %d CPUs and %s memory",
+                self.jobs,
+                scheduler.cpus,
+                "unlimited" if scheduler.memory is None else f"{scheduler.memory} bytes",
+            )
+            scheduler.check(self.cases)
+            if not shared_work:
+                for case in self.cases:
+                    case.isolate_directories()
+
+        return scheduler
+
+    def setup_cases(self, syslog_receiver: SyslogReceiver) -> None:
+        """Apply the run-wide settings to every case."""
+        for case in self.cases:
+            case.syslog_receiver = syslog_receiver
+            case.cancel_event = self.cancel
+            case.watch_outputs = self.watch_outputs
+            case.resource_interval = self.resource_interval
+            if self.trace_top is not None:
+                case.trace = True
+                case.trace_top = self.trace_top
+
+    def dispatch(
+        self,
+        executor: ThreadPoolExecutor,
+        scheduler: ResourceScheduler,
+        pending: List[NFTestCase],
+        estimates: Dict[str, float],
+    ) -> int:
+        """
+        Run the pending cases, returning the number that failed.
+
+        Cases are removed from pending as they start. Once the run is
+        cancelled no more are started, and this returns when the running
+        cases have stopped.
+        """
+        failure_count = 0
+        running: Dict[Future, NFTestCase] = {}
+        start_times: Dict[str, float] = {}
+
+        while running or (pending and not self.cancel.is_set()):
+            self.start_cases(executor, scheduler, pending, running, start_times)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                scheduler.release(running.pop(future))
+                failure_count += future.result()
+
+            self.check_max_failures(failure_count, len(running), len(pending))
+
+            if (
+                any(estimates.values())
+                and (pending or running)
+                and not self.cancel.is_set()
+            ):
+                self.log_progress(
+                    estimates, pending, list(running.values()), start_times
+                )
+
+        return failure_count
+
+    def start_cases(
+        self,
+        executor: ThreadPoolExecutor,
+        scheduler: ResourceScheduler,
+        pending: List[NFTestCase],
+        running: Dict[Future, NFTestCase],
+        start_times: Dict[str, float],
+    ) -> None:
+        """Start pending cases while workers and resources are free."""
+        while pending and len(running) < self.jobs and not self.cancel.is_set():
+            # Start the first case that fits in the free resources
+            case = scheduler.take(pending)
+            if case is None:
+                break
+            start_times[case.name] = time.monotonic()
+            running[executor.submit(self.run_case, case, self.report)] = case
+
+    def check_max_failures(self, failure_count: int, running: int, pending: int) -> None:
+        """Cancel the run once max_failures cases have failed."""
+        if (
+            self.max_failures
+            and failure_count >= self.max_failures
+            and not self.cancel.is_set()
+        ):
+            self._logger.error(
+                "Stopping after %d failed cases; %d running cases"
+                " will be terminated and %d cases will not run",
+                failure_count,
+                running,
+                pending,
+            )
+            self.cancel.set()
+
+    def finalize(
+        self,
+        pending: List[NFTestCase],
+        failure_count: int,
+        history: CaseHistory,
+        incremental_state: Optional[IncrementalState],
+    ) -> None:
+        """Report the cases that never ran and save the results of the run."""
+        report = self.report
+        for case in pending:
+            case.status = TestResult.NOT_RUN
+            with report.track_test(case):
+                pass
+
+        assert failure_count == (
+            len(report.failed_tests)
+            + len(report.errored_tests)
+            + len(report.timed_out_tests)
+        )
+
+        if incremental_state is not None:
+            self._logger.info(
+                "%d cases passed previously and were not run",
+                len(report.cached_tests),
+            )
+            incremental_state.save()
+
+        # Every shard of a run must split the cases using the same history
+        if self.shard is None and not self.repetition:
+            # Cached and skipped cases say nothing about how long a case takes
+            history.record({
+                name: duration
+                for name, duration in {
+                    **report.passed_tests, **report.failed_tests
+                }.items()
+                if name not in report.cached_tests
+            })
+            history.save()
+
+        if self.save_report:
+            report.write_report(self.report_path(".json"))
+
+    def check_output_names(self) -> None:
+        """
+        Check that no two cases that will run share an output directory.
 
+        Cases that run in parallel would overwrite each other's outputs (and,
+        once isolated, temporary directories), so this raises ValueError.
+        Serial cases only overwrite the outputs of a case that has already
+        been checked, so this warns.
+        """
+        output_names: Dict[str, NFTestCase] = {}
         for case in self.cases:
+            if case.skip:
+                continue
+            other = output_names.setdefault(case.name_for_output, case)
+            if other is case:
+                continue
+
+            message = (
+                f"Cases `{other.name}` and `{case.name}` would share the output"
+                f" directory `{case.name_for_output}`"
+            )
+            if self.jobs > 1:
+                raise ValueError(message)
+            self._logger.warning("%s", message)
+
+    @contextmanager
+    def cancel_on_signals(self) -> Iterator[None]:
+        """
+        Stop the running cases if nftest is asked to terminate.
+
+        Nextflow runs in its own session, so signals sent to nftest's process
+        group do not reach it. Instead, SIGTERM and SIGHUP cancel every case,
+        which terminates its Nextflow process tree, and then exit.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            # Signal handlers can only be installed from the main thread
+            yield
+            return
+
+        def handler(signum, _frame):
+            self._logger.error(
+                "Received %s; stopping the running cases", signal.Signals(signum).name
+            )
+            self.cancel.set()
+            raise SystemExit(128 + signum)
+
+        previous = {
+            signum: signal.signal(signum, handler)
+            for signum in (
+                getattr(signal, name)
+                for name in ("SIGTERM", "SIGHUP")
+                if hasattr(signal, name)
+            )
+        }
+        try:
+            yield
+        finally:
+            for signum, old_handler in previous.items():
+                signal.signal(
+                    signum, signal.SIG_DFL if old_handler is None else old_handler
+                )
+
+    def report_path(self, suffix: str) -> Path:
+        """Return the path of a report alongside the log file."""
+        if self.shard is not None:
+            suffix = f".shard-{self.shard[0]}-of-{self.shard[1]}{suffix}"
+        return Path(self._env.NFT_LOG).with_suffix(suffix)
+
+    def select_shard(self, history: CaseHistory) -> None:
+        """Keep only the cases in this shard of the run."""
+        index, count = self.shard
+        digest = history.digest(case.name for case in self.cases if not case.skip)
+        if digest is None:
+            self._logger.info("Splitting cases by name: %s has no durations", history.path)
+        else:
+            # Shards with different histories may run some cases twice and
+            # others not at all
+            self._logger.info(
+                "Splitting cases by duration from %s (digest %s); every shard"
+                " must use the same history",
+                history.path,
+                digest,
+            )
+        shards = history.partition(self.cases, count)
+        self._logger.info(
+            "Running shard %d of %d: %d of %d cases",
+            index,
+            count,
+            len(shards[index - 1]),
+            len(self.cases),
+        )
+        self.cases = shards[index - 1]
+
+    def log_progress(
+        self,
+        estimates: Dict[str, float],
+        pending: List[NFTestCase],
+        running: List[NFTestCase],
+        start_times: Dict[str, float],
+    ) -> None:
+        """Log the number of cases finished and the expected time remaining."""
+        now = time.monotonic()
+        remaining = makespan(
+            (estimates.get(case.name, 0.0) for case in pending),
+            self.jobs,
+            busy=[
+                max(0.0, estimates.get(case.name, 0.0) - (now - start_times[case.name]))
+                for case in running
+            ],
+        )
+        self._logger.info(
+            "%d of %d cases finished, about %s remaining",
+            len(self.cases) - len(pending) - len(running),
+            len(self.cases),
+            format_duration(remaining),
+        )
+
+    def validate_references(self) -> Dict[str, float]:
+        """
+        Validate the reference files of every case that will run.
+
+        Returns the number of files, the seconds taken, and the bytes hashed.
+        """
+        reference_files = [
+            reference_file
+            for case in self.cases
+            if not case.skip
+            for reference_file in case.reference_files
+        ]
+
+        if not reference_files:
+            return {}
+
+        start_time = time.monotonic()
+        hashed = validate_references(reference_files)
+        seconds = time.monotonic() - start_time
+        self._logger.info(
+            "Validated %d reference files in %.1f seconds (%d bytes hashed)",
+            len(reference_files),
+            seconds,
+            hashed,
+        )
+
+        return {
+            "files": len(reference_files),
+            "seconds": seconds,
+            "bytes_hashed": hashed,
+            "bytes_per_second": hashed / seconds if seconds else 0.0,
+        }
+
+    def run_case(self, case: NFTestCase, report: NFTestReport) -> int:
+        """Run a single case, returning the number of failures (0 or 1)."""
+        if self.jobs > 1:
+            # Label the worker thread so that interleaved logs can be traced
+            # back to their case
+            threading.current_thread().name = case.name_for_output
+
+        try:
             with report.track_test(case):
                 try:
                     if not case.test():
-                        failure_count += 1
+                        return 1
                 except NFTestAssertionError as err:
                     # In case of failed test case, continue with other cases
                     self._logger.debug(err)
-                    failure_count += 1
+                    return 1
                 except Exception as err:
                     # Unhandled error
                     self._logger.exception(err)
                     raise
+        finally:
+            if (
+                case.incremental is not None
+                and not case.skip
+                and not case.cached
+                and case.status != TestResult.NOT_RUN
+            ):
+                case.incremental.record(case)
 
-        assert failure_count == len(report.failed_tests) + len(report.errored_tests)
-
-        if self.save_report:
-            report.write_report(Path(self._env.NFT_LOG).with_suffix(".json"))
-
-        return failure_count
+        return 0
 
     def print_prolog(self):
         """Print prolog"""
@@ -1,12 +1,18 @@
 """Module containg Singleton metaclass"""
 
+import threading
+
 
 class Singleton(type):
     """Singleton metaclass"""
 
     _instances = {}
+    # Instances may first be requested from several threads at once
+    _lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
         if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+            with Singleton._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
@@ -2,13 +2,25 @@
 
 from __future__ import annotations
 import argparse
+import json
 import sys
 import os
 from logging import getLogger
 from pathlib import Path
 import shutil
+from typing import Tuple
 import pkg_resources
-from nftest.common import find_config_yaml, print_version_and_exist, setup_loggers
+from nftest.bench import METRICS, Benchmark, compare, read_results, write_results
+from nftest.checksum_cache import ChecksumCache
+from nftest.common import (
+    benchmark_checksums,
+    find_config_yaml,
+    print_version_and_exist,
+    setup_loggers,
+)
+from nftest.logqueue import LogQueueListener
+from nftest.merge import merge_reports
+from nftest.scheduler import memory_bytes
 from nftest.NFTestRunner import NFTestRunner
 from nftest.NFTestENV import NFTestENV
 
@@ -23,6 +35,9 @@ def parse_args() -> argparse.Namespace:
     subparsers = parser.add_subparsers(dest="command")
     add_subparser_init(subparsers)
     add_subparser_run(subparsers)
+    add_subparser_bench(subparsers)
+    add_subparser_report(subparsers)
+    add_subparser_checksum_benchmark(subparsers)
 
     args = parser.parse_args()
 
@@ -69,20 +84,292 @@ def add_subparser_run(subparsers: argparse._SubParsersAction):
         action="store_true",
         help="Save out a detailed JSON test report alongside the log file"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of test cases to run in parallel. Each case is launched"
+        " from its own directory under its temp_dir",
+    )
+    parser.add_argument(
+        "--max-cpus",
+        type=positive_int,
+        default=None,
+        help="CPUs available to parallel cases, which may declare their own"
+        " `cpus`. Defaults to the number of CPUs on this host",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=memory_size,
+        default=None,
+        metavar="SIZE",
+        help="Memory available to parallel cases (such as `64 GB`), which may"
+        " declare their own `memory`. Defaults to the available memory on"
+        " this host",
+    )
+    parser.add_argument(
+        "--watch-outputs",
+        action="store_true",
+        help="Hash the outputs of checksum assertions as soon as Nextflow"
+        " writes them, while the pipeline is still running",
+    )
+    parser.add_argument(
+        "--maxfail",
+        type=positive_int,
+        default=None,
+        metavar="N",
+        help="Stop after N cases fail: terminate the running cases and report"
+        " the rest as not run",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_const",
+        const=1,
+        dest="maxfail",
+        help="Stop after the first case fails. The same as --maxfail 1",
+    )
+    parser.add_argument(
+        "--shard",
+        type=shard_spec,
+        default=None,
+        metavar="I/N",
+        help="Split the cases into N shards of about the same duration and"
+        " run only shard I (from 1). The report is named for the shard",
+    )
+    parser.add_argument(
+        "--no-checksum-cache",
+        action="store_true",
+        help="Hash every reference and expected file instead of reusing"
+        " checksums cached under NFT_CACHE",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip cases that passed in a previous run with the same inputs"
+        " and unchanged outputs, as recorded under NFT_CACHE",
+    )
+    parser.add_argument(
+        "--resource-interval",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Sample the memory, CPU, I/O, and threads of each Nextflow"
+        " process tree at this interval and add them to the report."
+        " 0 disables sampling",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Write a Nextflow trace into each case's output directory and"
+        " add the tasks' runtime, CPU, and memory to the report",
+    )
+    parser.add_argument(
+        "--trace-top",
+        type=int,
+        default=10,
+        metavar="N",
+        help="Number of slowest tasks to summarize for each traced case",
+    )
     parser.add_argument(
         "TEST_CASES", type=str, help="Exact test case to run.", nargs="*"
     )
     parser.set_defaults(func=run)
 
 
-def run(args):
-    """Run"""
+def positive_int(value: str) -> int:
+    """Parse an integer greater than zero"""
+    try:
+        number = int(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid integer `{value}`") from error
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"`{value}` must be greater than zero")
+    return number
+
+
+def memory_size(value: str) -> int:
+    """Parse a memory size such as `64 GB`"""
+    try:
+        size = memory_bytes(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+    if size < 1:
+        raise argparse.ArgumentTypeError(f"`{value}` must be greater than zero")
+    return size
+
+
+def shard_spec(value: str) -> Tuple[int, int]:
+    """Parse an I/N shard"""
+    index, _, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(
+            f"invalid shard `{value}`, expected I/N such as 1/4"
+        ) from error
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            f"invalid shard `{value}`, expected 1 <= I <= N"
+        )
+    return index, count
+
+
+def metric_threshold(value: str) -> Tuple[str, float]:
+    """Parse a METRIC=FRACTION threshold"""
+    metric, _, fraction = value.partition("=")
+    if metric not in METRICS:
+        raise argparse.ArgumentTypeError(
+            f"unknown metric `{metric}`, expected one of {', '.join(METRICS)}"
+        )
+    try:
+        return metric, float(fraction)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid threshold `{fraction}`") from error
+
+
+def add_subparser_bench(subparsers: argparse._SubParsersAction):
+    """Add subparser for bench"""
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        name="bench",
+        help="Benchmark nextflow tests.",
+        description="Run nextflow tests repeatedly, summarize their run time"
+        " and resource usage, and compare them with a baseline.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-c",
+        "--config-file",
+        type=Path,
+        help="Path to the nextflow test config YAML file. If not given, it"
+        " looks for nftest.yaml or nftest.yml",
+        default=None,
+        nargs="?",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=5, help="Number of measured runs"
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Number of runs to discard before measuring",
+    )
+    parser.add_argument(
+        "--resource-interval",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="Interval between samples of each Nextflow process tree",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Path for the results JSON, which can be used as a later baseline."
+        " Defaults to the log file path with a .bench.json suffix",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=None,
+        help="Results JSON from an earlier benchmark to compare against",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative increase in a median over the baseline that counts as"
+        " a regression",
+    )
+    parser.add_argument(
+        "--metric-threshold",
+        type=metric_threshold,
+        action="append",
+        default=[],
+        metavar="METRIC=FRACTION",
+        help="Threshold for a single metric, overriding --threshold. One of: "
+        + ", ".join(METRICS),
+    )
+    parser.add_argument(
+        "--no-checksum-cache",
+        action="store_true",
+        help="Hash every reference and expected file instead of reusing"
+        " checksums cached under NFT_CACHE",
+    )
+    parser.add_argument(
+        "TEST_CASES", type=str, help="Exact test case to run.", nargs="*"
+    )
+    parser.set_defaults(func=bench)
+
+
+def add_subparser_report(subparsers: argparse._SubParsersAction):
+    """Add subparser for report"""
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        name="report",
+        help="Work with test reports.",
+        description="Work with the JSON test reports saved by `nftest run --report`.",
+    )
+    report_subparsers = parser.add_subparsers(dest="report_command")
+    report_subparsers.required = True
+
+    merge_parser: argparse.ArgumentParser = report_subparsers.add_parser(
+        name="merge",
+        help="Merge test reports.",
+        description="Combine test reports, such as those of the shards of a"
+        " run, into one summary and optionally JUnit XML. Reports may be JSON"
+        " reports or the `.cases.jsonl` files written as each case finishes.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    merge_parser.add_argument(
+        "--junit",
+        type=Path,
+        default=None,
+        help="Write every case to this file as JUnit XML",
+    )
+    merge_parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Write the summary to this JSON file instead of standard output",
+    )
+    merge_parser.add_argument(
+        "REPORTS",
+        type=Path,
+        nargs="+",
+        help="Reports to merge",
+    )
+    merge_parser.set_defaults(func=report_merge)
+
+
+def add_subparser_checksum_benchmark(subparsers: argparse._SubParsersAction):
+    """Add subparser for checksum-benchmark"""
+    parser: argparse.ArgumentParser = subparsers.add_parser(
+        name="checksum-benchmark",
+        help="Measure checksum throughput.",
+        description="Measure the hashing throughput of each supported checksum"
+        " algorithm on this host.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=256,
+        help="Number of MiB to hash with each algorithm",
+    )
+    parser.set_defaults(func=checksum_benchmark)
+
+
+def setup_run(args) -> LogQueueListener:
+    """Set up the environment, logging, and caches for running cases"""
     find_config_yaml(args)
 
     # Set up NFTestENV with config path to allow loading .env from same directory
     loaded_env = NFTestENV(test_yaml = args.config_file)
 
-    setup_loggers()
+    log_listener = setup_loggers()
+
+    ChecksumCache(enabled=not args.no_checksum_cache)
 
     _logger = getLogger("NFTest")
 
@@ -96,9 +383,96 @@ def run(args):
     for arg_name, arg_value in vars(args).items():
         _logger.info("`%s`: `%s`", arg_name, arg_value)
 
-    runner = NFTestRunner(report=args.report)
-    runner.load_from_config(args.config_file, args.TEST_CASES)
-    sys.exit(runner.main())
+    return log_listener
+
+
+def run(args):
+    """Run"""
+    log_listener = setup_run(args)
+
+    try:
+        runner = NFTestRunner(
+            report=args.report,
+            jobs=args.jobs,
+            incremental=args.incremental,
+            resource_interval=args.resource_interval,
+            trace_top=args.trace_top if args.trace else None,
+            max_cpus=args.max_cpus,
+            max_memory=args.max_memory,
+            shard=args.shard,
+            max_failures=args.maxfail,
+            watch_outputs=args.watch_outputs,
+        )
+        runner.load_from_config(args.config_file, args.TEST_CASES)
+        exit_code = runner.main()
+    finally:
+        log_listener.stop()
+
+    sys.exit(exit_code)
+
+
+def bench(args):
+    """Benchmark cases and compare them with a baseline"""
+    log_listener = setup_run(args)
+    _logger = getLogger("NFTest")
+
+    try:
+        results = Benchmark(
+            args.config_file,
+            args.TEST_CASES,
+            repeats=args.repeats,
+            warmup=args.warmup,
+            resource_interval=args.resource_interval,
+        ).run()
+
+        if results is None:
+            exit_code = 1
+        else:
+            output = args.output or Path(NFTestENV().NFT_LOG).with_suffix(".bench.json")
+            write_results(output, results)
+            _logger.info("Benchmark results written to %s", output)
+
+            regressions = []
+            if args.baseline:
+                regressions = compare(
+                    results,
+                    read_results(args.baseline),
+                    default_threshold=args.threshold,
+                    thresholds=dict(args.metric_threshold),
+                )
+                for regression in regressions:
+                    _logger.error("Regression: %s", regression)
+                if not regressions:
+                    _logger.info("No regressions from %s", args.baseline)
+
+            exit_code = 1 if regressions else 0
+    finally:
+        log_listener.stop()
+
+    sys.exit(exit_code)
+
+
+def report_merge(args):
+    """Merge test reports, exiting non-zero if any case failed"""
+    summary = merge_reports(args.REPORTS, junit=args.junit)
+
+    if args.output is None:
+        json.dump(summary, sys.stdout, indent=2)
+        print(file=sys.stdout)
+    else:
+        with args.output.open("wt", encoding="utf-8") as outfile:
+            json.dump(summary, outfile, indent=2)
+
+    sys.exit(0 if summary["success"] else 1)
+
+
+def checksum_benchmark(args):
+    """Print the throughput of each checksum algorithm"""
+    throughputs = benchmark_checksums(size=args.size * 1024 * 1024)
+    for algorithm, throughput in sorted(
+        throughputs.items(), key=lambda item: item[1], reverse=True
+    ):
+        print(f"{algorithm:<10} {throughput:6.2f} GB/s", file=sys.stdout)
 
 
 def init(_):
@@ -0,0 +1,188 @@
+"""Benchmark test cases by running them repeatedly."""
+
+import datetime
+import json
+import logging
+import math
+import statistics
+
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from nftest import __version__
+from nftest.NFTestReport import NFTestReport
+from nftest.NFTestRunner import NFTestRunner
+
+
+# How each metric is read from a report, for a case that has it
+METRICS: Dict[str, Callable[[NFTestReport, str], Optional[float]]] = {
+    "wall_seconds": lambda report, name: report.timings[name]["total"],
+    "startup_seconds": lambda report, name: (
+        report.timings[name]["phases"].get("startup")
+    ),
+    "pipeline_seconds": lambda report, name: (
+        report.timings[name]["phases"].get("pipeline")
+    ),
+    "task_realtime_seconds": lambda report, name: (
+        report.traces[name]["realtime"] if name in report.traces else None
+    ),
+    "peak_rss_bytes": lambda report, name: (
+        report.resources[name]["summary"]["peak_rss_bytes"]
+        if name in report.resources else None
+    ),
+    "cpu_seconds": lambda report, name: (
+        report.resources[name]["summary"]["cpu_seconds"]
+        if name in report.resources else None
+    ),
+}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of the values."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Return summary statistics of repeated measurements."""
+    return {
+        "n": len(values),
+        "median": statistics.median(values),
+        "p95": percentile(values, 0.95),
+        "stddev": statistics.stdev(values) if len(values) > 1 else 0.0,
+        "min": min(values),
+        "max": max(values),
+    }
+
+
+def collect_metrics(report: NFTestReport) -> Dict[str, Dict[str, float]]:
+    """Return the metrics of every case that passed and was run."""
+    metrics = {}
+    for name in report.passed_tests:
+        if name in report.cached_tests:
+            continue
+
+        case_metrics = {}
+        for metric, read in METRICS.items():
+            value = read(report, name)
+            if value is not None:
+                case_metrics[metric] = value
+        metrics[name] = case_metrics
+
+    return metrics
+
+
+class Benchmark:
+    """
+    Run the cases of a config file repeatedly and summarize their metrics.
+
+    Each repetition loads the config afresh and runs it with NFTestRunner,
+    one case at a time so that cases do not compete for resources. Cases
+    are traced and their resource usage is sampled. The first `warmup`
+    repetitions are discarded. No repetition prints the prolog or is
+    recorded in NFT_HISTORY.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(
+        self,
+        config_file: str,
+        test_cases: List[str],
+        repeats: int = 5,
+        warmup: int = 1,
+        resource_interval: float = 1.0,
+    ):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        self.config_file = config_file
+        self.test_cases = test_cases
+        self.repeats = repeats
+        self.warmup = warmup
+        self.resource_interval = resource_interval
+
+    def run(self) -> Optional[dict]:
+        """Run the benchmark, returning None if any case did not pass."""
+        samples: Dict[str, Dict[str, List[float]]] = {}
+
+        for iteration in range(self.warmup + self.repeats):
+            warmup = iteration < self.warmup
+            self._logger.info(
+                "Benchmark %s %d of %d",
+                "warmup" if warmup else "repetition",
+                iteration + 1 if warmup else iteration - self.warmup + 1,
+                self.warmup if warmup else self.repeats,
+            )
+
+            runner = NFTestRunner(
+                resource_interval=self.resource_interval,
+                trace_top=0,
+                repetition=True,
+            )
+            runner.load_from_config(self.config_file, self.test_cases)
+            if runner.main():
+                self._logger.error("Benchmark stopped because cases did not pass")
+                return None
+
+            if warmup:
+                continue
+
+            for name, metrics in collect_metrics(runner.report).items():
+                for metric, value in metrics.items():
+                    samples.setdefault(name, {}).setdefault(metric, []).append(value)
+
+        return {
+            "nftest": __version__,
+            "created": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            "repeats": self.repeats,
+            "warmup": self.warmup,
+            "cases": {
+                name: {metric: summarize(values) for metric, values in metrics.items()}
+                for name, metrics in samples.items()
+            },
+        }
+
+
+def compare(
+    results: dict,
+    baseline: dict,
+    default_threshold: float = 0.1,
+    thresholds: Optional[Dict[str, float]] = None,
+) -> List[str]:
+    """
+    Return a description of every metric that regressed from the baseline.
+
+    A metric regresses if its median exceeds the baseline median by more
+    than its relative threshold. Cases and metrics missing from either side
+    are not compared.
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for name, metrics in results["cases"].items():
+        for metric, stats in metrics.items():
+            base = baseline["cases"].get(name, {}).get(metric)
+            if base is None:
+                continue
+
+            threshold = thresholds.get(metric, default_threshold)
+            limit = base["median"] * (1 + threshold)
+            if stats["median"] > limit:
+                regressions.append(
+                    f"{name}: {metric} median {stats['median']:.4g} exceeds"
+                    f" baseline {base['median']:.4g} by more than {threshold:.0%}"
+                )
+
+    return regressions
+
+
+def write_results(path: Path, results: dict) -> None:
+    """Write benchmark results, which can later be used as a baseline."""
+    with Path(path).open("wt", encoding="utf-8") as outfile:
+        json.dump(results, outfile, indent=2, sort_keys=True)
+
+
+def read_results(path: Path) -> dict:
+    """Read benchmark results written by write_results."""
+    with Path(path).open("rt", encoding="utf-8") as infile:
+        return json.load(infile)
@@ -0,0 +1,162 @@
+"""Persistent on-disk cache of file checksums."""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+from typing import Callable, Optional
+
+from nftest.NFTestENV import NFTestENV
+from nftest.Singleton import Singleton
+
+
+# A file modified this recently may be modified again without its mtime
+# changing, so its checksum is not stored
+RACY_WINDOW_NS = 2_000_000_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checksums (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (device, inode, size, mtime_ns, algorithm)
+);
+CREATE INDEX IF NOT EXISTS checksums_last_used ON checksums (last_used);
+"""
+
+
+def stat_key(stat_result: os.stat_result) -> tuple:
+    """Return the cache key identifying one version of a file."""
+    return (
+        stat_result.st_dev,
+        stat_result.st_ino,
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+    )
+
+
+class ChecksumCache(metaclass=Singleton):
+    """
+    Cache of file checksums keyed on (device, inode, size, mtime_ns).
+
+    The cache is an SQLite database, which serializes concurrent writers from
+    multiple threads and processes. Once it holds more than `max_entries`
+    checksums the least recently used ones are evicted. Any database error
+    disables the cache for the rest of the run rather than failing the tests.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = 100_000,
+        enabled: bool = True,
+    ):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self.path = Path(path or Path(NFTestENV().NFT_CACHE, "checksums.sqlite3"))
+        self.max_entries = max_entries
+        self.enabled = enabled
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database, creating it if necessary."""
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                str(self.path),
+                timeout=30,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.OperationalError:
+                # WAL is unsupported on some network filesystems
+                pass
+            connection.executescript(SCHEMA)
+            self._connection = connection
+
+        return self._connection
+
+    def _disable(self, error: Exception) -> None:
+        """Stop using the cache after an unexpected error."""
+        self._logger.warning(
+            "Disabling checksum cache %s: %s", self.path, error
+        )
+        self.enabled = False
+
+    def lookup(self, stat_result: os.stat_result, algorithm: str) -> Optional[str]:
+        """Return the cached checksum for this version of a file, if any."""
+        key = (*stat_key(stat_result), algorithm)
+        with self._lock:
+            if not self.enabled:
+                return None
+            try:
+                connection = self._connect()
+                row = connection.execute(
+                    "SELECT checksum FROM checksums WHERE device = ? AND inode = ?"
+                    " AND size = ? AND mtime_ns = ? AND algorithm = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE checksums SET last_used = ? WHERE device = ?"
+                        " AND inode = ? AND size = ? AND mtime_ns = ?"
+                        " AND algorithm = ?",
+                        (time.time(), *key),
+                    )
+            except (OSError, sqlite3.Error) as error:
+                self._disable(error)
+                return None
+
+        return row[0] if row is not None else None
+
+    def store(self, stat_result: os.stat_result, algorithm: str, checksum: str):
+        """Record the checksum for this version of a file."""
+        if time.time_ns() - stat_result.st_mtime_ns < RACY_WINDOW_NS:
+            return
+
+        with self._lock:
+            if not self.enabled:
+                return
+            try:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (*stat_key(stat_result), algorithm, checksum, time.time()),
+                )
+                connection.execute(
+                    "DELETE FROM checksums WHERE rowid IN (SELECT rowid FROM"
+                    " checksums ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            except (OSError, sqlite3.Error) as error:
+                self._disable(error)
+
+    def checksum(
+        self, path: Path, algorithm: str, compute: Callable[[Path], str]
+    ) -> str:
+        """Return the checksum of path, calling compute only on a cache miss."""
+        if not self.enabled:
+            return compute(path)
+
+        before = os.stat(path)
+        cached = self.lookup(before, algorithm)
+        if cached is not None:
+            return cached
+
+        checksum = compute(path)
+
+        # Only store the result if the file did not change while being read
+        if stat_key(os.stat(path)) == stat_key(before):
+            self.store(before, algorithm, checksum)
+
+        return checksum
@@ -1,26 +1,60 @@
 """Common functions"""
 
 import argparse
+import asyncio
+import atexit
+import datetime
 import enum
+import functools
 import glob
 import hashlib
+import json
 import logging
 import os
 import re
-import selectors
+import shlex
 import shutil
+import signal
 import subprocess
 import sys
+import threading
 import time
 
+from asyncio.subprocess import Process
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 
 from nftest import __version__
+from nftest.checksum_cache import ChecksumCache
+from nftest.logqueue import (
+    BatchedFileHandler,
+    BatchedStreamHandler,
+    LogQueue,
+    LogQueueListener,
+)
 from nftest.NFTestENV import NFTestENV
+from nftest.resources import descendants, process_start_time
+from nftest.Singleton import Singleton
 from nftest.syslog import syslog_filter
 
 
+# Checksum algorithms accepted for reference files and assertions
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256", "sha512", "blake2b", "blake2s")
+
+# Files are hashed in blocks of this size
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+# Subprocess output is read in blocks of this size
+STREAM_READ_SIZE = 64 * 1024
+
+# Seconds between checks of whether a running subprocess has been cancelled
+CANCEL_POLL_INTERVAL = 0.2
+
+# Bytes hashed by each thread, so that the work can be attributed to a case
+_HASH_COUNTER = threading.local()
+
+
 class TestResult(enum.Enum):
     """Enumeration for test results."""
     PENDING = enum.auto()
@@ -28,6 +62,10 @@ class TestResult(enum.Enum):
     SKIPPED = enum.auto()
     FAILED = enum.auto()
     ERRORED = enum.auto()
+    # Not run, or stopped before finishing, once too many cases failed
+    NOT_RUN = enum.auto()
+    # Stopped because Nextflow or an assertion script ran out of time
+    TIMEOUT = enum.auto()
 
 
 def validate_yaml(path: Path):  # pylint: disable=unused-argument
@@ -37,9 +75,9 @@ def validate_yaml(path: Path):  # pylint: disable=unused-argument
     return True
 
 
-def remove_nextflow_logs() -> None:
-    """Remove log files generated by nextflow"""
-    files = glob.glob("./.nextflow*")
+def remove_nextflow_logs(launch_dir: Path = Path(".")) -> None:
+    """Remove log files generated by nextflow in the launch directory"""
+    files = glob.glob(str(Path(launch_dir, ".nextflow*")))
     for file in files:
         if Path(file).is_dir():
             shutil.rmtree(file, ignore_errors=True)
@@ -47,39 +85,136 @@ def remove_nextflow_logs() -> None:
             os.remove(file)
 
 
-def calculate_checksum(path: Path) -> str:
-    """Calculate checksum recursively.
+def read_json(path: Path, default=None):
+    """
+    Read data from a JSON file, returning default if the file does not exist.
+
+    Raises OSError if the file cannot be read and ValueError if it is not
+    valid JSON.
+    """
+    try:
+        with Path(path).open("rt", encoding="utf-8") as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return default
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """
+    Write data to a JSON file, replacing any previous file atomically.
+
+    Readers see either the previous file or the new one, never a partial
+    write. Raises OSError if the file cannot be written.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique to the thread, so that concurrent writers do not collide
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with temp_path.open("wt", encoding="utf-8") as outfile:
+            json.dump(data, outfile, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            temp_path.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def calculate_checksum(
+    path: Path, algorithm: str = "md5", use_cache: bool = True
+) -> str:
+    """Calculate the checksum of a file.
     Args:
-        path (Path): The path to the directory.
-        stdout (bool): If true, the result is printed to stdout.
+        path (Path): The path to the file.
+        algorithm (str): One of CHECKSUM_ALGORITHMS.
+        use_cache (bool): If true, reuse a checksum recorded in the
+            ChecksumCache for an unchanged file.
     """
-    sum_val = hashlib.md5()
-    with open(path, "rb") as handle:
-        for byte_block in iter(lambda: handle.read(4096), b""):
-            sum_val.update(byte_block)
-    sum_val = sum_val.hexdigest()
-    return sum_val
+    if use_cache:
+        return ChecksumCache().checksum(
+            Path(path), algorithm, functools.partial(_compute_checksum, algorithm=algorithm)
+        )
 
+    return _compute_checksum(path, algorithm)
 
-def validate_reference(
-    reference_parameter_name: str,
-    reference_parameter_path: str,
-    reference_checksum: str,
-    reference_checksum_type: str,
-) -> Tuple[str, str]:
-    """Validate reference file and checksum"""
+
+def _compute_checksum(path: Path, algorithm: str = "md5") -> str:
+    """Read the entire file to calculate its checksum."""
+    sum_val = hashlib.new(algorithm)
+    # Read into one reusable buffer rather than allocating a bytes object per
+    # block
+    buffer = bytearray(CHECKSUM_BLOCK_SIZE)
+    view = memoryview(buffer)
+    total = 0
+    with open(path, "rb", buffering=0) as handle:
+        for size in iter(lambda: handle.readinto(buffer), 0):
+            sum_val.update(view[:size])
+            total += size
+    count_hashed(total)
+    return sum_val.hexdigest()
+
+
+def bytes_hashed() -> int:
+    """Return the number of bytes that the current thread has hashed."""
+    return getattr(_HASH_COUNTER, "total", 0)
+
+
+def count_hashed(size: int) -> None:
+    """Add to the number of bytes that the current thread has hashed."""
+    _HASH_COUNTER.total = bytes_hashed() + size
+
+
+def benchmark_checksums(
+    size: int = 256 * 1024 * 1024, algorithms: Iterable[str] = CHECKSUM_ALGORITHMS
+) -> Dict[str, float]:
+    """Measure the in-memory hashing throughput of each algorithm in GB/s."""
+    buffer = os.urandom(CHECKSUM_BLOCK_SIZE)
+    blocks = max(1, size // CHECKSUM_BLOCK_SIZE)
+
+    throughputs = {}
+    for algorithm in algorithms:
+        sum_val = hashlib.new(algorithm)
+        start_time = time.perf_counter()
+        for _ in range(blocks):
+            sum_val.update(buffer)
+        elapsed = time.perf_counter() - start_time
+        throughputs[algorithm] = blocks * CHECKSUM_BLOCK_SIZE / elapsed / 1e9
+
+    return throughputs
+
+
+def validate_reference_name(reference_parameter_name: str) -> None:
+    """Ensure the reference parameter name is safe to pass to Nextflow"""
     if not re.match(r"[a-zA-Z0-9_\-.]+$", reference_parameter_name):
         raise ValueError(
             f"Reference parameter name: `{reference_parameter_name}` is invalid. "
             f"Please use only alphanumeric, _, -, and . characters in parameter names."
         )
 
-    _logger = logging.getLogger("NFTest")
 
-    if reference_checksum_type.lower() not in {"md5"}:
-        _logger.warning("reference_checksum_type must be `md5`")
+def reference_algorithm(reference_checksum_type: str) -> str:
+    """Return the checksum algorithm to use for a reference file"""
+    algorithm = reference_checksum_type.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        logging.getLogger("NFTest").warning(
+            "reference_checksum_type must be one of %s; using `md5`",
+            ", ".join(f"`{name}`" for name in CHECKSUM_ALGORITHMS),
+        )
+        return "md5"
+
+    return algorithm
 
-    actual_checksum = calculate_checksum(Path(reference_parameter_path))
+
+def check_reference_checksum(
+    reference_parameter_name: str,
+    reference_parameter_path: str,
+    reference_checksum: str,
+    actual_checksum: str,
+) -> None:
+    """Warn if the reference checksum does not match the expected value"""
+    _logger = logging.getLogger("NFTest")
 
     if actual_checksum != reference_checksum:
         _logger.warning(
@@ -91,7 +226,47 @@ def validate_reference(
             reference_checksum,
         )
 
-    return (reference_parameter_name, reference_parameter_path)
+
+def validate_references(reference_files: List[Dict[str, str]]) -> int:
+    """
+    Validate the checksums of many reference files at once.
+
+    Each distinct file is hashed only once, however many cases share it.
+    Files are hashed in a thread pool, as hashlib releases the GIL while
+    hashing large buffers. Returns the number of bytes hashed.
+    """
+    shared_references: Dict[Tuple[Path, str], List[Dict[str, str]]] = {}
+    for reference_file in reference_files:
+        key = (
+            Path(reference_file["reference_parameter_path"]).resolve(),
+            reference_algorithm(reference_file["reference_checksum_type"]),
+        )
+        shared_references.setdefault(key, []).append(reference_file)
+
+    def hash_reference(key: Tuple[Path, str]) -> Tuple[str, int]:
+        start_bytes = bytes_hashed()
+        return calculate_checksum(*key), bytes_hashed() - start_bytes
+
+    with ThreadPoolExecutor(thread_name_prefix="ReferenceHasher") as executor:
+        results = dict(
+            zip(shared_references, executor.map(hash_reference, shared_references))
+        )
+
+    for key, references in shared_references.items():
+        for reference_file in references:
+            check_reference_checksum(
+                reference_file["reference_parameter_name"],
+                reference_file["reference_parameter_path"],
+                reference_file["reference_checksum"],
+                actual_checksum=results[key][0],
+            )
+
+    return sum(size for _, size in results.values())
+
+
+def format_duration(seconds: float) -> str:
+    """Format a number of seconds as H:MM:SS."""
+    return str(datetime.timedelta(seconds=round(seconds)))
 
 
 def find_config_yaml(args: argparse.Namespace):
@@ -109,8 +284,14 @@ def print_version_and_exist():
     sys.exit()
 
 
-def setup_loggers():
-    """Initialize loggers for both init and run"""
+def setup_loggers() -> LogQueueListener:
+    """
+    Initialize loggers for both init and run.
+
+    Records are written to the console and log file by a background thread,
+    so that threads reading subprocess output never wait on I/O. The returned
+    listener must be stopped to flush the remaining records.
+    """
     # Always log times in UTC
     logging.Formatter.converter = time.gmtime
 
@@ -118,18 +299,21 @@ def setup_loggers():
 
     # Make a file handler that accepts all logs
     try:
-        file_handler = logging.FileHandler(_env.NFT_LOG)
+        file_handler = BatchedFileHandler(_env.NFT_LOG)
         file_handler.setLevel(logging.DEBUG)
     except (FileNotFoundError, PermissionError) as file_error:
         raise RuntimeError(f"Unable to create log file: {_env.NFT_LOG}") from file_error
 
     # Make a stream handler with the requested verbosity
-    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler = BatchedStreamHandler(sys.stdout)
     try:
         stream_handler.setLevel(_env.NFT_LOG_LEVEL)
     except ValueError:
         stream_handler.setLevel(logging.INFO)
 
+    # asyncio logs the choice of selector for every subprocess
+    logging.getLogger("asyncio").setLevel(logging.INFO)
+
     # Set up a special filter to decode the syslog messages from Nextflow
     logging.getLogger("nextflow").addFilter(syslog_filter)
 
@@ -151,45 +335,329 @@ def setup_loggers():
         )
     )
 
-    logging.basicConfig(level=logging.DEBUG, handlers=(file_handler, stream_handler))
+    log_queue = LogQueue()
+    listener = LogQueueListener(log_queue, (file_handler, stream_handler))
+    listener.start()
+    # Flush the remaining records even if the run ends unexpectedly
+    atexit.register(listener.stop)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG)
+    listener.attach(root_logger)
+
+    return listener
+
+
+async def _stream_lines(
+    stream: asyncio.StreamReader, handle_line: Callable[[str], None]
+) -> None:
+    """Pass every line of a stream to handle_line, until the stream closes."""
+    pending = b""
+    while True:
+        data = await stream.read(STREAM_READ_SIZE)
+        if not data:
+            break
+        *lines, pending = (pending + data).split(b"\n")
+        for line in lines:
+            handle_line(line.decode("utf-8", errors="replace").rstrip())
+
+    # Don't lose a final line without a newline
+    if pending:
+        handle_line(pending.decode("utf-8", errors="replace").rstrip())
 
 
-def popen_with_logger(
-    *args, logger=None, stdout_level=logging.INFO, stderr_level=logging.ERROR, **kwargs
+async def _write_stdin(stream: asyncio.StreamWriter, data: bytes) -> None:
+    """Write data to a process's stdin and close it."""
+    try:
+        stream.write(data)
+        await stream.drain()
+        stream.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # The process exited without reading everything
+        pass
+
+
+def _signal_process(
+    process: Process, signum: int, group: bool
+) -> None:
+    """Send a signal to a process, or to every process in its group."""
+    if group:
+        os.killpg(process.pid, signum)
+    else:
+        process.send_signal(signum)
+
+
+async def terminate_process(
+    process: Process, grace_period: float = 10, group: bool = False
+) -> None:
+    """
+    Ask a process to terminate, killing it if it does not within the grace period.
+
+    If `group` is True the process leads its own process group (it was
+    started with start_new_session), and every process in the group is
+    signalled. Any descendants that are still running once the process
+    exits, including those that left its group, are killed. A descendant is
+    only killed if its start time is unchanged, as its PID may have been
+    reused by an unrelated process during the grace period.
+    """
+    tree = descendants(process.pid)
+
+    try:
+        _signal_process(process, signal.SIGTERM, group)
+    except ProcessLookupError:
+        # The process already exited
+        pass
+
+    try:
+        await asyncio.wait_for(process.wait(), grace_period)
+    except asyncio.TimeoutError:
+        pass
+
+    if group or process.returncode is None:
+        try:
+            _signal_process(process, signal.SIGKILL, group)
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+    for pid, started in tree.items():
+        if process_start_time(pid) != started:
+            # The process exited, and its PID may have been reused
+            continue
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+async def _drain(supervised: asyncio.Future, grace_period: float) -> None:
+    """Wait for the output of a terminated process, giving up after the grace period."""
+    try:
+        await asyncio.wait_for(supervised, grace_period)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _terminate_when_set(
+    event: threading.Event,
+    process: Process,
+    grace_period: float,
+    group: bool,
+) -> None:
+    """Terminate a process once the event is set from any thread."""
+    while not event.is_set():
+        await asyncio.sleep(CANCEL_POLL_INTERVAL)
+    await terminate_process(process, grace_period, group)
+
+
+async def _start_process(command, shell: bool = False, **kwargs) -> Process:
+    """Start a command like subprocess.Popen, with or without the shell."""
+    if shell:
+        if not isinstance(command, str):
+            command = shlex.join(os.fsdecode(arg) for arg in command)
+        return await asyncio.create_subprocess_shell(command, **kwargs)
+
+    if isinstance(command, (str, bytes, os.PathLike)):
+        command = [command]
+    return await asyncio.create_subprocess_exec(
+        *(
+            os.fsdecode(arg) if isinstance(arg, (bytes, os.PathLike)) else str(arg)
+            for arg in command
+        ),
+        **kwargs,
+    )
+
+
+async def run_process(
+    *args,
+    logger=None,
+    stdout_level=logging.INFO,
+    stderr_level=logging.ERROR,
+    timeout: Optional[float] = None,
+    stdin_data: Optional[bytes] = None,
+    stdout_handler: Optional[Callable[[str], None]] = None,
+    on_start: Optional[Callable[[int], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    grace_period: float = 10,
+    **kwargs,
 ) -> subprocess.CompletedProcess:
     """
     Run a subprocess and stream the console outputs to a logger.
+
+    Both pipes are read until they close, so no output is lost when the
+    process exits. If the process outlives the timeout, or this coroutine is
+    cancelled, the process is terminated; a timeout then raises
+    subprocess.TimeoutExpired. With start_new_session=True, the whole
+    process group is terminated.
+
+    Like subprocess.Popen, the command is a sequence of arguments, or a
+    string naming the program to run; with shell=True, a string is run by
+    the shell.
+
+    Args:
+        stdin_data: Data written to the process's stdin, which is then closed.
+        stdout_handler: Called with each stdout line instead of logging it.
+        on_start: Called with the process ID once the process has started.
+        cancel: An event that, once set from any thread, terminates the
+            process. The result then has the process's (negative) returncode.
+        grace_period: Seconds between SIGTERM and SIGKILL when terminating.
     """
-    for badarg in ("stdout", "stderr", "universal_newlines"):
+    for badarg in ("stdin", "stdout", "stderr", "universal_newlines"):
         if badarg in kwargs:
             raise ValueError(f"Argument {badarg} is not allowed")
 
     if logger is None:
         raise ValueError("A logger must be supplied!")
 
-    kwargs.update({
-        "stdout": subprocess.PIPE,
-        "stderr": subprocess.PIPE,
-        "universal_newlines": True,
-    })
-
-    with subprocess.Popen(*args, **kwargs) as process:
-        # Route stdout to INFO and stderr to ERROR in real-time
-        with selectors.DefaultSelector() as selector:
-            selector.register(
-                fileobj=process.stdout, events=selectors.EVENT_READ, data=stdout_level
-            )
-            selector.register(
-                fileobj=process.stderr, events=selectors.EVENT_READ, data=stderr_level
-            )
+    process = await _start_process(
+        args[0],
+        stdin=asyncio.subprocess.DEVNULL if stdin_data is None else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **kwargs,
+    )
+
+    if on_start is not None:
+        on_start(process.pid)
+
+    # Route stdout to INFO and stderr to ERROR in real-time
+    tasks = [
+        _stream_lines(
+            process.stdout,
+            stdout_handler or functools.partial(logger.log, stdout_level),
+        ),
+        _stream_lines(process.stderr, functools.partial(logger.log, stderr_level)),
+    ]
+    if stdin_data is not None:
+        tasks.append(_write_stdin(process.stdin, stdin_data))
 
-            while process.poll() is None:
-                events = selector.select()
-                for key, _ in events:
-                    line = key.fileobj.readline()
-                    if line:
-                        # The only case in which this won't be true is when
-                        # the pipe is closed
-                        logger.log(level=key.data, msg=line.rstrip())
+    try:
+        await _supervise(
+            process,
+            tasks,
+            timeout=timeout,
+            cancel=cancel,
+            grace_period=grace_period,
+            group=bool(kwargs.get("start_new_session")),
+        )
+    except asyncio.TimeoutError as error:
+        raise subprocess.TimeoutExpired(args[0], timeout) from error
+
+    return subprocess.CompletedProcess(args[0], process.returncode)
+
+
+async def _supervise(
+    process: Process,
+    tasks: List[Awaitable],
+    *,
+    timeout: Optional[float],
+    cancel: Optional[threading.Event],
+    grace_period: float,
+    group: bool,
+) -> None:
+    """
+    Wait for a process and the tasks that handle its pipes.
+
+    The process is terminated if it outlives the timeout (which then raises
+    asyncio.TimeoutError), if this coroutine is cancelled, or once the cancel
+    event is set.
+    """
+    watcher = None
+    if cancel is not None:
+        watcher = asyncio.ensure_future(
+            _terminate_when_set(cancel, process, grace_period, group)
+        )
+
+    # The output is still read while the process is terminated, so that
+    # the pipes are closed by the time this returns
+    supervised = asyncio.ensure_future(asyncio.gather(*tasks, process.wait()))
+    try:
+        await asyncio.wait_for(asyncio.shield(supervised), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        await terminate_process(process, grace_period, group)
+        await _drain(supervised, grace_period)
+        raise
+    finally:
+        if watcher is not None and not cancel.is_set():
+            watcher.cancel()
+
+    # Let a termination that has started finish with the rest of the group
+    if watcher is not None and cancel.is_set():
+        await watcher
+
+
+class _CallerThreadLogger(logging.LoggerAdapter):
+    """Log records under the name of the thread that started a subprocess."""
 
-    return process
+    def log(self, level, msg, *args, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+
+        record = self.logger.makeRecord(
+            self.logger.name, level, "(subprocess)", 0, msg, args, None
+        )
+        record.threadName = self.extra["thread_name"]
+        self.logger.handle(record)
+
+
+class ProcessSupervisor(metaclass=Singleton):
+    """
+    A single event loop, in a background thread, that supervises every
+    subprocess.
+
+    Threads submit coroutines to the loop and block until they finish, so
+    processes started by cases running in parallel share one loop rather
+    than each needing a loop of their own.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        """Constructor"""
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self._loop.run_forever, name="ProcessSupervisor", daemon=True
+        ).start()
+
+    def run(self, coroutine: Awaitable):
+        """
+        Run a coroutine on the loop and return its result.
+
+        If the calling thread is interrupted while it waits (such as by
+        KeyboardInterrupt), the coroutine is cancelled, which terminates its
+        process, before the interruption is raised.
+        """
+        started: Future = Future()
+        finished = threading.Event()
+
+        def start():
+            task = self._loop.create_task(coroutine)
+            task.add_done_callback(lambda _: finished.set())
+            started.set_result(task)
+
+        self._loop.call_soon_threadsafe(start)
+        try:
+            task = started.result()
+            finished.wait()
+        except BaseException:
+            task = started.result()
+            self._loop.call_soon_threadsafe(task.cancel)
+            finished.wait()
+            raise
+
+        return task.result()
+
+
+def popen_with_logger(*args, logger=None, **kwargs) -> subprocess.CompletedProcess:
+    """
+    Run a subprocess and stream the console outputs to a logger.
+
+    This is a blocking wrapper around run_process, which takes the same
+    arguments. Every process is supervised by the one ProcessSupervisor
+    loop; its output is logged under the name of the calling thread.
+    """
+    if logger is not None:
+        logger = _CallerThreadLogger(
+            logger, {"thread_name": threading.current_thread().name}
+        )
+    return ProcessSupervisor().run(run_process(*args, logger=logger, **kwargs))
@@ -0,0 +1,241 @@
+"""Streaming comparison of file contents."""
+
+import queue
+import threading
+import zlib
+
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from nftest.common import CHECKSUM_BLOCK_SIZE, bytes_hashed, count_hashed
+
+
+# zlib window bits that accept only the gzip format
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+# Marks the end of a stream of chunks from a worker thread
+_END_OF_CHUNKS = object()
+
+# Entry point group under which other packages register comparator plugins
+PLUGIN_GROUP = "nftest.comparators"
+
+Comparator = Callable[[Path, Path], bool]
+
+# Comparators that have been registered or loaded, by method name. None
+# records that no plugin provides a method.
+_COMPARATORS: Dict[str, Optional[Comparator]] = {}
+# The error raised by loading each plugin that failed to load
+_LOAD_ERRORS: Dict[str, Exception] = {}
+_COMPARATORS_LOCK = threading.Lock()
+
+
+def register_comparator(name: str, comparator: Comparator) -> None:
+    """Make a comparator available as an assertion method."""
+    with _COMPARATORS_LOCK:
+        _COMPARATORS[name] = comparator
+        _LOAD_ERRORS.pop(name, None)
+
+
+def _plugin_entry_points() -> Iterable:
+    """Return the installed entry points in PLUGIN_GROUP."""
+    # Deferred so that plugins cost nothing unless a case uses one
+    from importlib import metadata  # pylint: disable=import-outside-toplevel
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=PLUGIN_GROUP)
+
+    # Python < 3.10 returns a dictionary of groups
+    return entry_points.get(PLUGIN_GROUP, [])
+
+
+def get_comparator(name: str) -> Optional[Comparator]:
+    """
+    Return the comparator for an assertion method, loading its plugin if needed.
+
+    A comparator is called with the actual and expected paths and returns
+    whether they match; it may instead raise MismatchedContentsError to
+    explain the difference. Only the plugin for the requested method is
+    imported. If the plugin fails to load, the error is raised again each
+    time the method is requested.
+    """
+    with _COMPARATORS_LOCK:
+        if name not in _COMPARATORS:
+            _COMPARATORS[name] = None
+            for entry_point in _plugin_entry_points():
+                if entry_point.name == name:
+                    try:
+                        _COMPARATORS[name] = entry_point.load()
+                    except Exception as error:  # pylint: disable=broad-except
+                        _LOAD_ERRORS[name] = error
+                    break
+
+        if name in _LOAD_ERRORS:
+            raise _LOAD_ERRORS[name]
+
+        return _COMPARATORS[name]
+
+
+def file_chunks(path: Path, block_size: int = CHECKSUM_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Yield the contents of a file in aligned blocks.
+
+    The blocks are bytes rather than views of a reused buffer, as comparing
+    bytes uses memcmp while comparing memoryviews goes byte by byte. The
+    bytes read are counted by bytes_hashed.
+    """
+    with open(path, "rb", buffering=0) as handle:
+        for block in iter(lambda: handle.read(block_size), b""):
+            count_hashed(len(block))
+            yield block
+
+
+def gzip_chunks(path: Path, block_size: int = CHECKSUM_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Yield the decompressed contents of a gzip file.
+
+    Files with multiple members (such as bgzip files) are decompressed as one
+    stream, and zero bytes after a member are skipped. Neither the compressed
+    nor the decompressed chunks are larger than block_size, so memory use is
+    bounded. The compressed bytes read are counted by bytes_hashed.
+    """
+    decompressor = None
+    pending = False
+
+    with open(path, "rb") as handle:
+        for data in iter(lambda: handle.read(block_size), b""):
+            count_hashed(len(data))
+            while data or pending:
+                if decompressor is None or decompressor.eof:
+                    if decompressor is not None:
+                        # Like the gzip module, ignore zero padding after a
+                        # member
+                        data = data.lstrip(b"\0")
+                        if not data:
+                            break
+                    decompressor = zlib.decompressobj(GZIP_WBITS)
+
+                chunk = decompressor.decompress(data, block_size)
+                if chunk:
+                    yield chunk
+
+                # A full chunk means more output may be held back
+                pending = len(chunk) == block_size and not decompressor.eof
+                data = (
+                    decompressor.unused_data
+                    if decompressor.eof
+                    else decompressor.unconsumed_tail
+                )
+
+    if decompressor is not None and not decompressor.eof:
+        raise EOFError(f"{path} ended before the end-of-stream marker")
+
+
+def threaded_chunks(chunks: Iterable, depth: int = 4) -> Iterator:
+    """
+    Produce chunks in a worker thread, with at most depth chunks in flight.
+
+    zlib and file reads release the GIL, so this lets two streams be read and
+    decompressed in parallel. The chunks must not share a buffer. The bytes
+    that the worker hashes are counted for the calling thread.
+    """
+    chunk_queue: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    produced = {"bytes": 0}
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        start_bytes = bytes_hashed()
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+            put(_END_OF_CHUNKS)
+        except Exception as error:  # pylint: disable=broad-except
+            put(error)
+        finally:
+            # Close the file behind the chunks, even if the consumer stopped
+            # early
+            if hasattr(chunks, "close"):
+                chunks.close()
+            produced["bytes"] = bytes_hashed() - start_bytes
+
+    producer = threading.Thread(target=produce, name="ChunkReader", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = chunk_queue.get()
+            if item is _END_OF_CHUNKS:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Release the producer if the consumer stopped early
+        stop.set()
+        producer.join()
+        count_hashed(produced["bytes"])
+
+
+def _first_mismatch(left: bytes, right: bytes) -> int:
+    """Return the index of the first differing byte of two unequal buffers."""
+    low, high = 0, len(left)
+    # Bisect with (fast) slice comparisons before checking single bytes
+    while high - low > 64:
+        middle = (low + high) // 2
+        if left[low:middle] == right[low:middle]:
+            low = middle
+        else:
+            high = middle
+
+    for index in range(low, high):
+        if left[index] != right[index]:
+            return index
+
+    return high
+
+
+def first_difference(left: Iterable[bytes], right: Iterable[bytes]) -> Optional[int]:
+    """
+    Compare two streams of non-empty byte chunks.
+
+    Returns None if the streams are identical, otherwise the offset of the
+    first difference. Reading stops as soon as a difference is found. The
+    streams may use different chunk sizes.
+    """
+    left_chunks, right_chunks = iter(left), iter(right)
+    left_chunk = right_chunk = b""
+    # The parts of the current chunks that have been compared
+    left_start = right_start = 0
+    offset = 0
+
+    while True:
+        if left_start == len(left_chunk):
+            left_chunk, left_start = next(left_chunks, b""), 0
+        if right_start == len(right_chunk):
+            right_chunk, right_start = next(right_chunks, b""), 0
+
+        if not left_chunk or not right_chunk:
+            # At least one stream is exhausted
+            return None if not left_chunk and not right_chunk else offset
+
+        size = min(len(left_chunk) - left_start, len(right_chunk) - right_start)
+        # Slicing a whole bytes object does not copy it, so aligned chunks are
+        # compared in place
+        left_part = left_chunk[left_start:left_start + size]
+        right_part = right_chunk[right_start:right_start + size]
+        if left_part != right_part:
+            return offset + _first_mismatch(left_part, right_part)
+
+        offset += size
+        left_start += size
+        right_start += size
@@ -0,0 +1,164 @@
+"""Durations of past test runs, used to schedule and estimate runs."""
+
+import hashlib
+import heapq
+import json
+import logging
+import statistics
+import threading
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, TypeVar
+
+from nftest.common import read_json, write_json_atomic
+from nftest.NFTestENV import NFTestENV
+
+
+# Number of recent durations kept for each case
+HISTORY_LENGTH = 10
+
+CaseT = TypeVar("CaseT")
+
+
+def makespan(
+    durations: Iterable[float], workers: int, busy: Sequence[float] = ()
+) -> float:
+    """
+    Return how long the durations take when run in order on workers.
+
+    Each duration starts on the first worker to become free. `busy` gives
+    the remaining time of work that is already running.
+    """
+    free_at = sorted(busy)[:workers]
+    free_at.extend([0.0] * (workers - len(free_at)))
+    heapq.heapify(free_at)
+
+    for duration in durations:
+        heapq.heappush(free_at, heapq.heappop(free_at) + duration)
+
+    return max(free_at, default=0.0)
+
+
+class CaseHistory:
+    """
+    The recent durations of each case, keyed on case name.
+
+    The history is a JSON file (NFT_HISTORY), updated from the report of
+    every run. A case is expected to take the median of its recent
+    durations.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        self._lock = threading.Lock()
+        self.path = Path(path or NFTestENV().NFT_HISTORY)
+        self.durations: Dict[str, List[float]] = self._load()
+
+    def _load(self) -> Dict[str, List[float]]:
+        """Read the recorded durations, if any."""
+        try:
+            return read_json(self.path, {"cases": {}})["cases"]
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            self._logger.warning("Ignoring unreadable history %s: %s", self.path, error)
+            return {}
+
+    def estimate(self, name: str) -> Optional[float]:
+        """Return the expected duration of a case, if it has run before."""
+        with self._lock:
+            durations = self.durations.get(name)
+            return statistics.median(durations) if durations else None
+
+    def estimates(self, names: Iterable[str]) -> Dict[str, float]:
+        """
+        Return the expected duration of every case.
+
+        Cases without a history are expected to take the mean of the
+        estimates of the others, or zero if no case has a history.
+        """
+        known = {name: self.estimate(name) for name in names}
+        values = [value for value in known.values() if value is not None]
+        fallback = statistics.mean(values) if values else 0.0
+
+        return {
+            name: fallback if value is None else value
+            for name, value in known.items()
+        }
+
+    def digest(self, names: Iterable[str]) -> Optional[str]:
+        """
+        Return a short hash of the estimates that partition would use.
+
+        Shards of a run agree on their split only if their digests match.
+        Returns None if no case has a history, as the split then depends
+        only on the case names.
+        """
+        estimates = self.estimates(names)
+        if not any(estimates.values()):
+            return None
+
+        return hashlib.sha1(
+            json.dumps(estimates, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+
+    def longest_first(self, cases: List[CaseT]) -> List[CaseT]:
+        """
+        Order cases by decreasing expected duration (LPT scheduling).
+
+        Starting the longest cases first keeps one long case from running
+        alone at the end. Cases with equal estimates, including every case
+        when there is no history, keep their order.
+        """
+        estimates = self.estimates(case.name for case in cases)
+        return sorted(cases, key=lambda case: -estimates[case.name])
+
+    def partition(self, cases: List[CaseT], count: int) -> List[List[CaseT]]:
+        """
+        Split cases into `count` shards of about the same expected duration.
+
+        With a history, each case in turn from the longest goes to the shard
+        with the least expected work. Without one, cases are ordered by a
+        stable hash of their names and dealt out in turn. Either way the
+        split depends only on the case names, their history, and `count`, so
+        every shard of a run computes the same split. Each shard keeps the
+        configured order of its cases.
+        """
+        positions = {id(case): index for index, case in enumerate(cases)}
+        shards: List[List[CaseT]] = [[] for _ in range(count)]
+
+        estimates = self.estimates(case.name for case in cases if not case.skip)
+        if any(estimates.values()):
+            loads = [0.0] * count
+            for case in sorted(
+                cases, key=lambda case: (-estimates.get(case.name, 0.0), case.name)
+            ):
+                shard = min(range(count), key=lambda index: (loads[index], index))
+                shards[shard].append(case)
+                loads[shard] += estimates.get(case.name, 0.0)
+        else:
+            ordered = sorted(
+                cases,
+                key=lambda case: hashlib.sha1(case.name.encode("utf-8")).hexdigest(),
+            )
+            for index, case in enumerate(ordered):
+                shards[index % count].append(case)
+
+        return [sorted(shard, key=lambda case: positions[id(case)]) for shard in shards]
+
+    def record(self, durations: Dict[str, float]) -> None:
+        """Add the durations of one run."""
+        with self._lock:
+            for name, duration in durations.items():
+                history = self.durations.setdefault(name, [])
+                history.append(duration)
+                del history[:-HISTORY_LENGTH]
+
+    def save(self) -> None:
+        """Write the history, replacing the previous file atomically."""
+        with self._lock:
+            data = {"cases": self.durations}
+
+        try:
+            write_json_atomic(self.path, data)
+        except OSError as error:
+            self._logger.warning("Unable to save history %s: %s", self.path, error)
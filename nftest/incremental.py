@@ -0,0 +1,299 @@
+"""Skip test cases whose inputs have not changed since they last passed."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, TYPE_CHECKING
+
+from nftest import __version__
+from nftest.common import (
+    TestResult,
+    calculate_checksum,
+    popen_with_logger,
+    read_json,
+    reference_algorithm,
+    write_json_atomic,
+)
+from nftest.NFTestAssert import NFTestAssertionError, resolve_single_path
+from nftest.NFTestENV import NFTestENV
+
+
+if TYPE_CHECKING:
+    from nftest.NFTestCase import NFTestCase
+
+
+# `include { A; B as C } from './modules/a'`
+INCLUDE_RE = re.compile(r"""\binclude\s*\{[^}]*\}\s*from\s*['"]([^'"]+)['"]""")
+
+# `includeConfig 'conf/base.config'`
+INCLUDE_CONFIG_RE = re.compile(r"""\bincludeConfig\s*\(?\s*['"]([^'"]+)['"]""")
+
+# The config that Nextflow loads from the project and launch directories
+IMPLICIT_CONFIG = "nextflow.config"
+
+# Project directories whose files Nextflow makes available to every task
+PROJECT_DIRECTORIES = ("bin", "templates", "lib")
+
+
+def nextflow_version() -> str:
+    """Return the output of `nextflow -version`, or an empty string."""
+    lines: List[str] = []
+    try:
+        popen_with_logger(
+            ["nextflow", "-version"],
+            logger=logging.getLogger("NFTest"),
+            stdout_handler=lines.append,
+        )
+    except OSError:
+        return ""
+
+    return "\n".join(line.strip() for line in lines if line.strip())
+
+
+def _resolve_include(source: Path, target: str, suffix: str) -> Optional[Path]:
+    """Resolve the file included by source, if it is a local file."""
+    # Scripts include plugins by name, and configs may be included by URL
+    if "://" in target or (suffix == ".nf" and not target.startswith((".", "/"))):
+        return None
+
+    path = Path(source.parent, target)
+    if path.is_dir():
+        path = path / f"main{suffix}"
+    elif not path.exists() and path.suffix != suffix:
+        path = path.with_name(path.name + suffix)
+
+    return path if path.is_file() else None
+
+
+def included_files(path: str, pattern: re.Pattern, suffix: str) -> Iterator[Path]:
+    """Yield path and every local file that it includes, recursively."""
+    pending = [Path(path)]
+    seen = set()
+    while pending:
+        current = pending.pop(0)
+        resolved = current.resolve()
+        if resolved in seen or not current.is_file():
+            continue
+        seen.add(resolved)
+        yield current
+
+        text = current.read_text(encoding="utf-8", errors="replace")
+        for target in pattern.findall(text):
+            include = _resolve_include(current, target, suffix)
+            if include is not None:
+                pending.append(include)
+
+
+def project_files(project_dir: Path) -> List[Path]:
+    """Return every file in the project directories that Nextflow uses implicitly."""
+    return sorted(
+        path
+        for name in PROJECT_DIRECTORIES
+        for path in Path(project_dir, name).rglob("*")
+        if path.is_file()
+    )
+
+
+def script_path(script: str) -> Path:
+    """Return the file that runs for an assertion script, searching PATH."""
+    # Like the subprocess module, search PATH for names without a directory
+    if os.sep not in script:
+        found = shutil.which(script)
+        if found is not None:
+            return Path(found)
+
+    return Path(script)
+
+
+def _file_checksums(paths: Iterable[Path]) -> List[List[str]]:
+    """Return the name and checksum of every file."""
+    return [[str(path), calculate_checksum(path)] for path in paths]
+
+
+def case_fingerprint(case: NFTestCase, version: str) -> str:
+    """
+    Return a digest of every input that can change the result of a case.
+
+    This covers the pipeline script and the modules it includes, the files
+    in the project's `bin`, `templates`, and `lib` directories, the configs
+    (including the global config and the `nextflow.config` files that
+    Nextflow loads from the project and launch directories) and the files
+    they include, the params file, the reference files, the profiles, the
+    assertions and their expected files, and the versions of Nextflow and
+    nftest.
+    """
+    project_dir = Path(case.nf_script).parent if case.nf_script else None
+    implicit_configs = [
+        Path(directory, IMPLICIT_CONFIG)
+        for directory in (project_dir, case.launch_dir or Path.cwd())
+        if directory is not None
+    ]
+
+    assertions = []
+    for assertion in case.asserts:
+        try:
+            expect = calculate_checksum(resolve_single_path(assertion.expect))
+        except NFTestAssertionError:
+            # The case will fail, so any value that forces a run will do
+            expect = None
+        assertions.append({
+            "actual": assertion.actual,
+            "expect": [assertion.expect, expect],
+            "method": assertion.method,
+            "script": (
+                _file_checksums([script_path(assertion.script)])
+                if assertion.script else None
+            ),
+            "batch": assertion.batch,
+        })
+
+    inputs = {
+        "nftest": __version__,
+        "nextflow": version,
+        "script": _file_checksums(
+            included_files(case.nf_script, INCLUDE_RE, ".nf")
+        ) if case.nf_script else None,
+        "project_files": (
+            _file_checksums(project_files(project_dir)) if project_dir else None
+        ),
+        "implicit_configs": [
+            _file_checksums(included_files(config, INCLUDE_CONFIG_RE, ".config"))
+            for config in implicit_configs
+        ],
+        "configs": [
+            _file_checksums(included_files(config, INCLUDE_CONFIG_RE, ".config"))
+            for config in case.nf_configs
+        ],
+        "params_file": (
+            _file_checksums([Path(case.params_file)]) if case.params_file else None
+        ),
+        "profiles": case.profiles,
+        "references": [
+            [
+                reference_file["reference_parameter_name"],
+                reference_file["reference_parameter_path"],
+                calculate_checksum(
+                    Path(reference_file["reference_parameter_path"]),
+                    reference_algorithm(reference_file["reference_checksum_type"]),
+                ),
+            ]
+            for reference_file in case.reference_files
+        ],
+        "reference_params": case.reference_params,
+        "output_directory_param_name": case.output_directory_param_name,
+        "asserts": assertions,
+    }
+
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class IncrementalState:
+    """
+    The fingerprints and output checksums of the cases that last passed.
+
+    The state is a JSON file under NFT_CACHE. A case whose fingerprint
+    matches its recorded passing run, and whose recorded outputs are
+    unchanged on disk, does not need to be run again.
+    """
+
+    def __init__(self, path: Optional[str] = None, version: Optional[str] = None):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        self._lock = threading.Lock()
+        self.path = Path(path or Path(NFTestENV().NFT_CACHE, "incremental.json"))
+        self.version = nextflow_version() if version is None else version
+        self.cases: Dict[str, dict] = self._load()
+        self._fingerprints: Dict[str, str] = {}
+
+    def _load(self) -> Dict[str, dict]:
+        """Read the recorded state, if any."""
+        try:
+            return read_json(self.path, {"cases": {}})["cases"]
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            self._logger.warning(
+                "Ignoring unreadable incremental state %s: %s", self.path, error
+            )
+            return {}
+
+    def fingerprint(self, case: NFTestCase) -> str:
+        """Return the fingerprint of a case, computed before it first runs."""
+        with self._lock:
+            fingerprint = self._fingerprints.get(case.name)
+
+        if fingerprint is None:
+            # Hash outside of the lock so that cases can be hashed in parallel
+            fingerprint = case_fingerprint(case, self.version)
+            with self._lock:
+                fingerprint = self._fingerprints.setdefault(case.name, fingerprint)
+
+        return fingerprint
+
+    def is_passing(self, case: NFTestCase) -> bool:
+        """Return True if the case passed with these inputs and outputs."""
+        try:
+            fingerprint = self.fingerprint(case)
+        except OSError as error:
+            # Running the case will report the problem
+            self._logger.debug("Unable to fingerprint %s: %s", case.name, error)
+            return False
+
+        with self._lock:
+            record = self.cases.get(case.name)
+
+        if record is None or record.get("fingerprint") != fingerprint:
+            return False
+
+        for path, checksum in record.get("outputs", {}).items():
+            try:
+                if calculate_checksum(Path(path)) != checksum:
+                    self._logger.debug("Output %s has changed", path)
+                    return False
+            except OSError:
+                self._logger.debug("Output %s is missing", path)
+                return False
+
+        return True
+
+    def record(self, case: NFTestCase) -> None:
+        """Record the outcome of a case that was run."""
+        record = None
+        if case.status == TestResult.PASSED:
+            try:
+                outputs = {
+                    str(path): calculate_checksum(path)
+                    for path in (
+                        resolve_single_path(assertion.actual)
+                        for assertion in case.asserts
+                    )
+                }
+                record = {"fingerprint": self.fingerprint(case), "outputs": outputs}
+            except (OSError, NFTestAssertionError) as error:
+                self._logger.debug("Not recording %s: %s", case.name, error)
+
+        with self._lock:
+            if record is None:
+                self.cases.pop(case.name, None)
+            else:
+                self.cases[case.name] = record
+
+    def save(self) -> None:
+        """Write the state, replacing the previous file atomically."""
+        with self._lock:
+            data = {"cases": self.cases}
+
+        try:
+            write_json_atomic(self.path, data)
+        except OSError as error:
+            self._logger.warning(
+                "Unable to save incremental state %s: %s", self.path, error
+            )
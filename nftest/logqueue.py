@@ -0,0 +1,197 @@
+"""
+Module for writing log records from a background thread.
+"""
+
+import logging
+import logging.handlers
+import queue
+import threading
+
+from typing import Iterable, List, Optional, Tuple
+
+
+# Most records that may be waiting to be written
+LOG_QUEUE_SIZE = 10_000
+
+# Most records written between flushes of the handlers
+LOG_BATCH_SIZE = 256
+
+
+class LogQueue(queue.Queue):
+    """
+    A bounded queue of log records that counts what it could not hold.
+
+    Records below WARNING are dropped when the queue is full, so that a
+    thread reading a subprocess pipe or a socket never waits on a slow
+    terminal or filesystem. More severe records wait for space.
+    """
+
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self._counter_lock = threading.Lock()
+        self.dropped = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        "The number of records waiting to be written."
+        return self.qsize()
+
+    def offer(self, record: logging.LogRecord) -> None:
+        "Add a record, dropping it if the queue is full and it is unimportant."
+        try:
+            self.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                with self._counter_lock:
+                    self.dropped += 1
+                return
+            self.put(record)
+
+        depth = self.qsize()
+        if depth > self.max_depth:
+            with self._counter_lock:
+                self.max_depth = max(self.max_depth, depth)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    "Handler that passes records to a LogQueue."
+
+    queue: LogQueue
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.queue.offer(record)
+
+
+def _write_record(handler: logging.StreamHandler, record: logging.LogRecord) -> None:
+    "Write a formatted record to a handler's stream without flushing it."
+    try:
+        handler.stream.write(handler.format(record) + handler.terminator)
+    except RecursionError:
+        raise
+    except Exception:  # pylint: disable=broad-except
+        handler.handleError(record)
+
+
+class BatchedStreamHandler(logging.StreamHandler):
+    "StreamHandler that leaves flushing to its caller while batched."
+
+    batched = True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        _write_record(self, record)
+        if not self.batched:
+            self.flush()
+
+
+class BatchedFileHandler(logging.FileHandler):
+    "FileHandler that leaves flushing to its caller while batched."
+
+    batched = True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        _write_record(self, record)
+        if not self.batched:
+            self.flush()
+
+
+class LogQueueListener(logging.handlers.QueueListener):
+    """
+    Write the records from a LogQueue in batches.
+
+    The handlers are flushed once per batch rather than once per record, and
+    whenever the queue runs empty, so output is never held back for long.
+    Once the listener stops, a logger attached to it writes to the handlers
+    directly, so records logged later (such as by atexit handlers) are not
+    lost.
+    """
+
+    def __init__(
+        self,
+        log_queue: LogQueue,
+        handlers: Iterable[logging.Handler],
+        batch_size: int = LOG_BATCH_SIZE,
+    ):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+        # The logger that sends its records through the queue, and its handler
+        self._attached: Optional[Tuple[logging.Logger, LogQueueHandler]] = None
+
+    def attach(self, logger: logging.Logger) -> LogQueueHandler:
+        "Send the records of a logger through the queue until the listener stops."
+        queue_handler = LogQueueHandler(self.queue)
+        # Records are formatted by the listener's handlers, not the queue's
+        queue_handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(queue_handler)
+        self._attached = (logger, queue_handler)
+        return queue_handler
+
+    def enqueue_sentinel(self) -> None:
+        # Wait for space rather than fail when the queue is full
+        self.queue.put(self._sentinel)
+
+    def _monitor(self) -> None:
+        done = False
+        while not done:
+            batch: List[Optional[logging.LogRecord]] = [self.dequeue(True)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.dequeue(False))
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self._sentinel:
+                    done = True
+                    continue
+                self.handle(record)
+                self.queue.task_done()
+
+            self.flush()
+
+        self.queue.task_done()
+
+    def flush(self) -> None:
+        "Flush every handler."
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self) -> None:
+        "Write every waiting record, flush the handlers, and stop the thread."
+        if self._thread is None:
+            return
+
+        super().stop()
+
+        if self._attached is not None:
+            logger, queue_handler = self._attached
+            self._attached = None
+            logger.removeHandler(queue_handler)
+            for handler in self.handlers:
+                if hasattr(handler, "batched"):
+                    handler.batched = False
+                logger.addHandler(handler)
+
+            # Write any records queued while the handlers were swapped
+            while True:
+                try:
+                    self.handle(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+        dropped = self.queue.dropped
+        if dropped:
+            self.handle(
+                logging.getLogger("NFTest").makeRecord(
+                    "NFTest",
+                    logging.WARNING,
+                    __file__,
+                    0,
+                    "Dropped %d log records below WARNING (queue of %d was full)",
+                    (dropped, self.queue.maxsize),
+                    None,
+                )
+            )
+        self.flush()
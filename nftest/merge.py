@@ -0,0 +1,151 @@
+"""Merge test reports into one summary and JUnit XML."""
+
+import json
+import logging
+import shutil
+import tempfile
+
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, TextIO
+from xml.sax.saxutils import escape, quoteattr
+
+
+# The section of a JSON report that lists the tests with each status
+STATUS_SECTIONS = {
+    "PASSED": "passed_tests",
+    "SKIPPED": "skipped_tests",
+    "ERRORED": "errored_tests",
+    "FAILED": "failed_tests",
+    "NOT_RUN": "not_run_tests",
+    "TIMEOUT": "timed_out_tests",
+}
+
+
+def read_case_records(path: Path) -> Iterator[dict]:
+    """
+    Yield the case records of a report.
+
+    A `.jsonl` file is the stream written while the tests ran, and is read a
+    line at a time. An incomplete last line, left by a run that was killed,
+    is skipped. Any other file is a JSON report written at the end of a run,
+    which is read whole.
+    """
+    path = Path(path)
+    if path.suffix == ".jsonl":
+        with path.open("rt", encoding="utf-8") as infile:
+            for number, line in enumerate(infile, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logging.getLogger("NFTest").warning(
+                        "Skipping unreadable line %d of %s", number, path
+                    )
+        return
+
+    with path.open("rt", encoding="utf-8") as infile:
+        report = json.load(infile)
+
+    cached = set(report.get("cached_tests", []))
+    for status, section in STATUS_SECTIONS.items():
+        for name, duration in report.get(section, {}).items():
+            yield {
+                "name": name,
+                "status": status,
+                "duration": duration,
+                "cached": name in cached,
+                "failure": report.get("failures", {}).get(name),
+                "shard": report.get("shard"),
+            }
+
+
+def write_testcase(outfile: TextIO, record: dict) -> None:
+    """Write a JUnit testcase element for a case record."""
+    outfile.write(
+        f"    <testcase classname=\"nftest\" name={quoteattr(record['name'])}"
+        f" time=\"{record.get('duration') or 0.0:.3f}\""
+    )
+
+    status = record["status"]
+    if status == "PASSED":
+        outfile.write("/>\n")
+        return
+
+    outfile.write(">\n")
+    if status == "SKIPPED":
+        outfile.write("      <skipped/>\n")
+    elif status == "NOT_RUN":
+        outfile.write('      <skipped message="not run"/>\n')
+    else:
+        tag = "failure" if status == "FAILED" else "error"
+        failure = record.get("failure") or {}
+        message = failure.get("message", f"Test {status.lower()}")
+        outfile.write(
+            f"      <{tag} type={quoteattr(failure.get('type', status))}"
+            f" message={quoteattr(message)}>{escape(message)}</{tag}>\n"
+        )
+    outfile.write("    </testcase>\n")
+
+
+def merge_reports(paths: Iterable[Path], junit: Optional[Path] = None) -> dict:
+    """
+    Combine the case records of many reports into one summary.
+
+    The reports are read in a single pass, keeping only running totals, so
+    memory use does not grow with the number of reports. A `.jsonl` stream
+    is read a line at a time, but a JSON report is loaded whole, so memory
+    use grows with the size of the largest JSON report. If `junit`
+    is given, every case is also written to it as JUnit XML; the testcase
+    elements are spooled to a temporary file until the totals for the
+    enclosing testsuite are known.
+    """
+    summary = {
+        "reports": 0,
+        "tests": 0,
+        "passed": 0,
+        "failed": 0,
+        "errored": 0,
+        "skipped": 0,
+        "not_run": 0,
+        "timeout": 0,
+        "cached": 0,
+        "duration": 0.0,
+    }
+
+    with tempfile.TemporaryFile(mode="w+t", encoding="utf-8") as spool:
+        for path in paths:
+            summary["reports"] += 1
+            for record in read_case_records(path):
+                summary["tests"] += 1
+                summary["duration"] += record.get("duration") or 0.0
+                # A test that never finished counts as errored
+                status = record["status"]
+                if status not in STATUS_SECTIONS:
+                    status = "ERRORED"
+                summary[status.lower()] += 1
+                if record.get("cached"):
+                    summary["cached"] += 1
+                if junit is not None:
+                    write_testcase(spool, record)
+
+        summary["success"] = not (
+            summary["failed"] or summary["errored"] or summary["timeout"]
+        )
+
+        if junit is not None:
+            counts = (
+                f"tests=\"{summary['tests']}\" failures=\"{summary['failed']}\""
+                f" errors=\"{summary['errored'] + summary['timeout']}\""
+                f" skipped=\"{summary['skipped'] + summary['not_run']}\""
+                f" time=\"{summary['duration']:.3f}\""
+            )
+            spool.seek(0)
+            with Path(junit).open("wt", encoding="utf-8") as outfile:
+                outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                outfile.write(f'<testsuites name="nftest" {counts}>\n')
+                outfile.write(f'  <testsuite name="nftest" {counts}>\n')
+                shutil.copyfileobj(spool, outfile)
+                outfile.write("  </testsuite>\n</testsuites>\n")
+
+    return summary
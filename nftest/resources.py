@@ -0,0 +1,205 @@
+"""Sample the resource usage of a process tree from /proc."""
+
+import logging
+import os
+import threading
+import time
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+PROC = "/proc"
+
+try:
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    # There is no /proc to read on this platform
+    CLOCK_TICKS = 100
+    PAGE_SIZE = 4096
+
+
+def _read_stat(pid: int) -> Optional[Tuple[int, int, int, int, int]]:
+    """
+    Return the parent PID, CPU ticks, thread count, resident pages, and start
+    time of pid.
+
+    The CPU ticks include the children that the process has waited for. The
+    start time, in clock ticks since boot, tells a process apart from a later
+    one that reuses its PID.
+    """
+    try:
+        with open(f"{PROC}/{pid}/stat", "rb") as handle:
+            text = handle.read()
+    except OSError:
+        return None
+
+    # The command name may contain spaces and parentheses, so the fields are
+    # found after the last parenthesis. fields[0] is field 3 in proc(5).
+    try:
+        fields = text[text.rindex(b")") + 2:].split()
+        return (
+            int(fields[1]),
+            sum(int(ticks) for ticks in fields[11:15]),
+            int(fields[17]),
+            int(fields[21]),
+            int(fields[19]),
+        )
+    except (ValueError, IndexError):
+        # The file was empty or truncated, as the process exited mid-read
+        return None
+
+
+def _read_io(pid: int) -> Tuple[int, int]:
+    """Return the bytes that pid has read from and written to storage."""
+    counters = {}
+    try:
+        with open(f"{PROC}/{pid}/io", "rb") as handle:
+            for line in handle:
+                name, _, value = line.partition(b":")
+                counters[name] = int(value)
+    except (OSError, ValueError):
+        # Reading another user's io requires privileges
+        pass
+
+    return counters.get(b"read_bytes", 0), counters.get(b"write_bytes", 0)
+
+
+def _pids() -> Iterator[int]:
+    """Yield the PID of every running process."""
+    with os.scandir(PROC) as entries:
+        for entry in entries:
+            if entry.name.isdigit():
+                yield int(entry.name)
+
+
+def process_start_time(pid: int) -> Optional[int]:
+    """Return the start time of a process, or None if it is not running."""
+    stat = _read_stat(pid)
+    return None if stat is None else stat[4]
+
+
+def descendants(root: int) -> Dict[int, int]:
+    """
+    Return the PIDs of every descendant of a process, mapped to their start
+    times, or {} without /proc.
+    """
+    children: Dict[int, List[Tuple[int, int]]] = {}
+    try:
+        for pid in _pids():
+            stat = _read_stat(pid)
+            if stat is not None:
+                children.setdefault(stat[0], []).append((pid, stat[4]))
+    except OSError:
+        return {}
+
+    found = {}
+    pending = list(children.get(root, []))
+    while pending:
+        pid, started = pending.pop()
+        found[pid] = started
+        pending.extend(children.get(pid, []))
+
+    return found
+
+
+def sample_tree(root: int) -> Optional[Dict[str, float]]:
+    """
+    Return the combined resource usage of a process and its descendants.
+
+    Returns None if the process is not running. Exited descendants count
+    towards the CPU time of the process that waited for them, but their
+    storage I/O is lost.
+    """
+    stats = {}
+    children: Dict[int, List[int]] = {}
+    for pid in _pids():
+        stat = _read_stat(pid)
+        if stat is not None:
+            stats[pid] = stat
+            children.setdefault(stat[0], []).append(pid)
+
+    if root not in stats:
+        return None
+
+    sample = {
+        "rss_bytes": 0,
+        "cpu_seconds": 0.0,
+        "read_bytes": 0,
+        "write_bytes": 0,
+        "threads": 0,
+        "processes": 0,
+    }
+    pending = [root]
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+
+        _, ticks, threads, pages, _ = stats[pid]
+        read_bytes, write_bytes = _read_io(pid)
+        sample["rss_bytes"] += pages * PAGE_SIZE
+        sample["cpu_seconds"] += ticks / CLOCK_TICKS
+        sample["read_bytes"] += read_bytes
+        sample["write_bytes"] += write_bytes
+        sample["threads"] += threads
+        sample["processes"] += 1
+
+    return sample
+
+
+class ResourceSampler:
+    """
+    Periodically sample the resource usage of a process tree in a thread.
+
+    The samples form a time series (with `time` in seconds since sampling
+    began), and `summary` reports the peak of each measure.
+    """
+
+    def __init__(self, interval: float):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+
+    def start(self, pid: int) -> None:
+        "Start sampling the tree rooted at pid."
+        if not os.path.isdir(PROC):
+            self._logger.warning("Unable to sample resource usage without %s", PROC)
+            return
+
+        self._thread = threading.Thread(
+            name="ResourceSampler", target=self._run, args=(pid,), daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        "Stop sampling."
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, pid: int) -> None:
+        start_time = time.monotonic()
+        while True:
+            sample = sample_tree(pid)
+            if sample is None:
+                break
+            sample["time"] = time.monotonic() - start_time
+            self.samples.append(sample)
+
+            if self._stop.wait(self.interval):
+                break
+
+    def summary(self) -> Dict[str, float]:
+        "Return the peak of each measure."
+        return {
+            "samples": len(self.samples),
+            "peak_rss_bytes": max((s["rss_bytes"] for s in self.samples), default=0),
+            "cpu_seconds": max((s["cpu_seconds"] for s in self.samples), default=0),
+            "read_bytes": max((s["read_bytes"] for s in self.samples), default=0),
+            "write_bytes": max((s["write_bytes"] for s in self.samples), default=0),
+            "peak_threads": max((s["threads"] for s in self.samples), default=0),
+            "peak_processes": max((s["processes"] for s in self.samples), default=0),
+        }
@@ -0,0 +1,123 @@
+"""Admit cases to run only when their declared resources are free."""
+
+from __future__ import annotations
+
+import logging
+import os
+
+from typing import List, Optional, Tuple, TYPE_CHECKING, Union
+
+from nftest.trace import parse_memory
+
+
+if TYPE_CHECKING:
+    from nftest.NFTestCase import NFTestCase
+
+
+def memory_bytes(value: Union[int, str, None]) -> Optional[int]:
+    """
+    Convert a memory declaration such as `16 GB` or `512.MB` to bytes.
+
+    Integers, and strings of digits, are taken to be bytes, as in Nextflow.
+    """
+    if value is None or isinstance(value, int):
+        return value
+
+    if str(value).strip().isdigit():
+        return int(value)
+
+    size = parse_memory(str(value).upper())
+    if size is None:
+        raise ValueError(f"Invalid memory `{value}`; expected a size such as `16 GB`")
+
+    return size
+
+
+def available_memory() -> Optional[int]:
+    """Return the memory available to new processes, if it can be found."""
+    try:
+        with open("/proc/meminfo", "rt", encoding="utf-8") as handle:
+            for line in handle:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ResourceScheduler:
+    """
+    Track the CPUs and memory of the running cases against a budget.
+
+    Cases declare `cpus` (default 1) and `memory` (default 0). take() starts
+    the first pending case that fits in what is free, so smaller cases
+    backfill around a larger one that must wait. A case that declares more
+    than the whole budget runs only when nothing else is running.
+    """
+
+    def __init__(
+        self, cpus: Optional[int] = None, memory: Optional[int] = None, jobs: int = 1
+    ):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        # By default cases that declare nothing are limited only by `jobs`
+        self.cpus = cpus or max(os.cpu_count() or 1, jobs)
+        self.memory = memory if memory is not None else available_memory()
+        self.free_cpus = self.cpus
+        self.free_memory = self.memory
+
+    def demand(self, case: NFTestCase) -> Tuple[int, int]:
+        """Return the CPUs and memory that a case will hold, within the budget."""
+        if case.skip:
+            return 0, 0
+
+        cpus = min(case.cpus or 1, self.cpus)
+        memory = case.memory or 0
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+
+        return cpus, memory
+
+    def check(self, cases: List[NFTestCase]) -> None:
+        """Warn about cases that declare more than the whole budget."""
+        for case in cases:
+            if (case.cpus or 1) > self.cpus or (
+                self.memory is not None and (case.memory or 0) > self.memory
+            ):
+                self._logger.warning(
+                    "%s declares more resources than the budget of %d CPUs and"
+                    " %s bytes; it will run alone",
+                    case.name,
+                    self.cpus,
+                    self.memory,
+                )
+
+    def fits(self, case: NFTestCase) -> bool:
+        """Return True if the case fits in the free resources."""
+        cpus, memory = self.demand(case)
+        return cpus <= self.free_cpus and (
+            self.free_memory is None or memory <= self.free_memory
+        )
+
+    def take(self, pending: List[NFTestCase]) -> Optional[NFTestCase]:
+        """Remove and return the first pending case that fits, if any."""
+        for index, case in enumerate(pending):
+            if self.fits(case):
+                cpus, memory = self.demand(case)
+                self.free_cpus -= cpus
+                if self.free_memory is not None:
+                    self.free_memory -= memory
+                return pending.pop(index)
+
+        return None
+
+    def release(self, case: NFTestCase) -> None:
+        """Return the resources held by a finished case."""
+        cpus, memory = self.demand(case)
+        self.free_cpus += cpus
+        if self.free_memory is not None:
+            self.free_memory += memory
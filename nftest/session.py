@@ -0,0 +1,92 @@
+"""A Nextflow session shared by every case in a run."""
+
+import logging
+import re
+import shutil
+import threading
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from nftest.common import remove_nextflow_logs
+
+
+SESSION_ID_RE = re.compile(
+    r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"
+)
+
+
+class SharedSession:
+    """
+    A launch directory, work directory, and task cache shared between cases.
+
+    Every case is launched from the same directory with the same work
+    directory, and all but the first resume the session of the first, so
+    tasks whose inputs have not changed are not run again. Nextflow cannot
+    use a session's cache from two runs at once, so only one case runs
+    Nextflow at a time; a lock file also excludes other nftest processes.
+    Cleaning up is left to the end of the run.
+    """
+
+    def __init__(self, root: Path):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        self._lock = threading.Lock()
+        self.root = Path(root)
+        self.launch_dir = self.root / "launch"
+        self.work_dir = self.root / "work"
+        self.session_id: Optional[str] = None
+
+    @contextmanager
+    def run(self) -> Iterator[List[str]]:
+        """
+        Hold the session for one Nextflow run.
+
+        Yields the arguments needed to resume the session, and records the
+        session started by the first run.
+        """
+        # Deferred so that nftest can be imported where fcntl is unavailable
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        with self._lock:
+            self.launch_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.root / "nftest.lock", "w", encoding="utf-8") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield ["-resume", self.session_id] if self.session_id else []
+                    if self.session_id is None:
+                        self.session_id = self.last_session_id()
+                        if self.session_id is None:
+                            self._logger.warning(
+                                "No Nextflow session to resume in %s", self.launch_dir
+                            )
+                        else:
+                            self._logger.info(
+                                "Later cases will resume session %s", self.session_id
+                            )
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def last_session_id(self) -> Optional[str]:
+        """Return the ID of the latest session in the Nextflow history."""
+        try:
+            history = (self.launch_dir / ".nextflow" / "history").read_text(
+                encoding="utf-8"
+            )
+        except OSError:
+            return None
+
+        for line in reversed(history.splitlines()):
+            match = SESSION_ID_RE.search(line)
+            if match:
+                return match.group(0)
+
+        return None
+
+    def close(self, remove_temp: bool, clean_logs: bool) -> None:
+        """Clean up after every case has finished."""
+        if remove_temp:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        if clean_logs:
+            remove_nextflow_logs(self.launch_dir)
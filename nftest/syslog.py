@@ -4,7 +4,12 @@ Module for a system to capture Nextflow logs via syslog.
 
 import logging
 import re
-import socketserver
+import selectors
+import socket
+import threading
+import time
+
+from typing import Optional, Set, Tuple
 
 
 # fmt: off
@@ -20,20 +25,77 @@ LEVELS = [
 ]
 # fmt: on
 
-SYSLOG_RE = re.compile(
-    r"""
-    ^                               # Start of line
-    <(?P<priority>\d+)>             # Priority
-    (?P<month>\w{3})\s              # Month
-    (?P<day>(?:\s|\d)\d)\s          # Day (with optional leading space)
-    (?P<time>\d{2}:\d{2}:\d{2})\s   # Time
-    (?P<hostname>\S+)\s             # Hostname
-    (?P<message>.*)                 # Message
-    $                               # End of line
-    """,
-    re.VERBOSE | re.DOTALL,
+# Nextflow uses BSD-style syslog messages
+# https://datatracker.ietf.org/doc/html/rfc3164
+# Format / example:
+# <PRI>Mmm dd hh:mm:ss HOSTNAME MESSAGE"
+# <134>Jan  3 12:00:25 ip-0A125232 nextflow: INFO  [main] more...
+#
+# For most messages, nextflow seems to have a format of:
+# nextflow: LEVEL [THREAD] MODULE - MESSAGE
+#
+# nextflow: DEBUG [main] ConfigBuilder - User config file...
+# nextflow: INFO  [main] DefaultPluginStatusProvider - Enabled...
+# nextflow: ERROR [main] Launcher - Unable...
+#
+# A single pass matches the syslog header and, if present, the Nextflow
+# prefix, ending where the message text begins. The embedded date is
+# ignored for simplicity.
+NEXTFLOW_SYSLOG_RE = re.compile(
+    r"<(\d+)>\w{3}\s[\s\d]\d\s\d\d:\d\d:\d\d\s\S+\s"
+    r"(?:nextflow:\s+\w+\s+\[([^\n]+?)\] \S+ - )?"
 )
-MESSAGE_RE = re.compile(r"^nextflow:\s+\w+\s+\[(?P<thread>.+?)\] \S+ - ")
+
+# Large enough for any UDP datagram
+MAX_DATAGRAM_SIZE = 65535
+
+# Maximum datagrams read from one socket before servicing the others
+DRAIN_BATCH_SIZE = 256
+
+
+def parse_syslog(data: bytes) -> Optional[Tuple[int, str, str]]:
+    """
+    Parse a syslog datagram from Nextflow.
+
+    Returns the logging level, thread name, and message, or None if the data
+    is not a well-formatted syslog message. Messages that are well-formatted
+    syslog messages, but not well-formatted Nextflow messages, are generally
+    tracebacks: they are given the thread name `traceback`.
+    """
+    text = data.strip().decode("utf-8", errors="replace")
+    syslog_match = NEXTFLOW_SYSLOG_RE.match(text)
+    if not syslog_match:
+        return None
+
+    # The priority is 8 * facility + level - we only care about the level
+    priority, thread = syslog_match.groups()
+
+    # Strip off everything before the module if possible
+    return LEVELS[int(priority) % 8], thread or "traceback", text[syslog_match.end():]
+
+
+def emit_syslog(logger: logging.Logger, data: bytes, **extra) -> None:
+    """
+    Log a syslog datagram from Nextflow at its embedded level.
+
+    Unlike syslog_filter, the level is known before the record is created,
+    so disabled messages cost nothing more than parsing.
+    """
+    parsed = parse_syslog(data)
+    if parsed is None:
+        # This isn't a well-formatted syslog message - log it unmodified
+        logger.info(data, extra=extra)
+        return
+
+    level, thread, message = parsed
+    if not logger.isEnabledFor(level):
+        return
+
+    record = logger.makeRecord(
+        logger.name, level, "(syslog)", 0, message, None, None, extra=extra
+    )
+    record.threadName = thread
+    logger.handle(record)
 
 
 def syslog_filter(record):
@@ -44,70 +106,176 @@ def syslog_filter(record):
         # This isn't a well-formatted syslog message - don't modify it
         return record
 
-    # Nextflow uses BSD-style syslog messages
-    # https://datatracker.ietf.org/doc/html/rfc3164
-    # Format / example:
-    # <PRI>Mmm dd hh:mm:ss HOSTNAME MESSAGE"
-    # <134>Jan  3 12:00:25 ip-0A125232 nextflow: INFO  [main] more...
-    # Ignore the embedded date for simplicity
-
-    syslog_match = SYSLOG_RE.match(record.msg.strip().decode("utf-8"))
-
-    if not syslog_match:
+    parsed = parse_syslog(record.msg)
+    if parsed is None:
         # This isn't a well-formatted syslog message - don't modify it
         return record
 
-    syslog_priority = int(syslog_match.group("priority")) % 8
-
-    # The priority is 8 * facility + level - we only care about the level
-    record.levelno = LEVELS[syslog_priority]
+    record.levelno, record.threadName, record.msg = parsed
     record.levelname = logging.getLevelName(record.levelno)
 
-    # For most messages, nextflow seems to have a format of:
-    # nextflow: LEVEL [THREAD] MODULE - MESSAGE
-    #
-    # nextflow: DEBUG [main] ConfigBuilder - User config file...
-    # nextflow: INFO  [main] DefaultPluginStatusProvider - Enabled...
-    # nextflow: ERROR [main] Launcher - Unable...
+    return record
 
-    # Strip off everything before the module if possible
-    message = syslog_match.group("message")
 
-    thread_match = MESSAGE_RE.match(message)
-    if thread_match:
-        record.msg = MESSAGE_RE.sub("", message)
-        record.threadName = thread_match.group("thread")
-    else:
-        record.msg = message
-        record.threadName = "traceback"
+class SyslogChannel:
+    "The socket to which a single Nextflow process sends its syslogs."
 
-    return record
+    # pylint: disable=too-few-public-methods
 
+    def __init__(self, name: str):
+        self.name = name
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.setblocking(False)
+        self.address = self.socket.getsockname()
+        self.closed = False
+        # Statistics about the received messages
+        self.message_count = 0
+        self.first_message: Optional[float] = None
 
-class SyslogServer(socketserver.ThreadingUDPServer):
-    "A UDPServer that logs itself starting up and shutting down."
+    def drain(self, limit: Optional[int] = None) -> None:
+        "Log every datagram waiting on the socket, up to the limit."
+        logger = logging.getLogger("nextflow")
+        received = 0
+        while limit is None or received < limit:
+            try:
+                datagram = self.socket.recv(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
 
-    @classmethod
-    def make_server(cls):
-        "Create a server with a random port to handle syslogs."
-        return cls(server_address=("127.0.0.1", 0), RequestHandlerClass=SyslogHandler)
+            if self.first_message is None:
+                self.first_message = time.monotonic()
+            received += 1
+            emit_syslog(logger, datagram, case=self.name)
 
-    def serve_forever(self, poll_interval=0.5):
-        logging.getLogger(__name__).debug(
-            "Syslog server at %s:%d starting up", *self.server_address
-        )
-        return super().serve_forever(poll_interval)
+        self.message_count += received
+
+
+class SyslogReceiver:
+    """
+    A single thread that receives syslogs from many Nextflow processes.
+
+    Each case opens its own channel (a UDP socket on a random port), so
+    datagrams are attributed to the case that they were sent to. The thread
+    waits on every channel at once and drains each ready socket in batches.
+    Stopping the receiver wakes the thread immediately.
+
+    Only the thread uses the selector. Other threads add and remove channels
+    from the set of open channels, under the lock, and wake the thread to
+    update the selector from that set.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger(__name__)
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._channels: Set[SyslogChannel] = set()
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._wakeup_receiver.setblocking(False)
+        self._selector.register(self._wakeup_receiver, selectors.EVENT_READ, None)
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
 
-    def shutdown(self):
-        logging.getLogger(__name__).debug(
-            "Syslog server at %s:%d shutting down", *self.server_address
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        "Start receiving syslogs in a background thread."
+        self._running = True
+        self._thread = threading.Thread(
+            name="SyslogThread", target=self._serve, daemon=True
         )
-        return super().shutdown()
+        self._thread.start()
+        self._logger.debug("Syslog receiver starting up")
+
+    def stop(self) -> None:
+        "Stop the background thread and close every channel."
+        self._logger.debug("Syslog receiver shutting down")
+        self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+
+        with self._lock:
+            for channel in list(self._channels):
+                self._close(channel)
+        self._selector.close()
+        self._wakeup_receiver.close()
+        self._wakeup_sender.close()
+
+    def open_channel(self, name: str) -> SyslogChannel:
+        "Open a new channel for the named case."
+        channel = SyslogChannel(name)
+        with self._lock:
+            self._channels.add(channel)
+        # Make sure the thread notices the new socket
+        self._wake()
+        self._logger.debug("Syslog channel for %s at %s:%d", name, *channel.address)
+        return channel
+
+    def close_channel(self, channel: SyslogChannel) -> None:
+        "Log any remaining datagrams from a channel, then close it."
+        with self._lock:
+            self._close(channel)
+        self._wake()
+
+    def _wake(self) -> None:
+        "Wake the thread to update its selector."
+        try:
+            self._wakeup_sender.send(b"\0")
+        except OSError:
+            # The receiver has stopped
+            pass
+
+    def _close(self, channel: SyslogChannel) -> None:
+        "Drain and close a channel. The lock must be held."
+        if channel.closed:
+            return
+        self._channels.discard(channel)
+        try:
+            channel.drain()
+        finally:
+            channel.socket.close()
+            channel.closed = True
+
+    def _update_selector(self) -> None:
+        "Make the selector wait on the open channels. The lock must be held."
+        registered = {
+            key.data for key in self._selector.get_map().values() if key.data is not None
+        }
+        # Closed sockets are unregistered first, as a new socket may reuse
+        # the file descriptor of a closed one
+        for channel in registered - self._channels:
+            self._selector.unregister(channel.socket)
+        for channel in self._channels - registered:
+            self._selector.register(channel.socket, selectors.EVENT_READ, channel)
 
+    def _serve(self) -> None:
+        "Wait for and log datagrams until stopped."
+        while self._running:
+            try:
+                with self._lock:
+                    self._update_selector()
 
-class SyslogHandler(socketserver.BaseRequestHandler):
-    "A simple syslog-like server to capture formatted logs from Nextflow."
+                events = self._selector.select()
+                with self._lock:
+                    for key, _ in events:
+                        if key.data is None:
+                            self._discard_wakeups()
+                        elif not key.data.closed:
+                            key.data.drain(limit=DRAIN_BATCH_SIZE)
+            except Exception:  # pylint: disable=broad-except
+                # Keep receiving syslogs for the other cases
+                self._logger.exception("Error receiving syslog messages")
 
-    def handle(self):
-        # This is a syslog message from Nextflow
-        logging.getLogger("nextflow").info(self.request[0])
+    def _discard_wakeups(self) -> None:
+        "Discard the bytes sent to wake the thread."
+        try:
+            while self._wakeup_receiver.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
@@ -0,0 +1,88 @@
+"""Read the execution trace files written by Nextflow."""
+
+import csv
+import re
+
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# The name of the trace file written into each case's output directory
+TRACE_FILE_NAME = "nftest-trace.txt"
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+DURATION_RE = re.compile(r"([\d.]+)\s*(ms|s|m|h|d)\b")
+
+MEMORY_UNITS = {
+    "B": 1,
+    "KB": 1024,
+    "MB": 1024**2,
+    "GB": 1024**3,
+    "TB": 1024**4,
+    "PB": 1024**5,
+}
+MEMORY_RE = re.compile(r"([\d.]+)\s*([KMGTP]?B)$")
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """Convert a duration such as `1h 2m 3.5s` or `350ms` to seconds."""
+    matches = DURATION_RE.findall(text)
+    if not matches:
+        return None
+
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in matches)
+
+
+def parse_memory(text: str) -> Optional[int]:
+    """Convert a size such as `1.2 GB` to bytes."""
+    match = MEMORY_RE.match(text.strip())
+    if not match:
+        return None
+
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def parse_percent(text: str) -> Optional[float]:
+    """Convert a percentage such as `98.5%` to a number."""
+    try:
+        return float(text.strip().rstrip("%"))
+    except ValueError:
+        return None
+
+
+def read_trace(path: Path) -> List[Dict]:
+    """
+    Return the tasks in a trace file with the default (human-readable) fields.
+
+    Missing values, which Nextflow writes as `-`, are None.
+    """
+    tasks = []
+    with open(path, "rt", encoding="utf-8", newline="") as handle:
+        for row in csv.DictReader(handle, delimiter="\t"):
+            status = row.get("status", "")
+            tasks.append({
+                "name": row.get("name", ""),
+                "hash": row.get("hash", ""),
+                "status": status,
+                "exit": row.get("exit", ""),
+                "cached": status == "CACHED",
+                "realtime": parse_duration(row.get("realtime", "")),
+                "cpu_percent": parse_percent(row.get("%cpu", "")),
+                "peak_rss": parse_memory(row.get("peak_rss", "")),
+            })
+
+    return tasks
+
+
+def summarize_trace(tasks: List[Dict], top: int = 10) -> Dict:
+    """Summarize the tasks of a trace, including the slowest `top` tasks."""
+    return {
+        "tasks": len(tasks),
+        "cached": sum(1 for task in tasks if task["cached"]),
+        "realtime": sum(task["realtime"] or 0.0 for task in tasks),
+        "slowest": sorted(
+            (task for task in tasks if task["realtime"] is not None),
+            key=lambda task: task["realtime"],
+            reverse=True,
+        )[:top],
+    }
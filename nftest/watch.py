@@ -0,0 +1,316 @@
+"""Hash a case's outputs while Nextflow is still running."""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from nftest.checksum_cache import RACY_WINDOW_NS, stat_key
+from nftest.common import bytes_hashed, calculate_checksum
+
+
+# Seconds between scans of the output directory when inotify is unavailable
+POLL_INTERVAL = 1.0
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event, which is followed by `len` bytes of name
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _load_inotify():
+    """Return libc if it provides inotify, else None."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+_LIBC = _load_inotify()
+
+
+def glob_match(pattern: str, path: str) -> bool:
+    """Return True if glob.glob(pattern) would find path."""
+    pattern_parts = os.path.normpath(pattern).split(os.sep)
+    path_parts = os.path.normpath(path).split(os.sep)
+    return len(pattern_parts) == len(path_parts) and all(
+        fnmatch.fnmatchcase(part, pattern_part)
+        for part, pattern_part in zip(path_parts, pattern_parts)
+    )
+
+
+class OutputChecksums:
+    """
+    Checksums of output files, keyed on path and algorithm.
+
+    Each checksum is stored with the stat signature (device, inode, size,
+    and mtime) of the file that was hashed, and is only returned while the
+    file still has that signature.
+    """
+
+    def __init__(self):
+        """Constructor"""
+        self._lock = threading.Lock()
+        self._checksums: Dict[Tuple[str, str], Tuple[tuple, str]] = {}
+        self.hits = 0
+
+    def store(self, path: str, algorithm: str, signature: tuple, checksum: str):
+        """Record the checksum of one version of a file."""
+        with self._lock:
+            self._checksums[(os.path.abspath(path), algorithm)] = (signature, checksum)
+
+    def discard(self, path: str) -> None:
+        """Forget every checksum of a file."""
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in [key for key in self._checksums if key[0] == path]:
+                del self._checksums[key]
+
+    def clear(self) -> None:
+        """Forget every checksum."""
+        with self._lock:
+            self._checksums.clear()
+
+    def signature(self, path: str, algorithm: str) -> Optional[tuple]:
+        """Return the signature of the version of a file that was hashed."""
+        with self._lock:
+            entry = self._checksums.get((os.path.abspath(path), algorithm))
+        return None if entry is None else entry[0]
+
+    def lookup(self, path: Path, algorithm: str) -> Optional[str]:
+        """Return the checksum of a file if it has not changed since it was hashed."""
+        with self._lock:
+            entry = self._checksums.get((os.path.abspath(path), algorithm))
+        if entry is None:
+            return None
+
+        try:
+            if stat_key(os.stat(path)) != entry[0]:
+                return None
+        except OSError:
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return entry[1]
+
+
+class OutputWatcher:
+    """
+    Hash output files that match assertion globs as Nextflow writes them.
+
+    A thread watches the output directory tree with inotify, or scans it
+    every POLL_INTERVAL seconds where inotify is unavailable. A file is
+    hashed once it is closed after writing, or moved or linked into place
+    (as by `publishDir`). When polling, a file is hashed once it is
+    unchanged between two scans. A file that is written again is hashed
+    again. The checksums are recorded in an OutputChecksums; anything not
+    hashed in time is hashed by the assertion as usual.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        patterns: List[Tuple[str, str]],
+        checksums: OutputChecksums,
+        poll: bool = False,
+    ):
+        """Constructor"""
+        self._logger = logging.getLogger("NFTest")
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._fd: Optional[int] = None
+        self._watches: Dict[int, str] = {}
+        self.directory = str(directory)
+        # (glob, algorithm) for every checksum assertion
+        self.patterns = patterns
+        self.checksums = checksums
+        self.poll = poll or _LIBC is None
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+
+    def start(self) -> None:
+        """Start watching the output directory."""
+        os.makedirs(self.directory, exist_ok=True)
+
+        if not self.poll:
+            fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                self._logger.debug(
+                    "inotify unavailable (%s); polling", os.strerror(ctypes.get_errno())
+                )
+                self.poll = True
+            else:
+                self._fd = fd
+                # Files already in place are left over from an earlier run
+                self._watch_tree(self.directory, scan=False)
+
+        self._thread = threading.Thread(
+            target=self._poll_loop if self.poll else self._inotify_loop,
+            name="NFTestOutputWatcher",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching, once Nextflow has finished writing."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._fd is not None:
+            # Any file written since it was last hashed must be hashed again
+            # by its assertion
+            for path, mask in self._read_events():
+                if mask & IN_Q_OVERFLOW:
+                    self.checksums.clear()
+                else:
+                    self.checksums.discard(path)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def _algorithms(self, path: str) -> List[str]:
+        """Return the algorithms of the assertions whose globs match path."""
+        return sorted({
+            algorithm
+            for pattern, algorithm in self.patterns
+            if glob_match(pattern, path)
+        })
+
+    def _hash(self, path: str, written: bool) -> None:
+        """
+        Hash a finished file with the algorithm of every matching assertion.
+
+        A file that inotify reports `written` is hashed even if its signature
+        is unchanged, as it may have been rewritten within one mtime tick.
+        Otherwise the file is only hashed if its signature has changed, and
+        not while it could still change without its signature changing.
+        """
+        for algorithm in self._algorithms(path):
+            try:
+                before = os.stat(path)
+                if not written and (
+                    self.checksums.signature(path, algorithm) == stat_key(before)
+                    or time.time_ns() - before.st_mtime_ns < RACY_WINDOW_NS
+                ):
+                    continue
+
+                start_bytes = bytes_hashed()
+                checksum = calculate_checksum(path, algorithm, use_cache=False)
+                self.bytes_hashed += bytes_hashed() - start_bytes
+
+                # The file was changed while it was read
+                if stat_key(os.stat(path)) != stat_key(before):
+                    continue
+            except OSError as error:
+                self._logger.debug("Not hashing %s: %s", path, error)
+                continue
+
+            self.checksums.store(path, algorithm, stat_key(before), checksum)
+            self.files_hashed += 1
+
+    def _poll_loop(self) -> None:
+        """Hash matching files that are unchanged between scans."""
+        previous: Dict[str, tuple] = {}
+        while not self._stop.wait(POLL_INTERVAL):
+            current = {}
+            for dirpath, _, filenames in os.walk(self.directory):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    if not self._algorithms(path):
+                        continue
+                    try:
+                        current[path] = stat_key(os.stat(path))
+                    except OSError:
+                        continue
+                    if previous.get(path) == current[path]:
+                        self._hash(path, written=False)
+            previous = current
+
+    def _inotify_loop(self) -> None:
+        """Hash matching files as inotify reports them finished."""
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], POLL_INTERVAL)
+            if not readable:
+                continue
+
+            for path, mask in self._read_events():
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, so look at every file
+                    self._watch_tree(self.directory, scan=True)
+                elif mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._watch_tree(path, scan=True)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._hash(path, written=True)
+                elif mask & IN_CREATE and self._is_link(path):
+                    self._hash(path, written=True)
+                elif mask & IN_ATTRIB:
+                    # A copy may set its mtime to that of the original
+                    self._hash(path, written=False)
+
+    @staticmethod
+    def _is_link(path: str) -> bool:
+        """Return True if path was linked to a file written elsewhere."""
+        try:
+            return os.path.islink(path) or os.stat(path).st_nlink > 1
+        except OSError:
+            return False
+
+    def _watch_tree(self, directory: str, scan: bool) -> None:
+        """Watch a directory and its subdirectories, hashing their files if scan."""
+        for dirpath, _, filenames in os.walk(directory):
+            wd = _LIBC.inotify_add_watch(self._fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd >= 0:
+                self._watches[wd] = dirpath
+            if scan:
+                for filename in filenames:
+                    self._hash(os.path.join(dirpath, filename), written=True)
+
+    def _read_events(self) -> Iterator[Tuple[str, int]]:
+        """Yield the path and mask of every pending inotify event."""
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                name = data[
+                    offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length
+                ].rstrip(b"\0")
+                offset += INOTIFY_EVENT.size + length
+                if wd in self._watches:
+                    yield os.path.join(self._watches[wd], os.fsdecode(name)), mask
+                elif mask & IN_Q_OVERFLOW:
+                    yield self.directory, mask
@@ -2,6 +2,9 @@
 
 import pytest
 
+from nftest.checksum_cache import ChecksumCache
+from nftest.NFTestENV import NFTestENV
+
 
 def pytest_configure(config):
     "Hook to add in the custom marker."
@@ -19,3 +22,21 @@ def pytest_runtest_setup(item):
     failure_types = {mark.args[0] for mark in item.iter_markers(name="xfailgroup")}
     if failure_types:
         item.add_marker(pytest.mark.xfail(raises=tuple(failure_types)))
+
+
+@pytest.fixture(autouse=True)
+def isolated_checksum_cache(tmp_path):
+    "Keep the persistent checksum cache out of the working directory."
+    # pylint: disable=protected-access
+    previous = ChecksumCache._instances.pop(ChecksumCache, None)
+    ChecksumCache(path=tmp_path / "checksums.sqlite3")
+    yield
+    ChecksumCache._instances.pop(ChecksumCache, None)
+    if previous is not None:
+        ChecksumCache._instances[ChecksumCache] = previous
+
+
+@pytest.fixture(autouse=True)
+def isolated_history(tmp_path, monkeypatch):
+    "Keep the history of case durations out of the working directory."
+    monkeypatch.setattr(NFTestENV(), "NFT_HISTORY", str(tmp_path / "history.json"))
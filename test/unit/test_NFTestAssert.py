@@ -1,8 +1,11 @@
 """Test module for NFTestAssert"""
 
 import datetime
+import gzip
+import hashlib
 import logging
 import stat
+import sys
 import textwrap
 import time
 from collections import namedtuple
@@ -14,7 +17,11 @@ from nftest.NFTestAssert import (
     NotUpdatedError,
     MismatchedContentsError,
     NonSpecificGlobError,
+    ScriptBatch,
+    ScriptTimeoutError,
 )
+from nftest.checksum_cache import stat_key
+from nftest.watch import OutputChecksums
 
 
 @pytest.fixture(name="custom_script")
@@ -167,6 +174,9 @@ FILEUPDATED_PARAMS = [
     "method",
     [
         "md5",
+        "sha256",
+        "blake2b",
+        "bytes",
     ],
     indirect=True,
 )
@@ -217,3 +227,211 @@ def test_nftest_assert(
     # The sentinel text should be in the output if and only if the custom
     # script was used
     assert used_custom_script == flag_in_logs
+
+
+def test_assertion_timing(tmp_path):
+    """Assertions record their duration and the bytes that they hashed."""
+    expect_file = tmp_path / "file.expect"
+    expect_file.write_text("x" * 1000, encoding="utf-8")
+    assertion = NFTestAssert(
+        actual=str(tmp_path / "file.actual"), expect=str(expect_file), method="sha256"
+    )
+    time.sleep(0.01)
+    (tmp_path / "file.actual").write_text("x" * 1000, encoding="utf-8")
+
+    assertion.perform_assertions()
+
+    assert assertion.timing["bytes_hashed"] == 2000
+    assert assertion.timing["seconds"] > 0
+
+
+def test_watched_output_not_rehashed(tmp_path):
+    """An output hashed while Nextflow ran is not read again."""
+    expect_file = tmp_path / "file.expect"
+    expect_file.write_text("x" * 1000, encoding="utf-8")
+    assertion = NFTestAssert(
+        actual=str(tmp_path / "file.actual"), expect=str(expect_file), method="sha256"
+    )
+    time.sleep(0.01)
+    actual_file = tmp_path / "file.actual"
+    actual_file.write_text("x" * 1000, encoding="utf-8")
+
+    assertion.output_checksums = OutputChecksums()
+    assertion.output_checksums.store(
+        str(actual_file),
+        "sha256",
+        stat_key(actual_file.stat()),
+        hashlib.sha256(b"x" * 1000).hexdigest(),
+    )
+    assertion.perform_assertions()
+
+    assert assertion.timing["bytes_hashed"] == 1000
+    assert assertion.output_checksums.hits == 1
+
+
+@pytest.mark.parametrize(
+    "actual_text,expect_text,offset,reason",
+    [
+        ("abcdef", "abcxef", 3, None),
+        ("abcdef", "abc", None, "sizes differ (6 != 3 bytes)"),
+    ],
+)
+def test_bytes_mismatch_details(tmp_path, actual_text, expect_text, offset, reason):
+    """The bytes method reports where the files first differ."""
+    expect_file = tmp_path / "file.expect"
+    expect_file.write_text(expect_text, encoding="utf-8")
+    assertion = NFTestAssert(
+        actual=str(tmp_path / "file.actual"), expect=str(expect_file), method="bytes"
+    )
+    # Create the actual file after the assertion so that it counts as updated
+    time.sleep(0.01)
+    (tmp_path / "file.actual").write_text(actual_text, encoding="utf-8")
+
+    with pytest.raises(MismatchedContentsError) as excinfo:
+        assertion.perform_assertions()
+
+    assert excinfo.value.offset == offset
+    assert excinfo.value.reason == reason
+
+
+@pytest.mark.parametrize(
+    "actual_text,matches",
+    [
+        (b"same contents", True),
+        (b"different contents", False),
+    ],
+)
+def test_gzip_content(tmp_path, actual_text, matches):
+    """gzip-content ignores gzip header differences such as mtime."""
+    expect_file = tmp_path / "file.expect.gz"
+    expect_file.write_bytes(gzip.compress(b"same contents", mtime=1))
+    assertion = NFTestAssert(
+        actual=str(tmp_path / "file.actual.gz"),
+        expect=str(expect_file),
+        method="gzip-content",
+    )
+    time.sleep(0.01)
+    (tmp_path / "file.actual.gz").write_bytes(gzip.compress(actual_text, mtime=2))
+
+    if matches:
+        assertion.perform_assertions()
+    else:
+        with pytest.raises(MismatchedContentsError) as excinfo:
+            assertion.perform_assertions()
+        assert excinfo.value.offset == 0
+
+
+def test_script_batch(tmp_path):
+    """A batch script runs once and its results go to the right assertions."""
+    launches = tmp_path / "launches.txt"
+    script = tmp_path / "batch.py"
+    script.write_text(
+        textwrap.dedent(f"""\
+        #!{sys.executable}
+        import json, sys
+        with open({str(launches)!r}, "a") as handle:
+            handle.write("launched\\n")
+        print("not a result")
+        for line in sys.stdin:
+            pair = json.loads(line)
+            with open(pair["actual"]) as actual, open(pair["expect"]) as expect:
+                passed = actual.read() == expect.read()
+            print(json.dumps({{"id": pair["id"], "passed": passed, "message": "diff"}}))
+        """),
+        encoding="utf-8",
+    )
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+
+    assertions = []
+    for index in range(3):
+        (tmp_path / f"{index}.expect").write_text("same", encoding="utf-8")
+        assertions.append(
+            NFTestAssert(
+                actual=str(tmp_path / f"{index}.actual"),
+                expect=str(tmp_path / f"{index}.expect"),
+                script=str(script),
+                batch=True,
+            )
+        )
+
+    time.sleep(0.01)
+    for index, text in enumerate(["same", "different", "same"]):
+        (tmp_path / f"{index}.actual").write_text(text, encoding="utf-8")
+
+    ScriptBatch.attach(assertions)
+
+    assertions[0].perform_assertions()
+    with pytest.raises(MismatchedContentsError) as excinfo:
+        assertions[1].perform_assertions()
+    assert excinfo.value.reason == "diff"
+    assertions[2].perform_assertions()
+
+    assert launches.read_text(encoding="utf-8") == "launched\n"
+
+
+def test_script_batch_invalid_results(tmp_path):
+    """Pairs whose results have an invalid id or passed value fail."""
+    script = tmp_path / "batch.py"
+    script.write_text(
+        textwrap.dedent(f"""\
+        #!{sys.executable}
+        import json, sys
+        for line in sys.stdin:
+            pair = json.loads(line)
+            print(json.dumps({{"id": -1, "passed": True}}))
+            print(json.dumps({{"id": True, "passed": True}}))
+            print(json.dumps({{"id": str(pair["id"]), "passed": True}}))
+            print(json.dumps({{"id": pair["id"], "passed": "false"}}))
+        """),
+        encoding="utf-8",
+    )
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+
+    assertions = []
+    for index in range(2):
+        (tmp_path / f"{index}.expect").write_text("same", encoding="utf-8")
+        assertions.append(
+            NFTestAssert(
+                actual=str(tmp_path / f"{index}.actual"),
+                expect=str(tmp_path / f"{index}.expect"),
+                script=str(script),
+                batch=True,
+            )
+        )
+
+    time.sleep(0.01)
+    for index in range(2):
+        (tmp_path / f"{index}.actual").write_text("same", encoding="utf-8")
+
+    ScriptBatch.attach(assertions)
+
+    for assertion in assertions:
+        with pytest.raises(MismatchedContentsError) as excinfo:
+            assertion.perform_assertions()
+        assert excinfo.value.reason == f"{script} returned no result"
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_script_timeout(tmp_path, batch):
+    """A script that outlives its timeout is killed"""
+    script = tmp_path / "hang.sh"
+    script.write_text("#!/bin/sh\nsleep 60\n", encoding="utf-8")
+    script.chmod(script.stat().st_mode | stat.S_IXUSR)
+
+    (tmp_path / "expect").write_text("same", encoding="utf-8")
+    assertion = NFTestAssert(
+        actual=str(tmp_path / "actual"),
+        expect=str(tmp_path / "expect"),
+        script=str(script),
+        batch=batch,
+        timeout=0.5,
+    )
+    time.sleep(0.01)
+    (tmp_path / "actual").write_text("same", encoding="utf-8")
+    ScriptBatch.attach([assertion])
+
+    start_time = time.monotonic()
+    with pytest.raises(ScriptTimeoutError) as excinfo:
+        assertion.perform_assertions()
+    assert time.monotonic() - start_time < 30
+    assert excinfo.value.timeout == 0.5
@@ -1,9 +1,20 @@
 # pylint: disable=W0212
 """Test module for NFTestCase"""
 
-from types import SimpleNamespace
+import functools
+import os
+import signal
+import subprocess
+import threading
+import time
+import types
+from pathlib import Path
 import mock
+from nftest.common import TestResult as Result
+from nftest.NFTestAssert import NFTestAssert
 from nftest.NFTestCase import NFTestCase
+from nftest.NFTestENV import NFTestENV
+from nftest.session import SharedSession
 
 
 @mock.patch("nftest.NFTestCase.NFTestCase", wraps=NFTestCase)
@@ -15,6 +26,7 @@ def test_combine_global(mock_case):
     mock_case.return_value.remove_temp = None
     mock_case.return_value.temp_dir = None
     mock_case.return_value.clean_logs = None
+    mock_case.return_value.asserts = []
     mock_case.return_value._global.remove_temp = test_remove_temp
     mock_case.return_value._global.temp_dir = test_temp_directory
     mock_case.return_value._global.clean_logs = test_clean_logs
@@ -27,27 +39,242 @@ def test_combine_global(mock_case):
     assert case.clean_logs == test_clean_logs
 
 
-@mock.patch("nftest.common.selectors")
-@mock.patch("nftest.common.subprocess.Popen")
+@mock.patch("nftest.NFTestCase.popen_with_logger")
 @mock.patch("nftest.NFTestCase.NFTestCase", wraps=NFTestCase)
-def test_submit(mock_case, mock_sp, mock_selectors):
+def test_submit(mock_case, mock_popen):
     """Tests for submission step"""
-    test_stdout = "hello world"
-
-    mock_sp.return_value.__enter__ = lambda x: SimpleNamespace(**{
-        "stdout": test_stdout,
-        "stderr": "",
-        "poll": lambda: True,
-    })
-    mock_selectors.DefaultSelector.register.return_value = lambda x, y, z: None
+    mock_popen.return_value = subprocess.CompletedProcess([], 0)
 
     mock_case.return_value.params_file = ""
-    mock_case.return_value.output_directory_param_name = ""
+    mock_case.return_value.output_directory_param_name = "output_dir"
     mock_case.return_value._env.NFT_OUTPUT = ""
-    mock_case.return_value.temp_dir = ""
-    mock_case.return_value.nf_script = ""
+    mock_case.return_value.temp_dir = "work"
+    mock_case.return_value.nf_script = "main.nf"
+    mock_case.return_value.profiles = []
+    mock_case.return_value.nf_configs = []
+    mock_case.return_value.reference_params = [("reference", "ref.fa")]
+    mock_case.return_value.launch_dir = None
+    mock_case.return_value.shared_session = None
+    mock_case.return_value.resource_interval = None
+    mock_case.return_value.trace = False
+    mock_case.return_value.name_for_output = "name"
     mock_case.return_value.submit = NFTestCase.submit
 
     case = mock_case()
+    for helper in ("join_shared_session", "nextflow_command", "run_nextflow"):
+        setattr(case, helper, functools.partial(getattr(NFTestCase, helper), case))
+
+    assert case.submit(case).returncode == 0
+
+    command = mock_popen.call_args.args[0]
+    assert command[:3] == ["nextflow", "-quiet", "-syslog"]
+    assert command[4:] == ["run", "main.nf", "--reference", "ref.fa", "--output_dir", "name"]
+    assert mock_popen.call_args.kwargs["env"]["NXF_WORK"] == "work"
+
+
+@mock.patch("nftest.NFTestCase.NFTestCase", wraps=NFTestCase)
+def test_isolate_directories(mock_case):
+    """Tests that each case gets a private launch and work directory"""
+    mock_case.return_value.temp_dir = "global_temp_dir"
+    mock_case.return_value.name_for_output = "case-one"
+    mock_case.return_value.isolate_directories = NFTestCase.isolate_directories
+
+    case = mock_case()
+    case.isolate_directories(case)
+
+    assert case.launch_dir == Path("global_temp_dir", "case-one", "launch")
+    assert case.temp_dir == str(Path("global_temp_dir", "case-one", "work"))
+
+
+def test_isolated_directories_removed(tmp_path):
+    """With remove_temp, a parallel case's directories are removed"""
+    case = NFTestCase(name="case one", temp_dir=str(tmp_path), remove_temp=True)
+    case.isolate_directories()
+    (case.launch_dir / ".nextflow").mkdir(parents=True)
+    (case.launch_dir / ".nextflow.log").touch()
+    Path(case.temp_dir).mkdir()
+
+    case.remove_launch_dir()
+    assert list(case.launch_dir.iterdir()) == [case.launch_dir / ".nextflow.log"]
+
+    # Without logs, nothing of the case is left once its work directory is gone
+    (case.launch_dir / ".nextflow.log").unlink()
+    Path(case.temp_dir).rmdir()
+    case.remove_launch_dir()
+    assert list(tmp_path.iterdir()) == []
+
+
+@mock.patch("nftest.NFTestCase.popen_with_logger")
+def test_submit_shared_session(mock_popen, tmp_path):
+    """Tests that cases after the first resume a shared session"""
+    session = SharedSession(tmp_path)
+
+    def run_nextflow(command, **kwargs):
+        # Record the session that Nextflow would have started
+        history = kwargs["cwd"] / ".nextflow" / "history"
+        history.parent.mkdir(exist_ok=True)
+        history.write_text(
+            "2024-01-01 00:00:00\t1s\tsad_turing\tOK\tabc123\t"
+            "0c5ab6b5-8d4b-4a4c-9e6a-3f1b2f4c6d7e\tnextflow run main.nf\n",
+            encoding="utf-8",
+        )
+        return subprocess.CompletedProcess(command, 0)
+
+    mock_popen.side_effect = run_nextflow
+
+    commands = []
+    for name in ("first", "second"):
+        case = NFTestCase(name=name, nf_script="main.nf")
+        case.share_session(session)
+        case.submit()
+        commands.append(mock_popen.call_args.args[0])
+
+        assert mock_popen.call_args.kwargs["cwd"] == tmp_path / "launch"
+        assert mock_popen.call_args.kwargs["env"]["NXF_WORK"] == str(tmp_path / "work")
+
+    assert "-resume" not in commands[0]
+    resume = commands[1].index("-resume")
+    assert commands[1][resume + 1] == "0c5ab6b5-8d4b-4a4c-9e6a-3f1b2f4c6d7e"
+
+
+@mock.patch("nftest.NFTestCase.popen_with_logger")
+def test_submit_trace(mock_popen, tmp_path, monkeypatch):
+    """Tests that a requested trace is written to the output directory and read"""
+    monkeypatch.chdir(tmp_path)
+
+    def run_nextflow(command, **_):
+        trace = Path(command[command.index("-with-trace") + 1])
+        assert not trace.exists()
+        trace.parent.mkdir(parents=True, exist_ok=True)
+        trace.write_text(
+            "name\tstatus\trealtime\t%cpu\tpeak_rss\n"
+            "FAST\tCOMPLETED\t1s\t100.0%\t1 MB\n"
+            "SLOW\tCACHED\t1m\t100.0%\t1 MB\n",
+            encoding="utf-8",
+        )
+        return subprocess.CompletedProcess(command, 0)
+
+    mock_popen.side_effect = run_nextflow
+
+    case = NFTestCase(name="traced", nf_script="main.nf")
+    case.trace = True
+    case.trace_top = 1
+
+    # A trace left over from an earlier run is replaced
+    case.submit()
+    case.submit()
+
+    assert case.trace_summary["tasks"] == 2
+    assert case.trace_summary["cached"] == 1
+    assert [task["name"] for task in case.trace_summary["slowest"]] == ["SLOW"]
+
+
+@mock.patch("nftest.NFTestCase.popen_with_logger")
+def test_failure_recorded(mock_popen, tmp_path):
+    """Tests that the reason a case did not pass is recorded"""
+    mock_popen.return_value = subprocess.CompletedProcess([], 1)
+    case = NFTestCase(name="errored", nf_script="main.nf", temp_dir=str(tmp_path))
+
+    assert not case.test()
+    assert case.failure == {
+        "type": "NextflowError",
+        "message": "Nextflow exited with code 1",
+    }
+
+
+@mock.patch("nftest.NFTestCase.popen_with_logger")
+def test_cancelled_case_not_run(mock_popen, tmp_path):
+    """Tests that a case whose Nextflow run is cancelled is not run"""
+    case = NFTestCase(name="cancelled", nf_script="main.nf", temp_dir=str(tmp_path))
+    case.cancel_event = threading.Event()
+
+    def run_nextflow(command, **kwargs):
+        assert kwargs["cancel"] is case.cancel_event
+        assert kwargs["start_new_session"]
+        case.cancel_event.set()
+        return subprocess.CompletedProcess(command, -signal.SIGTERM)
+
+    mock_popen.side_effect = run_nextflow
+
+    assert case.test()
+    assert case.status == Result.NOT_RUN
+    assert case.failure is None
+
+
+@mock.patch("nftest.NFTestCase.popen_with_logger")
+def test_timed_out_case(mock_popen, tmp_path):
+    """Tests that a case whose Nextflow run times out is recorded as such"""
+    case = NFTestCase(name="slow", nf_script="main.nf", temp_dir=str(tmp_path))
+    case.combine_global(
+        types.SimpleNamespace(
+            nf_config=None, remove_temp=True, temp_dir=None, clean_logs=True, timeout=60
+        )
+    )
+
+    def run_nextflow(command, **kwargs):
+        assert kwargs["timeout"] == 60
+        assert kwargs["start_new_session"]
+        raise subprocess.TimeoutExpired(command, kwargs["timeout"])
+
+    mock_popen.side_effect = run_nextflow
+
+    assert not case.test()
+    assert case.status == Result.TIMEOUT
+    assert case.failure["type"] == "TimeoutExpired"
+
+
+def test_assertions_inherit_timeout():
+    """Tests that script assertions are limited like their case by default"""
+    asserts = [
+        NFTestAssert(actual="a", expect="a", script="diff"),
+        NFTestAssert(actual="b", expect="b", script="diff", timeout=5),
+    ]
+    case = NFTestCase(name="case", asserts=asserts, timeout=60)
+    case.combine_global(
+        types.SimpleNamespace(
+            nf_config=None, remove_temp=True, temp_dir="t", clean_logs=True, timeout=None
+        )
+    )
+
+    assert case.timeout == 60
+    assert [assertion.timeout for assertion in case.asserts] == [60, 5]
+
+
+def test_watched_outputs_reported(tmp_path, monkeypatch):
+    """The hashing done while Nextflow ran is recorded on the case"""
+    monkeypatch.setattr(NFTestENV(), "NFT_OUTPUT", str(tmp_path))
+    case = NFTestCase(
+        name="case", asserts=[NFTestAssert("out.txt", str(tmp_path / "expect.txt"))]
+    )
+
+    with case.watching_outputs():
+        pass
+    assert case.watched_outputs is None
+
+    case.watch_outputs = True
+    with case.watching_outputs():
+        pass
+    assert case.watched_outputs == {"files_hashed": 0, "bytes_hashed": 0}
+
+
+def test_watched_outputs_symlinked_output_dir(tmp_path, monkeypatch):
+    """Outputs are hashed while running when NFT_OUTPUT is a symlink"""
+    (tmp_path / "real").mkdir()
+    (tmp_path / "link").symlink_to(tmp_path / "real")
+    monkeypatch.setattr(NFTestENV(), "NFT_OUTPUT", str(tmp_path / "link"))
+    case = NFTestCase(
+        name="case", asserts=[NFTestAssert("out.txt", str(tmp_path / "expect.txt"))]
+    )
+    case.watch_outputs = True
+
+    with case.watching_outputs():
+        output = Path(case.asserts[0].actual)
+        output.write_text("output", encoding="utf-8")
+        os.utime(output, ns=(10**18, 10**18))
+
+        deadline = time.monotonic() + 5
+        while case.asserts[0].output_checksums.lookup(output, "md5") is None:
+            assert time.monotonic() < deadline, "The output was not hashed"
+            time.sleep(0.01)
 
-    assert case.submit(case).stdout == test_stdout
+    assert case.watched_outputs["files_hashed"] >= 1
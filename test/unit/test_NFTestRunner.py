@@ -1,8 +1,18 @@
 """Test module for NFTestRunner"""
 
+import json
+import logging
+import os
+import signal
+import threading
+import time
 from dataclasses import dataclass
 from unittest.mock import mock_open
 import mock
+import pytest
+from nftest.common import TestResult as Result
+from nftest.history import CaseHistory
+from nftest.NFTestENV import NFTestENV
 from nftest.NFTestRunner import NFTestRunner
 
 
@@ -40,8 +50,6 @@ def test_load_from_config(
             {"name": "case2", "nf_config": None},
         ],
     }
-    mock_case.return_value = lambda **kwargs: kwargs["name"]
-    mock_case.return_value.combine_global = lambda x: None
     mock_runner.return_value.load_from_config = NFTestRunner.load_from_config
 
     runner = mock_runner()
@@ -49,3 +57,330 @@ def test_load_from_config(
     runner.load_from_config(runner_data, "None", None)
 
     assert len(runner_data.cases) == 2
+
+
+class FakeCase:
+    """Minimal stand-in for an NFTestCase that finishes after a delay"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, delay, passes):
+        self.name = name
+        self.name_for_output = name
+        self.delay = delay
+        self.passes = passes
+        self.status = Result.PENDING
+        self.isolated = False
+        self.skip = False
+        self.reference_files = []
+        self.incremental = None
+        self.cached = False
+        self.timings = {}
+        self.asserts = []
+        self.resource_interval = None
+        self.resource_usage = None
+        self.trace = False
+        self.trace_top = 10
+        self.trace_summary = None
+        self.cpus = None
+        self.memory = None
+        self.failure = None
+        self.cancel_event = None
+        self.watch_outputs = False
+        self.watched_outputs = None
+        self.temp_dir = None
+        self.remove_temp = None
+        self.shared_session = None
+
+    def share_session(self, session):
+        """Record the shared session"""
+        self.shared_session = session
+    def isolate_directories(self):
+        """Record that the runner isolated this case"""
+        self.isolated = True
+
+    def test(self):
+        """Sleep, then pass or fail, unless cancelled first"""
+        if self.cancel_event is not None and self.cancel_event.wait(self.delay):
+            self.status = Result.NOT_RUN
+            return True
+        self.status = Result.PASSED if self.passes else Result.FAILED
+        if not self.passes:
+            self.failure = {"type": "NotUpdatedError", "message": "not updated"}
+        return self.passes
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_main_parallel(jobs):
+    """Failures are counted correctly when cases finish out of order"""
+    cases = [
+        FakeCase("slow_fail", 0.3, False),
+        FakeCase("fast_pass", 0.0, True),
+        FakeCase("medium_fail", 0.1, False),
+        FakeCase("fast_pass2", 0.0, True),
+    ]
+    runner = NFTestRunner(cases=cases, jobs=jobs)
+
+    assert runner.main() == 2
+    assert all(case.isolated == (jobs > 1) for case in cases)
+
+
+def test_main_longest_first():
+    """With history, parallel runs start the longest cases first"""
+    history = CaseHistory()
+    history.record({"short": 1.0, "medium": 5.0, "long": 10.0})
+    history.save()
+
+    started = []
+    cases = [
+        FakeCase("short", 0, True),
+        FakeCase("medium", 0.2, True),
+        FakeCase("long", 0.2, True),
+    ]
+    for case in cases:
+        case.test = lambda case=case, test=case.test: started.append(case.name) or test()
+
+    NFTestRunner(cases=cases, jobs=2).main()
+
+    assert set(started[:2]) == {"medium", "long"}
+    assert started[2] == "short"
+
+    # This run's durations are added to the history
+    assert all(len(durations) == 2 for durations in CaseHistory().durations.values())
+
+
+def test_main_resource_budget():
+    """Parallel cases never hold more CPUs than the budget"""
+    lock = threading.Lock()
+    held = []
+    peak = [0]
+
+    cases = [
+        FakeCase("large", 0.2, True),
+        FakeCase("large2", 0.2, True),
+        FakeCase("small", 0.05, True),
+    ]
+    cases[0].cpus = cases[1].cpus = 3
+    for case in cases:
+        def test(case=case, test=case.test):
+            with lock:
+                held.append(case.cpus or 1)
+                peak[0] = max(peak[0], sum(held))
+            try:
+                return test()
+            finally:
+                with lock:
+                    held.remove(case.cpus or 1)
+        case.test = test
+
+    assert NFTestRunner(cases=cases, jobs=3, max_cpus=4).main() == 0
+    assert peak[0] == 4
+
+
+@mock.patch("nftest.NFTestRunner.IncrementalState")
+def test_main_incremental(mock_state):
+    """Cases that run are recorded in the incremental state"""
+    cases = [FakeCase("pass", 0, True), FakeCase("fail", 0, False)]
+    cases.append(FakeCase("cached", 0, True))
+    cases[-1].cached = True
+
+    assert NFTestRunner(cases=cases, incremental=True).main() == 1
+
+    state = mock_state.return_value
+    assert all(case.incremental is state for case in cases)
+    assert [call.args[0].name for call in state.record.call_args_list] == [
+        "pass",
+        "fail",
+    ]
+    state.save.assert_called_once_with()
+
+
+@mock.patch("nftest.NFTestRunner.validate_references")
+def test_validate_references_skips_unused_cases(mock_validate):
+    """Only the references of cases that will run are validated"""
+    mock_validate.return_value = 1024
+    reference = {"reference_parameter_name": "ref"}
+    running = FakeCase("running", 0, True)
+    running.reference_files = [reference]
+    skipped = FakeCase("skipped", 0, True)
+    skipped.skip = True
+    skipped.reference_files = [{"reference_parameter_name": "other"}]
+
+    stats = NFTestRunner(cases=[running, skipped]).validate_references()
+
+    mock_validate.assert_called_once_with([reference])
+    assert stats["files"] == 1
+    assert stats["bytes_hashed"] == 1024
+
+
+def test_main_shard(tmp_path, monkeypatch):
+    """Each shard runs its own cases and writes its own report"""
+    monkeypatch.setattr(NFTestENV(), "NFT_LOG", str(tmp_path / "log.log"))
+    names = ["a", "b", "c", "d", "e"]
+
+    ran = []
+    for index in (1, 2):
+        cases = [FakeCase(name, 0, True) for name in names]
+        runner = NFTestRunner(cases=cases, report=True, shard=(index, 2))
+        assert runner.main() == 0
+        ran.append(sorted(runner.report.passed_tests))
+
+        with open(tmp_path / f"log.shard-{index}-of-2.json", encoding="utf-8") as infile:
+            report = json.load(infile)
+        assert report["shard"] == f"{index}/2"
+        assert sorted(report["passed_tests"]) == ran[-1]
+
+    assert sorted(ran[0] + ran[1]) == names
+    assert {len(ran[0]), len(ran[1])} == {2, 3}
+
+
+def test_select_shard_logs_history(tmp_path, caplog):
+    """Shards log the history that their split was based on"""
+    history = CaseHistory(tmp_path / "history.json")
+    runner = NFTestRunner(cases=[FakeCase("a", 0, True)], shard=(1, 2))
+    with caplog.at_level(logging.INFO):
+        runner.select_shard(history)
+    assert f"Splitting cases by name: {history.path} has no durations" in caplog.text
+
+    history.record({"a": 5.0})
+    runner = NFTestRunner(cases=[FakeCase("a", 0, True)], shard=(1, 2))
+    with caplog.at_level(logging.INFO):
+        runner.select_shard(history)
+    assert f"(digest {history.digest(['a'])})" in caplog.text
+
+
+def test_main_streams_report(tmp_path, monkeypatch):
+    """Each case is appended to the report stream as it finishes"""
+    monkeypatch.setattr(NFTestENV(), "NFT_LOG", str(tmp_path / "log.log"))
+    cases = [FakeCase("slow_pass", 0.1, True), FakeCase("fast_fail", 0, False)]
+
+    assert NFTestRunner(cases=cases, report=True, jobs=2).main() == 1
+
+    with open(tmp_path / "log.cases.jsonl", encoding="utf-8") as infile:
+        records = [json.loads(line) for line in infile]
+    assert [record["name"] for record in records] == ["fast_fail", "slow_pass"]
+    assert records[0]["status"] == "FAILED"
+    assert records[0]["failure"]["type"] == "NotUpdatedError"
+    assert records[1]["failure"] is None
+    # Start times are in UTC, like the start of the report
+    assert all(record["start"].endswith("+00:00") for record in records)
+
+    # The stream's path is not part of the report
+    with open(tmp_path / "log.json", encoding="utf-8") as infile:
+        assert "_stream_path" not in json.load(infile)
+
+
+def test_main_maxfail():
+    """Once enough cases fail, the rest are not run"""
+    cases = [
+        FakeCase("pass", 0, True),
+        FakeCase("fail", 0, False),
+        FakeCase("fail2", 0, False),
+        FakeCase("pass2", 0, True),
+    ]
+    runner = NFTestRunner(cases=cases, max_failures=1)
+
+    assert runner.main() == 1
+    assert list(runner.report.passed_tests) == ["pass"]
+    assert list(runner.report.failed_tests) == ["fail"]
+    assert sorted(runner.report.not_run_tests) == ["fail2", "pass2"]
+
+
+def test_main_fail_fast_stops_running_cases():
+    """With fail-fast, cases that are running when a case fails are stopped"""
+    cases = [
+        FakeCase("slow", 30, True),
+        FakeCase("fail", 0.1, False),
+        FakeCase("waiting", 0, True),
+    ]
+    runner = NFTestRunner(cases=cases, jobs=2, max_failures=1)
+
+    start_time = time.monotonic()
+    assert runner.main() == 1
+    assert time.monotonic() - start_time < 10
+    assert sorted(runner.report.not_run_tests) == ["slow", "waiting"]
+
+
+def test_main_timeout_counts_as_failure():
+    """Cases that time out are reported and counted as failures"""
+    cases = [FakeCase("pass", 0, True), FakeCase("slow", 0, False)]
+
+    def time_out(case=cases[1]):
+        case.status = Result.TIMEOUT
+        return False
+    cases[1].test = time_out
+
+    runner = NFTestRunner(cases=cases, max_failures=1)
+    assert runner.main() == 1
+    assert list(runner.report.timed_out_tests) == ["slow"]
+
+
+@mock.patch("nftest.NFTestRunner.SharedSession")
+def test_main_shared_work(mock_session, caplog):
+    """Shared sessions warn about ignored settings and are always closed"""
+    cases = [FakeCase("default", 0, True), FakeCase("custom", 0, True)]
+    runner = NFTestRunner(cases=cases)
+    runner._global = mock.Mock(  # pylint: disable=protected-access
+        temp_dir="temp", remove_temp=True, clean_logs=True, shared_work=True
+    )
+    for case in cases:
+        case.temp_dir = "temp"
+        case.remove_temp = True
+    cases[1].remove_temp = False
+
+    def fail():
+        raise RuntimeError("unexpected")
+    cases[0].test = fail
+
+    with pytest.raises(RuntimeError):
+        runner.main()
+
+    assert all(case.shared_session is mock_session.return_value for case in cases)
+    mock_session.return_value.close.assert_called_once_with(
+        remove_temp=True, clean_logs=True
+    )
+    assert "custom: shared_work ignores" in caplog.text
+    assert "default: shared_work ignores" not in caplog.text
+
+
+def test_main_repetition(capsys):
+    """Repeated runs print no prolog and leave the history untouched"""
+    runner = NFTestRunner(cases=[FakeCase("pass", 0, True)], repetition=True)
+    assert runner.main() == 0
+    assert not CaseHistory().durations
+    assert "NFTEST STARTS" not in capsys.readouterr().out
+
+
+def test_main_terminated_by_signal():
+    """SIGTERM stops the running cases, then exits"""
+    cases = [FakeCase("slow", 30, True), FakeCase("waiting", 0, True)]
+    runner = NFTestRunner(cases=cases)
+    previous = signal.getsignal(signal.SIGTERM)
+    threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM)).start()
+
+    start_time = time.monotonic()
+    with pytest.raises(SystemExit) as exit_info:
+        runner.main()
+
+    assert exit_info.value.code == 128 + signal.SIGTERM
+    assert time.monotonic() - start_time < 10
+    assert cases[0].status == Result.NOT_RUN
+    assert signal.getsignal(signal.SIGTERM) is previous
+
+
+def test_main_shared_output_names(caplog):
+    """Cases that would share an output directory cannot run in parallel"""
+    cases = [FakeCase("a", 0, True), FakeCase("b", 0, True), FakeCase("c", 0, True)]
+    cases[1].name_for_output = "a"
+
+    with pytest.raises(ValueError, match="`a` and `b` would share the output"):
+        NFTestRunner(cases=cases, jobs=2).main()
+
+    # Serial cases run one after the other, so they only warn
+    assert NFTestRunner(cases=cases).main() == 0
+    assert "`a` and `b` would share the output" in caplog.text
+
+    # Skipped cases do not run, so they do not collide
+    caplog.clear()
+    cases[1].skip = True
+    assert NFTestRunner(cases=cases, jobs=2).main() == 0
+    assert "would share" not in caplog.text
@@ -0,0 +1,106 @@
+"""Test module for benchmarking cases."""
+
+import mock
+import pytest
+
+from nftest.bench import Benchmark, collect_metrics, compare, percentile, summarize
+from nftest.NFTestReport import NFTestReport
+
+
+def make_report(wall: float) -> NFTestReport:
+    "Return a report of one traced and sampled case, and one cached case."
+    report = NFTestReport()
+    report.passed_tests = {"case": wall, "cached": 0.0}
+    report.cached_tests = ["cached"]
+    report.timings = {
+        "case": {"total": wall, "phases": {"startup": 2.0, "pipeline": wall - 2}},
+        "cached": {"total": 0.0, "phases": {}},
+    }
+    report.traces = {"case": {"realtime": wall / 2}}
+    report.resources = {
+        "case": {"summary": {"peak_rss_bytes": 1024, "cpu_seconds": wall * 2}}
+    }
+    return report
+
+
+def test_percentile():
+    "Percentiles use the nearest rank."
+    values = list(range(1, 21))
+    assert percentile(values, 0.95) == 19
+    assert percentile(values, 0.5) == 10
+    assert percentile([3], 0.95) == 3
+
+
+def test_summarize():
+    "Repeated measurements are summarized."
+    assert summarize([1.0, 2.0, 3.0]) == {
+        "n": 3,
+        "median": 2.0,
+        "p95": 3.0,
+        "stddev": 1.0,
+        "min": 1.0,
+        "max": 3.0,
+    }
+    assert summarize([5.0])["stddev"] == 0.0
+
+
+def test_collect_metrics():
+    "Metrics are read for cases that ran, but not cached cases."
+    assert collect_metrics(make_report(10.0)) == {
+        "case": {
+            "wall_seconds": 10.0,
+            "startup_seconds": 2.0,
+            "pipeline_seconds": 8.0,
+            "task_realtime_seconds": 5.0,
+            "peak_rss_bytes": 1024,
+            "cpu_seconds": 20.0,
+        }
+    }
+
+
+@mock.patch("nftest.bench.NFTestRunner")
+def test_benchmark(mock_runner):
+    "Warmup runs are discarded and the rest are summarized."
+    runners = [mock.Mock(), mock.Mock(), mock.Mock()]
+    for runner, wall in zip(runners, (100.0, 10.0, 12.0)):
+        runner.main.return_value = 0
+        runner.report = make_report(wall)
+    mock_runner.side_effect = runners
+
+    results = Benchmark("nftest.yml", [], repeats=2, warmup=1).run()
+
+    assert results["repeats"] == 2
+    assert results["cases"]["case"]["wall_seconds"]["median"] == 11.0
+    assert results["cases"]["case"]["wall_seconds"]["max"] == 12.0
+    # No repetition prints the prolog or is recorded in the history
+    assert all(call.kwargs["repetition"] for call in mock_runner.call_args_list)
+
+
+@mock.patch("nftest.bench.NFTestRunner")
+def test_benchmark_failure(mock_runner):
+    "A benchmark with failing cases has no results."
+    mock_runner.return_value.main.return_value = 1
+
+    assert Benchmark("nftest.yml", [], repeats=2, warmup=0).run() is None
+
+
+@pytest.mark.parametrize(
+    "median,thresholds,regressed",
+    [
+        (10.5, {}, False),
+        (11.5, {}, True),
+        (11.5, {"wall_seconds": 0.2}, False),
+    ],
+)
+def test_compare(median, thresholds, regressed):
+    "Medians beyond the relative threshold are regressions."
+    baseline = {"cases": {"case": {"wall_seconds": {"median": 10.0}}}}
+    results = {
+        "cases": {
+            "case": {"wall_seconds": {"median": median}, "cpu_seconds": {"median": 1}},
+            "new_case": {"wall_seconds": {"median": 100.0}},
+        }
+    }
+
+    regressions = compare(results, baseline, 0.1, thresholds)
+    assert len(regressions) == int(regressed)
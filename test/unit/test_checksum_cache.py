@@ -0,0 +1,101 @@
+"""Test module for the persistent checksum cache"""
+
+import os
+
+import mock
+import pytest
+
+from nftest.checksum_cache import ChecksumCache
+from nftest.common import calculate_checksum
+
+
+@pytest.fixture(name="new_cache")
+def fixture_new_cache(tmp_path):
+    """A factory for fresh (non-singleton) caches sharing one database"""
+
+    def factory(**kwargs):
+        ChecksumCache._instances.pop(ChecksumCache, None)  # pylint: disable=protected-access
+        return ChecksumCache(path=tmp_path / "cache.sqlite3", **kwargs)
+
+    return factory
+
+
+@pytest.fixture(name="old_file")
+def fixture_old_file(tmp_path):
+    """A file whose mtime is well outside of the racy window"""
+    path = tmp_path / "reference.txt"
+    path.write_text("reference contents", encoding="utf-8")
+    os.utime(path, ns=(10**18, 10**18))
+    return path
+
+
+def test_unchanged_file_is_not_rehashed(old_file, new_cache):
+    """A second checksum of an unchanged file only needs a stat"""
+    cache = new_cache()
+    compute = mock.Mock(return_value="abc")
+
+    assert cache.checksum(old_file, "md5", compute) == "abc"
+    assert cache.checksum(old_file, "md5", compute) == "abc"
+    compute.assert_called_once()
+
+    # A different algorithm is a different entry
+    cache.checksum(old_file, "sha256", compute)
+    assert compute.call_count == 2
+
+
+def test_modified_file_is_rehashed(old_file, new_cache):
+    """Changing the file contents invalidates the cached checksum"""
+    cache = new_cache()
+    first = cache.checksum(old_file, "md5", lambda path: "first")
+
+    old_file.write_text("new reference contents", encoding="utf-8")
+    os.utime(old_file, ns=(2 * 10**18, 2 * 10**18))
+
+    assert first == "first"
+    assert cache.checksum(old_file, "md5", lambda path: "second") == "second"
+
+
+def test_recent_file_is_not_cached(tmp_path, new_cache):
+    """Files modified within the racy window are always rehashed"""
+    path = tmp_path / "fresh.txt"
+    path.write_text("fresh", encoding="utf-8")
+    cache = new_cache()
+    compute = mock.Mock(return_value="abc")
+
+    cache.checksum(path, "md5", compute)
+    cache.checksum(path, "md5", compute)
+    assert compute.call_count == 2
+
+
+def test_eviction(tmp_path, new_cache):
+    """The least recently used entries are evicted beyond max_entries"""
+    cache = new_cache(max_entries=2)
+    paths = []
+    for index in range(3):
+        path = tmp_path / f"{index}.txt"
+        path.write_text(str(index), encoding="utf-8")
+        os.utime(path, ns=(10**18, 10**18))
+        paths.append(path)
+        cache.checksum(path, "md5", lambda path: "value")
+
+    assert cache.lookup(os.stat(paths[0]), "md5") is None
+    assert cache.lookup(os.stat(paths[2]), "md5") == "value"
+
+
+def test_shared_between_connections(old_file, new_cache):
+    """Separate cache instances (e.g. processes) share the database"""
+    writer = new_cache()
+    reader = new_cache()
+    writer.checksum(old_file, "md5", lambda path: "shared")
+
+    assert reader.lookup(os.stat(old_file), "md5") == "shared"
+
+
+def test_disabled_cache(old_file):
+    """calculate_checksum hashes the file when the cache is disabled"""
+    ChecksumCache().enabled = False
+
+    assert calculate_checksum(old_file) == calculate_checksum(
+        old_file, use_cache=False
+    )
+    assert not ChecksumCache().path.exists()
@@ -1,11 +1,33 @@
 # pylint: disable=W0212
 """Test module for common functions"""
 
+import asyncio
+import hashlib
 import logging
+import signal
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+from pathlib import Path
 import mock
 import pytest
 
-from nftest.common import validate_reference
+from nftest.common import (
+    CHECKSUM_ALGORITHMS,
+    CHECKSUM_BLOCK_SIZE,
+    benchmark_checksums,
+    bytes_hashed,
+    calculate_checksum,
+    check_reference_checksum,
+    popen_with_logger,
+    read_json,
+    run_process,
+    validate_reference_name,
+    validate_references,
+)
+from nftest.resources import process_start_time
 
 
 @pytest.mark.parametrize(
@@ -17,33 +39,28 @@ from nftest.common import validate_reference
         ("validparam", True),
     ],
 )
-@mock.patch("nftest.common.calculate_checksum")
-def test_param_names_validate_reference(
-    mock_calculate_checksum, param_name, valid_name
-):
+def test_validate_reference_name(param_name, valid_name):
     """Tests for proper parameter name check"""
-    mock_calculate_checksum.return_value = ""
     if valid_name:
-        validate_reference(param_name, "", "", "")
+        validate_reference_name(param_name)
     else:
         with pytest.raises(ValueError):
-            validate_reference(param_name, "", "", "")
+            validate_reference_name(param_name)
 
 
-@mock.patch("nftest.common.calculate_checksum")
-def test_warning_with_bad_checksum_validate_reference(mock_calculate_checksum, caplog):
+def test_warning_with_bad_checksum(caplog):
     """Tests for warning message printed with bad checksum"""
     test_bad_checksum = "bad_checksum"
     test_param_name = "name"
     test_param_path = "path"
     test_checksum = "checksum"
-    test_checksum_type = "md5"
-
-    mock_calculate_checksum.return_value = test_bad_checksum
 
     with caplog.at_level(logging.DEBUG):
-        validate_reference(
-            test_param_name, test_param_path, test_checksum, test_checksum_type
+        check_reference_checksum(
+            test_param_name,
+            test_param_path,
+            test_checksum,
+            actual_checksum=test_bad_checksum,
         )
 
     assert (
@@ -54,18 +71,271 @@ def test_warning_with_bad_checksum_validate_reference(mock_calculate_checksum, c
     )
 
 
+def test_validate_references_with_good_checksum(tmp_path, caplog):
+    """Tests that a matching reference is hashed and not reported"""
+    reference = tmp_path / "reference.fa"
+    reference.write_text("ACGT", encoding="utf-8")
+
+    with caplog.at_level(logging.WARNING):
+        hashed = validate_references([{
+            "reference_parameter_name": "reference",
+            "reference_parameter_path": str(reference),
+            "reference_checksum": hashlib.md5(b"ACGT").hexdigest(),
+            "reference_checksum_type": "md5",
+        }])
+
+    assert hashed == 4
+    assert caplog.text == ""
+
+
 @mock.patch("nftest.common.calculate_checksum")
-def test_returns_correct_tuple_validate_reference(mock_calculate_checksum):
-    """Tests for correct return tuple after validation"""
-    test_param_name = "name"
-    test_param_path = "path"
-    test_checksum = "checksum"
-    test_checksum_type = "md5"
+def test_shared_references_hashed_once(mock_calculate_checksum, tmp_path, caplog):
+    """Tests that a reference shared between cases is only hashed once"""
+    mock_calculate_checksum.return_value = "checksum"
+    shared = tmp_path / "shared.fa"
+    other = tmp_path / "other.fa"
+
+    def reference(name, path, checksum):
+        return {
+            "reference_parameter_name": name,
+            "reference_parameter_path": str(path),
+            "reference_checksum": checksum,
+            "reference_checksum_type": "md5",
+        }
+
+    with caplog.at_level(logging.WARNING):
+        validate_references([
+            reference("ref", shared, "checksum"),
+            reference("ref", tmp_path / "." / "shared.fa", "checksum"),
+            reference("other", other, "bad_checksum"),
+        ])
+
+    assert sorted(
+        call.args[0] for call in mock_calculate_checksum.call_args_list
+    ) == sorted([shared.resolve(), other.resolve()])
+    assert "does not match expected checksum of `bad_checksum`" in caplog.text
 
-    mock_calculate_checksum.return_value = test_checksum
 
-    validated_reference = validate_reference(
-        test_param_name, test_param_path, test_checksum, test_checksum_type
+@pytest.mark.parametrize("algorithm", CHECKSUM_ALGORITHMS)
+def test_calculate_checksum(algorithm, tmp_path):
+    """Tests that block-wise hashing matches hashing the whole file"""
+    contents = bytes(range(256)) * (CHECKSUM_BLOCK_SIZE // 100)
+    path = tmp_path / "data.bin"
+    path.write_bytes(contents)
+
+    assert calculate_checksum(path, algorithm, use_cache=False) == (
+        hashlib.new(algorithm, contents).hexdigest()
     )
 
-    assert validated_reference == (test_param_name, test_param_path)
+
+def test_bytes_hashed(tmp_path):
+    """Tests that only files that are actually read are counted as hashed"""
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"x" * 1000)
+
+    start = bytes_hashed()
+    calculate_checksum(path, use_cache=False)
+    assert bytes_hashed() - start == 1000
+
+    # Cached checksums are not hashed again
+    with mock.patch("nftest.checksum_cache.RACY_WINDOW_NS", 0):
+        calculate_checksum(path)
+        start = bytes_hashed()
+        calculate_checksum(path)
+    assert bytes_hashed() == start
+
+
+def test_read_json(tmp_path):
+    """Missing files are the default, and unreadable files are an error"""
+    path = tmp_path / "data.json"
+    assert read_json(path, {"cases": {}}) == {"cases": {}}
+
+    path.write_text('{"cases": {"a": 1}}', encoding="utf-8")
+    assert read_json(path) == {"cases": {"a": 1}}
+
+    path.write_text("{", encoding="utf-8")
+    with pytest.raises(ValueError):
+        read_json(path)
+
+
+def test_benchmark_checksums():
+    """Tests that the benchmark reports a throughput for every algorithm"""
+    throughputs = benchmark_checksums(size=CHECKSUM_BLOCK_SIZE)
+
+    assert set(throughputs) == set(CHECKSUM_ALGORITHMS)
+    assert all(value > 0 for value in throughputs.values())
+
+
+def test_popen_with_logger_drains_output(caplog):
+    """All output is logged, even if it is written just before exit"""
+    script = textwrap.dedent("""\
+        import sys
+        print("first")
+        print("error", file=sys.stderr)
+        sys.stdout.write("x" * 100000 + "\\nlast line without newline")
+        """)
+
+    with caplog.at_level(logging.DEBUG):
+        result = popen_with_logger(
+            [sys.executable, "-c", script], logger=logging.getLogger("test")
+        )
+
+    assert result.returncode == 0
+    assert [record.msg for record in caplog.records if record.levelno == logging.INFO] == [
+        "first",
+        "x" * 100000,
+        "last line without newline",
+    ]
+    assert ("test", logging.ERROR, "error") in caplog.record_tuples
+
+
+def test_popen_with_logger_timeout():
+    """Processes that outlive their timeout are terminated"""
+    start_time = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        popen_with_logger(
+            [sys.executable, "-c", "import time; time.sleep(60)"],
+            logger=logging.getLogger("test"),
+            timeout=0.5,
+        )
+    assert time.monotonic() - start_time < 30
+
+
+def test_run_process_concurrently(caplog):
+    """Many processes can be supervised from a single event loop"""
+
+    async def run_all():
+        return await asyncio.gather(*[
+            run_process(
+                [sys.executable, "-c", f"import sys; print({index}); sys.exit({index})"],
+                logger=logging.getLogger("test"),
+            )
+            for index in range(4)
+        ])
+
+    with caplog.at_level(logging.INFO):
+        results = asyncio.run(run_all())
+
+    assert [result.returncode for result in results] == [0, 1, 2, 3]
+    assert sorted(record.msg for record in caplog.records) == ["0", "1", "2", "3"]
+
+
+def test_popen_with_logger_shares_one_loop(caplog):
+    """Calls from many threads are supervised by one loop, and log as their caller"""
+    supervisors = []
+
+    def run(index):
+        popen_with_logger(
+            [sys.executable, "-c", f"print({index})"],
+            logger=logging.getLogger("test"),
+            on_start=lambda _: supervisors.append(threading.current_thread().name),
+        )
+
+    threads = [
+        threading.Thread(target=run, args=(index,), name=f"caller{index}")
+        for index in range(4)
+    ]
+    with caplog.at_level(logging.INFO):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert supervisors == ["ProcessSupervisor"] * 4
+    assert sorted((record.threadName, record.msg) for record in caplog.records) == [
+        (f"caller{index}", str(index)) for index in range(4)
+    ]
+
+
+@pytest.mark.parametrize(
+    "command,kwargs",
+    [
+        ("true", {}),
+        (Path("true"), {}),
+        ("echo started && true", {"shell": True}),
+        (["echo", "started"], {"shell": True}),
+    ],
+)
+def test_popen_with_logger_commands(command, kwargs):
+    """Commands may be given as strings, paths, or shell commands"""
+    result = popen_with_logger(command, logger=logging.getLogger("test"), **kwargs)
+    assert result.returncode == 0
+
+
+@pytest.mark.parametrize("ignore_term", [False, True])
+def test_popen_with_logger_cancel(ignore_term, tmp_path):
+    """Setting the cancel event terminates the whole process group"""
+    pid_file = tmp_path / "child.pid"
+    trap = "trap '' TERM; " if ignore_term else ""
+    cancel = threading.Event()
+    threading.Timer(0.5, cancel.set).start()
+
+    start_time = time.monotonic()
+    result = popen_with_logger(
+        ["sh", "-c", f"{trap}sleep 60 & echo $! > {pid_file}; wait"],
+        logger=logging.getLogger("test"),
+        cancel=cancel,
+        grace_period=0.5,
+        start_new_session=True,
+    )
+
+    assert time.monotonic() - start_time < 30
+    assert result.returncode == -(signal.SIGKILL if ignore_term else signal.SIGTERM)
+
+    # The background child was stopped along with its parent
+    assert_stopped(pid_file)
+
+
+def assert_stopped(pid_file):
+    """Assert that the process whose PID is in the file stops running"""
+    stat = Path("/proc", pid_file.read_text(encoding="utf-8").strip(), "stat")
+    for _ in range(50):
+        # A child that nothing has reaped yet is a zombie
+        if not stat.exists() or stat.read_text(encoding="utf-8").split()[2] == "Z":
+            return
+        time.sleep(0.1)
+
+    pytest.fail("The child process is still running")
+
+
+def test_popen_with_logger_timeout_kills_tree(tmp_path):
+    """A timeout kills descendants, even those in another process group"""
+    pid_file = tmp_path / "child.pid"
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        popen_with_logger(
+            [
+                "sh",
+                "-c",
+                f"setsid sleep 60 > /dev/null & echo $! > {pid_file}; wait",
+            ],
+            logger=logging.getLogger("test"),
+            timeout=0.5,
+            grace_period=0.5,
+            start_new_session=True,
+        )
+
+    assert_stopped(pid_file)
+
+
+def test_terminate_skips_reused_pids():
+    """A descendant whose PID was reused by another process is not killed"""
+    with subprocess.Popen(["sleep", "60"]) as unrelated:
+        try:
+            started = process_start_time(unrelated.pid)
+            assert started is not None
+
+            # Pretend that the PID belonged to an earlier descendant
+            with mock.patch(
+                "nftest.common.descendants", return_value={unrelated.pid: started - 1}
+            ), pytest.raises(subprocess.TimeoutExpired):
+                popen_with_logger(
+                    ["sleep", "60"],
+                    logger=logging.getLogger("test"),
+                    timeout=0.2,
+                    grace_period=0.2,
+                )
+
+            assert unrelated.poll() is None
+        finally:
+            unrelated.kill()
@@ -0,0 +1,265 @@
+"""Test module for the streaming comparators"""
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+import mock
+import pytest
+
+from nftest.common import CHECKSUM_BLOCK_SIZE, bytes_hashed
+from nftest.comparators import (
+    file_chunks,
+    first_difference,
+    get_comparator,
+    gzip_chunks,
+    register_comparator,
+    threaded_chunks,
+)
+from nftest.NFTestAssert import NFTestAssert, NFTestAssertionError
+
+
+def chunked(data, size):
+    """Split bytes into chunks of the given size"""
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("left_size,right_size", [(1, 1), (3, 7), (1000, 64), (5000, 5000)])
+@pytest.mark.parametrize("difference", [None, 0, 1, 999, 4095])
+def test_first_difference(left_size, right_size, difference):
+    """The first differing offset is found regardless of chunk sizes"""
+    left = bytes(range(256)) * 16
+    right = bytearray(left)
+    if difference is not None:
+        right[difference] ^= 0xFF
+
+    assert first_difference(
+        chunked(left, left_size), chunked(bytes(right), right_size)
+    ) == difference
+
+
+def test_first_difference_lengths():
+    """A stream that ends early differs at its length"""
+    assert first_difference([b"abc"], [b"ab", b"cd"]) == 3
+    assert first_difference([], [b"a"]) == 0
+    assert first_difference([], []) is None
+
+
+def test_file_chunks(tmp_path):
+    """Files are read in aligned blocks"""
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"x" * 10)
+
+    assert [bytes(chunk) for chunk in file_chunks(path, block_size=4)] == [
+        b"xxxx",
+        b"xxxx",
+        b"xx",
+    ]
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_chunks_count_bytes(tmp_path, payload, threaded):
+    """Reading chunks counts the bytes read for the calling thread"""
+    plain = tmp_path / "data.txt"
+    plain.write_bytes(payload)
+    compressed = tmp_path / "data.gz"
+    compressed.write_bytes(gzip.compress(payload, mtime=0))
+
+    for path, chunks in ((plain, file_chunks), (compressed, gzip_chunks)):
+        stream = chunks(path, block_size=512)
+        if threaded:
+            stream = threaded_chunks(stream)
+
+        start_bytes = bytes_hashed()
+        assert b"".join(stream) == payload
+        assert bytes_hashed() - start_bytes == path.stat().st_size
+
+
+def test_first_difference_stops_early(tmp_path):
+    """Comparing files stops reading at the block with the first difference"""
+    data = os.urandom(8 * CHECKSUM_BLOCK_SIZE)
+    changed = bytearray(data)
+    changed[CHECKSUM_BLOCK_SIZE + 100] ^= 0xFF
+    left, right = tmp_path / "left.bin", tmp_path / "right.bin"
+    left.write_bytes(data)
+    right.write_bytes(bytes(changed))
+
+    start_bytes = bytes_hashed()
+    assert first_difference(file_chunks(left), file_chunks(right)) == (
+        CHECKSUM_BLOCK_SIZE + 100
+    )
+    # Two blocks from each file, rather than all eight
+    assert bytes_hashed() - start_bytes == 4 * CHECKSUM_BLOCK_SIZE
+
+
+def test_first_difference_benchmark(tmp_path, record_property):
+    """Record the time to compare two files against the time to hash them"""
+    data = os.urandom(32 * 2**20)
+    left, right = tmp_path / "left.bin", tmp_path / "right.bin"
+    left.write_bytes(data)
+    right.write_bytes(data)
+
+    def best_time(function):
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    assert first_difference(file_chunks(left), file_chunks(right)) is None
+    # Timings vary too much between hosts to assert on
+    record_property(
+        "compare_seconds",
+        best_time(lambda: first_difference(file_chunks(left), file_chunks(right))),
+    )
+    record_property(
+        "sha256_seconds",
+        best_time(lambda: [hashlib.sha256(data).digest() for _ in range(2)]),
+    )
+
+
+@pytest.fixture(name="payload")
+def fixture_payload():
+    """Compressible data larger than several blocks"""
+    return b"".join(b"line %d\n" % index for index in range(20000))
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_gzip_chunks_multimember(tmp_path, payload, threaded):
+    """bgzip-style files with many members decompress as a single stream"""
+    single = tmp_path / "single.gz"
+    single.write_bytes(gzip.compress(payload, mtime=0))
+
+    multiple = tmp_path / "multiple.gz"
+    with multiple.open("wb") as handle:
+        for index in range(0, len(payload), 1000):
+            handle.write(gzip.compress(payload[index:index + 1000], mtime=index))
+
+    streams = [gzip_chunks(single, block_size=512), gzip_chunks(multiple, block_size=512)]
+    if threaded:
+        streams = [threaded_chunks(stream) for stream in streams]
+
+    assert first_difference(*streams) is None
+    assert b"".join(gzip_chunks(multiple, block_size=512)) == payload
+
+
+def test_gzip_chunks_difference(tmp_path, payload):
+    """Offsets refer to the decompressed contents"""
+    changed = bytearray(payload)
+    changed[12345] = ord("X")
+    left = tmp_path / "left.gz"
+    left.write_bytes(gzip.compress(payload))
+    right = tmp_path / "right.gz"
+    right.write_bytes(gzip.compress(bytes(changed)))
+
+    assert first_difference(gzip_chunks(left), gzip_chunks(right)) == 12345
+
+
+def test_gzip_chunks_zero_padding(tmp_path, payload):
+    """Zero bytes after the last member are ignored, as by the gzip module"""
+    padded = tmp_path / "padded.gz"
+    padded.write_bytes(gzip.compress(payload) + b"\0" * 1000)
+
+    assert b"".join(gzip_chunks(padded, block_size=512)) == payload
+    assert gzip.decompress(padded.read_bytes()) == payload
+
+
+def test_gzip_chunks_truncated(tmp_path, payload):
+    """Truncated files are an error, even in a worker thread"""
+    truncated = tmp_path / "truncated.gz"
+    truncated.write_bytes(gzip.compress(payload)[:-20])
+
+    with pytest.raises(EOFError):
+        list(threaded_chunks(gzip_chunks(truncated)))
+
+
+def test_threaded_chunks_early_exit():
+    """Abandoning a threaded stream does not block its producer"""
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            while True:
+                yield b"a"
+        finally:
+            closed.set()
+
+    stream = threaded_chunks(chunks(), depth=1)
+    assert next(stream) == b"a"
+    stream.close()
+    # The producer closes its chunks, and the file behind them
+    assert closed.wait(5)
+
+
+def test_get_comparator_plugin():
+    """Plugins are loaded from entry points only when requested"""
+    entry_points = [
+        mock.Mock(load=mock.Mock(return_value="vcf comparator")),
+        mock.Mock(load=mock.Mock(side_effect=ImportError)),
+    ]
+    entry_points[0].name = "test-vcf"
+    entry_points[1].name = "test-broken"
+
+    with mock.patch(
+        "nftest.comparators._plugin_entry_points", return_value=entry_points
+    ):
+        assert get_comparator("test-vcf") == "vcf comparator"
+        assert get_comparator("test-vcf") == "vcf comparator"
+        assert get_comparator("test-missing") is None
+
+    entry_points[0].load.assert_called_once()
+    entry_points[1].load.assert_not_called()
+
+
+def test_get_comparator_load_error():
+    """A plugin that fails to load raises its error every time it is requested"""
+    entry_point = mock.Mock(load=mock.Mock(side_effect=ImportError("no module")))
+    entry_point.name = "test-unloadable"
+
+    with mock.patch(
+        "nftest.comparators._plugin_entry_points", return_value=[entry_point]
+    ):
+        for _ in range(2):
+            with pytest.raises(ImportError, match="no module"):
+                get_comparator("test-unloadable")
+
+    entry_point.load.assert_called_once()
+
+
+def test_plugin_error_fails_assertion(tmp_path):
+    """An error raised by a plugin fails the assertion"""
+    def broken(*_):
+        raise ValueError("bad record")
+
+    register_comparator("test-broken-plugin", broken)
+    (tmp_path / "file.expect").touch()
+    assertion = NFTestAssert(
+        actual=str(tmp_path / "file.actual"),
+        expect=str(tmp_path / "file.expect"),
+        method="test-broken-plugin",
+    )
+    time.sleep(0.01)
+    (tmp_path / "file.actual").touch()
+
+    with pytest.raises(NFTestAssertionError, match="raised ValueError: bad record"):
+        assertion.perform_assertions()
+
+
+def test_registered_comparator(tmp_path):
+    """Registered comparators are usable as assertion methods"""
+    register_comparator("test-always", lambda actual, expect: True)
+    (tmp_path / "file.expect").touch()
+    assertion = NFTestAssert(
+        actual=str(tmp_path / "file.actual"),
+        expect=str(tmp_path / "file.expect"),
+        method="test-always",
+    )
+    time.sleep(0.01)
+    (tmp_path / "file.actual").write_bytes(b"abc")
+
+    assertion.perform_assertions()
+    # The plugin is credited with reading both files
+    assert assertion.timing["bytes_hashed"] == 3
@@ -0,0 +1,117 @@
+"""Test module for the history of case durations."""
+
+import types
+
+import pytest
+
+from nftest.history import HISTORY_LENGTH, CaseHistory, makespan
+
+
+@pytest.mark.parametrize(
+    "durations,workers,busy,expected",
+    [
+        ([], 2, [], 0),
+        ([3, 2, 1], 1, [], 6),
+        ([3, 2, 1], 2, [], 3),
+        ([1, 1, 3], 2, [], 4),
+        ([2], 2, [5, 1], 5),
+        ([2, 2], 2, [5, 1], 5),
+        ([2, 2, 2], 2, [5, 1], 7),
+    ],
+)
+def test_makespan(durations, workers, busy, expected):
+    "Durations are assigned to the first free worker in order."
+    assert makespan(durations, workers, busy) == expected
+
+
+def test_round_trip(tmp_path):
+    "Durations are saved, limited in number, and estimated by their median."
+    path = tmp_path / "history.json"
+    history = CaseHistory(path)
+    assert history.estimate("case") is None
+
+    for duration in range(HISTORY_LENGTH + 5):
+        history.record({"case": float(duration)})
+    history.save()
+
+    history = CaseHistory(path)
+    assert len(history.durations["case"]) == HISTORY_LENGTH
+    assert history.estimate("case") == 9.5
+    # Nothing is left behind by the atomic write
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_longest_first(tmp_path):
+    "Cases are ordered longest first, with unknown cases given the mean."
+    history = CaseHistory(tmp_path / "history.json")
+    history.record({"short": 1.0, "long": 100.0, "medium": 10.0})
+
+    cases = [
+        types.SimpleNamespace(name=name)
+        for name in ("short", "new", "medium", "long", "new2")
+    ]
+    assert [case.name for case in history.longest_first(cases)] == [
+        "long",
+        "new",
+        "new2",
+        "medium",
+        "short",
+    ]
+
+
+def test_longest_first_without_history(tmp_path):
+    "Without any history the order is unchanged."
+    history = CaseHistory(tmp_path / "history.json")
+    cases = [types.SimpleNamespace(name=name) for name in ("b", "a", "c")]
+
+    assert history.longest_first(cases) == cases
+
+
+def make_cases(*names):
+    "Return stand-ins for cases that will run."
+    return [types.SimpleNamespace(name=name, skip=False) for name in names]
+
+
+def test_partition(tmp_path):
+    "Shards are balanced on expected duration and keep the configured order."
+    history = CaseHistory(tmp_path / "history.json")
+    history.record({"a": 10.0, "b": 6.0, "c": 5.0, "d": 4.0, "e": 1.0})
+
+    cases = make_cases("e", "d", "c", "b", "a")
+    shards = history.partition(cases, 2)
+
+    assert [[case.name for case in shard] for shard in shards] == [
+        ["d", "a"],
+        ["e", "c", "b"],
+    ]
+
+
+def test_partition_without_history(tmp_path):
+    "Without any history, shards are dealt out by a stable hash of the names."
+    history = CaseHistory(tmp_path / "history.json")
+    names = [f"case{index}" for index in range(10)]
+
+    shards = history.partition(make_cases(*names), 3)
+    assert sorted(len(shard) for shard in shards) == [3, 3, 4]
+    assert sorted(case.name for shard in shards for case in shard) == names
+
+    # The split does not depend on the configured order
+    reordered = history.partition(make_cases(*reversed(names)), 3)
+    assert [{case.name for case in shard} for shard in reordered] == [
+        {case.name for case in shard} for shard in shards
+    ]
+
+
+def test_digest(tmp_path):
+    "Shards agree on the split exactly when their digests match."
+    history = CaseHistory(tmp_path / "history.json")
+    assert history.digest(["a", "b"]) is None
+
+    history.record({"a": 10.0, "b": 6.0})
+    digest = history.digest(["a", "b"])
+    assert digest is not None
+    assert history.digest(["b", "a"]) == digest
+
+    other = CaseHistory(tmp_path / "other.json")
+    other.record({"a": 10.0, "b": 7.0})
+    assert other.digest(["a", "b"]) != digest
@@ -0,0 +1,192 @@
+"""Test module for incremental runs."""
+
+from pathlib import Path
+
+import mock
+import pytest
+
+from nftest.common import TestResult as Result
+from nftest.incremental import (
+    INCLUDE_CONFIG_RE,
+    INCLUDE_RE,
+    IncrementalState,
+    case_fingerprint,
+    included_files,
+)
+from nftest.NFTestAssert import NFTestAssert
+from nftest.NFTestCase import NFTestCase
+
+
+@pytest.fixture(name="pipeline")
+def fixture_pipeline(tmp_path, monkeypatch):
+    "Create a small pipeline with modules and configs in the working directory."
+    monkeypatch.chdir(tmp_path)
+
+    Path("modules/align").mkdir(parents=True)
+    Path("main.nf").write_text(
+        "include { ALIGN } from './modules/align'\n"
+        "include { SORT; INDEX as IDX } from \"./modules/sort\"\n"
+        "include { validateParameters } from 'plugin/nf-schema'\n",
+        encoding="utf-8",
+    )
+    Path("modules/align/main.nf").write_text(
+        "include { SORT } from '../sort'\n", encoding="utf-8"
+    )
+    Path("modules/sort.nf").write_text("process SORT {}\n", encoding="utf-8")
+
+    Path("nextflow.config").write_text(
+        "includeConfig 'base.config'\n", encoding="utf-8"
+    )
+    Path("base.config").write_text("process.cpus = 1\n", encoding="utf-8")
+
+    Path("bin").mkdir()
+    Path("bin/tool.sh").write_text("echo tool\n", encoding="utf-8")
+    Path("templates/nested").mkdir(parents=True)
+    Path("templates/nested/report.sh").write_text("echo report\n", encoding="utf-8")
+
+    return tmp_path
+
+
+def make_case(**kwargs) -> NFTestCase:
+    "Return a case that runs the pipeline fixture."
+    return NFTestCase(
+        name="case",
+        nf_script="main.nf",
+        nf_configs=["nextflow.config"],
+        **kwargs,
+    )
+
+
+def test_included_files(pipeline):  # pylint: disable=unused-argument
+    "Local includes are followed recursively and plugins are ignored."
+    assert list(included_files("main.nf", INCLUDE_RE, ".nf")) == [
+        Path("main.nf"),
+        Path("modules/align/main.nf"),
+        Path("modules/sort.nf"),
+    ]
+    assert list(included_files("nextflow.config", INCLUDE_CONFIG_RE, ".config")) == [
+        Path("nextflow.config"),
+        Path("base.config"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda case: Path("modules/sort.nf").write_text("changed", encoding="utf-8"),
+        lambda case: Path("base.config").write_text("changed", encoding="utf-8"),
+        lambda case: Path("bin/tool.sh").write_text("changed", encoding="utf-8"),
+        lambda case: Path("templates/nested/report.sh").write_text(
+            "changed", encoding="utf-8"
+        ),
+        lambda case: Path("bin/new.sh").touch(),
+        lambda case: case.profiles.append("docker"),
+        lambda case: case.reference_params.append(("genome", "genome.fa")),
+    ],
+)
+def test_fingerprint_changes_with_inputs(pipeline, change):  # pylint: disable=unused-argument
+    "Changing any input changes the fingerprint."
+    case = make_case()
+    before = case_fingerprint(case, "nextflow 24.04.0")
+    assert case_fingerprint(case, "nextflow 24.04.0") == before
+    assert case_fingerprint(case, "nextflow 24.10.0") != before
+
+    change(case)
+    assert case_fingerprint(case, "nextflow 24.04.0") != before
+
+
+def test_fingerprint_covers_implicit_configs(pipeline):
+    "The nextflow.config that Nextflow loads implicitly, and its includes, count."
+    Path("pipeline").mkdir()
+    Path("pipeline/main.nf").write_text("workflow {}\n", encoding="utf-8")
+    Path("pipeline/nextflow.config").write_text(
+        "includeConfig 'conf/base.config'\n", encoding="utf-8"
+    )
+    Path("pipeline/conf").mkdir()
+    Path("pipeline/conf/base.config").write_text("process.cpus = 1\n", encoding="utf-8")
+    case = NFTestCase(name="case", nf_script="pipeline/main.nf")
+    before = case_fingerprint(case, "")
+
+    # From the project directory
+    Path("pipeline/conf/base.config").write_text("process.cpus = 2\n", encoding="utf-8")
+    after_project = case_fingerprint(case, "")
+    assert after_project != before
+
+    # From the launch directory (the working directory)
+    Path("base.config").write_text("process.cpus = 2\n", encoding="utf-8")
+    assert case_fingerprint(case, "") != after_project
+
+    # From a case's private launch directory
+    case.launch_dir = pipeline / "launch"
+    case.launch_dir.mkdir()
+    isolated = case_fingerprint(case, "")
+    (case.launch_dir / "nextflow.config").write_text("", encoding="utf-8")
+    assert case_fingerprint(case, "") != isolated
+
+
+def test_fingerprint_assertion_scripts(pipeline):  # pylint: disable=unused-argument
+    "Scripts are found on PATH, and a missing script means the case runs."
+    Path("expect.txt").write_text("output", encoding="utf-8")
+    Path("compare.sh").write_text("exit 0\n", encoding="utf-8")
+    case = make_case(asserts=[NFTestAssert("out.txt", "expect.txt", script="cmp")])
+    state = IncrementalState(path=Path("incremental.json"), version="")
+    assert case_fingerprint(case, "")
+    assert not state.is_passing(case)
+
+    case = make_case(asserts=[NFTestAssert("out.txt", "expect.txt", script="compare.sh")])
+    before = case_fingerprint(case, "")
+    Path("compare.sh").write_text("exit 1\n", encoding="utf-8")
+    assert case_fingerprint(case, "") != before
+
+    case = make_case(asserts=[NFTestAssert("out.txt", "expect.txt", script="missing")])
+    assert not state.is_passing(case)
+
+
+def test_state_round_trip(pipeline):
+    "A passing case is skipped next time, unless its outputs change."
+    Path("expect.txt").write_text("output", encoding="utf-8")
+    case = make_case(asserts=[NFTestAssert("out.txt", "expect.txt")])
+    output = Path(case.asserts[0].actual)
+    output.parent.mkdir(parents=True)
+    output.write_text("output", encoding="utf-8")
+
+    state_path = pipeline / "cache" / "incremental.json"
+    state = IncrementalState(path=state_path, version="nextflow")
+    assert not state.is_passing(case)
+
+    case.status = Result.PASSED
+    state.record(case)
+    state.save()
+
+    state = IncrementalState(path=state_path, version="nextflow")
+    assert state.is_passing(case)
+
+    output.write_text("changed", encoding="utf-8")
+    assert not IncrementalState(path=state_path, version="nextflow").is_passing(case)
+
+    # A failure forgets the previous pass
+    case.status = Result.FAILED
+    state.record(case)
+    state.save()
+    assert not IncrementalState(path=state_path, version="nextflow").cases
+
+
+def test_unreadable_state(tmp_path):
+    "A corrupt state file is ignored."
+    state_path = tmp_path / "incremental.json"
+    state_path.write_text("{", encoding="utf-8")
+
+    assert not IncrementalState(path=state_path, version="").cases
+
+
+@mock.patch("nftest.NFTestCase.NFTestCase.submit")
+def test_cached_case_is_not_run(mock_submit, pipeline):  # pylint: disable=unused-argument
+    "A case with a recorded pass is reported as passed without running."
+    case = make_case()
+    case.incremental = mock.Mock()
+    case.incremental.is_passing.return_value = True
+
+    assert case.test()
+    assert case.status == Result.PASSED
+    assert case.cached
+    mock_submit.assert_not_called()
@@ -0,0 +1,138 @@
+"""Test module for the queued logging pipeline."""
+
+import io
+import logging
+import threading
+
+import mock
+import pytest
+
+from nftest.logqueue import (
+    BatchedStreamHandler,
+    LogQueue,
+    LogQueueHandler,
+    LogQueueListener,
+)
+
+
+def make_record(level: int, message: str) -> logging.LogRecord:
+    "Return a record from the test logger."
+    return logging.getLogger("test").makeRecord(
+        "test", level, __file__, 0, message, None, None
+    )
+
+
+@pytest.mark.parametrize("level", [logging.DEBUG, logging.INFO])
+def test_full_queue_drops_unimportant_records(level):
+    "Records below WARNING are counted and dropped when the queue is full."
+    log_queue = LogQueue(maxsize=2)
+    for index in range(5):
+        log_queue.offer(make_record(level, f"message {index}"))
+
+    assert log_queue.depth == 2
+    assert log_queue.max_depth == 2
+    assert log_queue.dropped == 3
+    assert [log_queue.get().msg for _ in range(2)] == ["message 0", "message 1"]
+
+
+def test_full_queue_keeps_warnings():
+    "Records at or above WARNING wait for space instead of being dropped."
+    log_queue = LogQueue(maxsize=1)
+    log_queue.offer(make_record(logging.INFO, "first"))
+
+    offered = threading.Event()
+
+    def offer_warning():
+        log_queue.offer(make_record(logging.WARNING, "second"))
+        offered.set()
+
+    thread = threading.Thread(target=offer_warning)
+    thread.start()
+    assert not offered.wait(0.1)
+
+    assert log_queue.get().msg == "first"
+    thread.join(5)
+    assert offered.is_set()
+    assert log_queue.get().msg == "second"
+    assert log_queue.dropped == 0
+
+
+def test_listener_writes_in_batches():
+    "The listener writes every record and flushes once per batch."
+    stream = io.StringIO()
+    handler = BatchedStreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+
+    log_queue = LogQueue()
+    listener = LogQueueListener(log_queue, (handler,), batch_size=10)
+    queue_handler = LogQueueHandler(log_queue)
+
+    # Queue everything before the listener starts so the batches are full
+    for index in range(25):
+        queue_handler.handle(make_record(logging.INFO, f"message {index}"))
+
+    with mock.patch.object(handler, "flush", wraps=handler.flush) as mock_flush:
+        listener.start()
+        listener.stop()
+
+    assert stream.getvalue().splitlines() == [
+        f"INFO message {index}" for index in range(25)
+    ]
+    # Three batches, perhaps one more for the stop sentinel, and a final flush
+    assert 4 <= mock_flush.call_count <= 5
+
+    # Stopping again is harmless
+    listener.stop()
+
+
+def test_listener_reports_dropped_records():
+    "Stopping the listener logs how many records were dropped."
+    stream = io.StringIO()
+    handler = BatchedStreamHandler(stream)
+
+    log_queue = LogQueue(maxsize=1)
+    listener = LogQueueListener(log_queue, (handler,))
+    queue_handler = LogQueueHandler(log_queue)
+
+    for index in range(3):
+        queue_handler.handle(make_record(logging.DEBUG, f"message {index}"))
+
+    listener.start()
+    listener.stop()
+
+    assert stream.getvalue().splitlines() == [
+        "message 0",
+        "Dropped 2 log records below WARNING (queue of 1 was full)",
+    ]
+
+
+def test_stopped_listener_writes_directly():
+    "Once the listener stops, an attached logger writes to its handlers."
+    stream = io.StringIO()
+    handler = BatchedStreamHandler(stream)
+
+    logger = logging.getLogger("test.attached")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+
+    log_queue = LogQueue(maxsize=1)
+    listener = LogQueueListener(log_queue, (handler,))
+    queue_handler = listener.attach(logger)
+    listener.start()
+    logger.info("queued")
+    listener.stop()
+
+    assert queue_handler not in logger.handlers
+    assert handler in logger.handlers
+
+    # Neither lost nor blocked on the (full) queue
+    log_queue.put_nowait(make_record(logging.INFO, "stuck"))
+    logger.info("after stop")
+    logger.warning("warning after stop")
+
+    assert stream.getvalue().splitlines() == [
+        "queued",
+        "after stop",
+        "warning after stop",
+    ]
+    logger.removeHandler(handler)
@@ -0,0 +1,31 @@
+"""Test module for the command-line interface"""
+
+import sys
+
+import mock
+import pytest
+
+from nftest.__main__ import parse_args
+
+
+@pytest.mark.parametrize(
+    "argv,maxfail",
+    [
+        ([], None),
+        (["--maxfail", "2"], 2),
+        (["--fail-fast"], 1),
+    ],
+)
+def test_run_maxfail(argv, maxfail):
+    """--maxfail and --fail-fast set how many failures stop the run"""
+    with mock.patch.object(sys, "argv", ["nftest", "run", *argv]):
+        assert parse_args().maxfail == maxfail
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "two"])
+def test_run_maxfail_invalid(value, capsys):
+    """--maxfail must be a positive integer"""
+    with mock.patch.object(sys, "argv", ["nftest", "run", "--maxfail", value]):
+        with pytest.raises(SystemExit):
+            parse_args()
+    assert "--maxfail" in capsys.readouterr().err
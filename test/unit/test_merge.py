@@ -0,0 +1,94 @@
+"""Test module for merging test reports."""
+
+import json
+import xml.etree.ElementTree as ET
+
+from nftest.merge import merge_reports, read_case_records
+
+
+def write_stream(path, records):
+    "Write case records as a report stream."
+    with open(path, "wt", encoding="utf-8") as outfile:
+        for record in records:
+            outfile.write(json.dumps(record) + "\n")
+
+
+def test_read_truncated_stream(tmp_path):
+    "An incomplete last line of a stream is skipped."
+    path = tmp_path / "log.cases.jsonl"
+    write_stream(path, [{"name": "a", "status": "PASSED", "duration": 1.0}])
+    with open(path, "at", encoding="utf-8") as outfile:
+        outfile.write('{"name": "b", "sta')
+
+    assert [record["name"] for record in read_case_records(path)] == ["a"]
+
+
+def test_merge_reports(tmp_path):
+    "Streams and JSON reports merge into one summary and JUnit XML."
+    stream = tmp_path / "log.shard-1-of-2.cases.jsonl"
+    write_stream(stream, [
+        {"name": "a", "status": "PASSED", "duration": 1.5, "cached": True},
+        {
+            "name": "b",
+            "status": "FAILED",
+            "duration": 2.0,
+            "failure": {
+                "type": "MismatchedContentsError",
+                "message": "File comparison failed between x & y",
+            },
+        },
+        {"name": "c", "status": "PENDING", "duration": 0.5},
+    ])
+
+    report = tmp_path / "log.shard-2-of-2.json"
+    with open(report, "wt", encoding="utf-8") as outfile:
+        json.dump({
+            "passed_tests": {"d": 1.0},
+            "skipped_tests": {"e": 0.0},
+            "errored_tests": {},
+            "failed_tests": {"f": 3.0},
+            "not_run_tests": {"g": 0.0},
+            "timed_out_tests": {"h": 5.0},
+            "cached_tests": [],
+            "failures": {
+                "f": {"type": "NotUpdatedError", "message": "f was not modified"},
+            },
+            "shard": "2/2",
+        }, outfile)
+
+    junit = tmp_path / "junit.xml"
+    summary = merge_reports([stream, report], junit=junit)
+
+    assert summary == {
+        "reports": 2,
+        "tests": 8,
+        "passed": 2,
+        "failed": 2,
+        "errored": 1,
+        "skipped": 1,
+        "not_run": 1,
+        "timeout": 1,
+        "cached": 1,
+        "duration": 13.0,
+        "success": False,
+    }
+
+    suite = ET.parse(junit).getroot().find("testsuite")
+    assert suite.attrib["tests"] == "8"
+    assert suite.attrib["skipped"] == "2"
+    assert suite.attrib["failures"] == "2"
+    assert suite.attrib["errors"] == "2"
+    assert suite.attrib["time"] == "13.000"
+
+    cases = {case.attrib["name"]: case for case in suite.iter("testcase")}
+    assert list(cases) == ["a", "b", "c", "d", "e", "f", "g", "h"]
+    assert cases["b"].find("failure").attrib == {
+        "type": "MismatchedContentsError",
+        "message": "File comparison failed between x & y",
+    }
+    assert cases["f"].find("failure").attrib["type"] == "NotUpdatedError"
+    assert cases["c"].find("error") is not None
+    assert cases["e"].find("skipped") is not None
+    assert cases["g"].find("skipped").attrib["message"] == "not run"
+    assert cases["h"].find("error").attrib["type"] == "TIMEOUT"
+    assert len(cases["a"]) == 0
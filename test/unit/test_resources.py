@@ -0,0 +1,86 @@
+"""Test module for process tree resource sampling."""
+
+import logging
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from nftest.common import popen_with_logger
+from nftest import resources
+from nftest.resources import (
+    ResourceSampler,
+    descendants,
+    process_start_time,
+    sample_tree,
+)
+
+
+pytestmark = pytest.mark.skipif(
+    not os.path.isdir("/proc"), reason="requires /proc"
+)
+
+# A parent that starts a child and waits for it
+TREE_SCRIPT = textwrap.dedent(f"""\
+    import subprocess, sys, time
+    child = subprocess.Popen([{sys.executable!r}, "-c", "import time; time.sleep(0.5)"])
+    data = bytearray(32 * 1024 * 1024)
+    child.wait()
+    """)
+
+
+def test_sample_tree():
+    "A sample combines a process and its descendants."
+    with subprocess.Popen([sys.executable, "-c", TREE_SCRIPT]) as process:
+        # Wait for the child to start
+        deadline = time.monotonic() + 5
+        sample = sample_tree(process.pid)
+        while sample["processes"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+            sample = sample_tree(process.pid)
+
+        assert sample["processes"] == 2
+        assert sample["threads"] >= 2
+        assert sample["rss_bytes"] > 0
+
+        # The child is listed with its start time
+        [(child, started)] = descendants(process.pid).items()
+        assert started == process_start_time(child)
+        assert started >= process_start_time(process.pid)
+
+    assert sample_tree(process.pid) is None
+    assert process_start_time(process.pid) is None
+
+
+@pytest.mark.parametrize("contents", [b"", b"123 (python", b"123 (python) S 1 2"])
+def test_truncated_stat(tmp_path, monkeypatch, contents):
+    "A stat file cut short by an exiting process is skipped."
+    (tmp_path / "123").mkdir()
+    (tmp_path / "123" / "stat").write_bytes(contents)
+    monkeypatch.setattr(resources, "PROC", str(tmp_path))
+
+    assert resources._read_stat(123) is None  # pylint: disable=protected-access
+
+
+def test_resource_sampler():
+    "The sampler records a time series until the process exits."
+    sampler = ResourceSampler(interval=0.05)
+    popen_with_logger(
+        [sys.executable, "-c", TREE_SCRIPT],
+        logger=logging.getLogger("test"),
+        on_start=sampler.start,
+    )
+    sampler.stop()
+
+    assert len(sampler.samples) >= 2
+    times = [sample["time"] for sample in sampler.samples]
+    assert times == sorted(times)
+
+    summary = sampler.summary()
+    assert summary["samples"] == len(sampler.samples)
+    assert summary["peak_processes"] == 2
+    assert summary["peak_rss_bytes"] >= 32 * 1024 * 1024
+    assert summary["cpu_seconds"] >= 0
@@ -0,0 +1,91 @@
+"""Test module for the resource-aware case scheduler."""
+
+import types
+
+import pytest
+
+from nftest.scheduler import ResourceScheduler, available_memory, memory_bytes
+
+
+def make_case(name, cpus=None, memory=None, skip=False):
+    "Return a stand-in for a case with declared resources."
+    return types.SimpleNamespace(name=name, cpus=cpus, memory=memory, skip=skip)
+
+
+@pytest.mark.parametrize(
+    "value,size",
+    [
+        (None, None),
+        (1024, 1024),
+        ("2048", 2048),
+        ("16 GB", 16 * 1024**3),
+        ("512.MB", 512 * 1024**2),
+        ("2 gb", 2 * 1024**3),
+    ],
+)
+def test_memory_bytes(value, size):
+    "Memory declarations are converted to bytes."
+    assert memory_bytes(value) == size
+
+
+def test_memory_bytes_invalid():
+    "Memory without a unit is rejected."
+    with pytest.raises(ValueError):
+        memory_bytes("sixteen")
+
+
+def test_available_memory():
+    "The available memory is found on this host."
+    assert available_memory() > 0
+
+
+def test_backfill():
+    "Smaller cases start around a larger case that does not fit."
+    scheduler = ResourceScheduler(cpus=8, memory=16 * 1024**3)
+    large = make_case("large", cpus=6, memory=4 * 1024**3)
+    large2 = make_case("large2", cpus=6)
+    small = make_case("small", cpus=2)
+    heavy = make_case("heavy", memory=16 * 1024**3)
+    pending = [large, large2, small, heavy]
+
+    assert scheduler.take(pending) is large
+    assert scheduler.take(pending) is small
+    assert scheduler.take(pending) is None
+    assert pending == [large2, heavy]
+    assert (scheduler.free_cpus, scheduler.free_memory) == (0, 12 * 1024**3)
+
+    scheduler.release(small)
+    # heavy needs all of the memory, and large2 needs more CPUs
+    assert scheduler.take(pending) is None
+
+    scheduler.release(large)
+    assert scheduler.take(pending) is large2
+    assert scheduler.take(pending) is heavy
+    assert (scheduler.free_cpus, scheduler.free_memory) == (1, 0)
+
+
+def test_oversized_case_runs_alone():
+    "A case larger than the budget runs once nothing else is running."
+    scheduler = ResourceScheduler(cpus=4, memory=None)
+    small = make_case("small")
+    huge = make_case("huge", cpus=32)
+    skipped = make_case("skipped", cpus=64, skip=True)
+
+    pending = [small, huge, skipped]
+    assert scheduler.take(pending) is small
+    assert scheduler.take(pending) is skipped
+    assert scheduler.take(pending) is None
+
+    scheduler.release(small)
+    assert scheduler.take(pending) is huge
+    assert scheduler.free_cpus == 0
+
+
+def test_default_cpus_allow_jobs():
+    "By default, cases that declare nothing are limited only by the jobs."
+    scheduler = ResourceScheduler(jobs=64)
+    pending = [make_case(f"case{index}") for index in range(64)]
+
+    while scheduler.take(pending):
+        pass
+    assert not pending
@@ -0,0 +1,52 @@
+"""Test module for shared Nextflow sessions."""
+
+import logging
+
+from nftest.session import SharedSession
+
+
+def test_last_session_id(tmp_path):
+    "The session ID is read from the last run in the history."
+    session = SharedSession(tmp_path)
+    assert session.last_session_id() is None
+
+    history = tmp_path / "launch" / ".nextflow" / "history"
+    history.parent.mkdir(parents=True)
+    history.write_text(
+        "2024-01-01 00:00:00\t1s\tsad_turing\tOK\tabc123\t"
+        "11111111-2222-3333-4444-555555555555\tnextflow run main.nf\n"
+        "2024-01-01 00:01:00\t1s\tbig_curie\tERR\tdef456\t"
+        "66666666-7777-8888-9999-000000000000\tnextflow run main.nf -resume\n",
+        encoding="utf-8",
+    )
+
+    assert session.last_session_id() == "66666666-7777-8888-9999-000000000000"
+
+
+def test_close(tmp_path):
+    "Closing the session removes the work directory and Nextflow logs."
+    session = SharedSession(tmp_path)
+    (session.work_dir / "ab").mkdir(parents=True)
+    (session.launch_dir / ".nextflow").mkdir(parents=True)
+    (session.launch_dir / ".nextflow.log").touch()
+
+    session.close(remove_temp=False, clean_logs=False)
+    assert session.work_dir.exists()
+    assert (session.launch_dir / ".nextflow.log").exists()
+
+    session.close(remove_temp=True, clean_logs=True)
+    assert not session.work_dir.exists()
+    assert list(session.launch_dir.iterdir()) == []
+
+
+def test_run_without_history(tmp_path, caplog):
+    "A run that leaves no history is not resumed."
+    caplog.set_level(logging.INFO)
+    session = SharedSession(tmp_path)
+    with session.run() as resume_args:
+        assert resume_args == []
+    with session.run() as resume_args:
+        assert resume_args == []
+
+    assert "No Nextflow session to resume" in caplog.text
+    assert "resume session None" not in caplog.text
@@ -1,8 +1,23 @@
 """Test module for the syslog filter."""
 
 import logging
+import re
+import socket
+import threading
+import time
+from pathlib import Path
 
-from nftest.syslog import syslog_filter, LEVELS
+import mock
+
+from nftest.syslog import (
+    syslog_filter,
+    parse_syslog,
+    LEVELS,
+    SyslogReceiver,
+)
+
+
+DATA_DIR = Path(__file__).parent / "data"
 
 
 def test_syslog_filter(caplog):
@@ -92,3 +107,137 @@ def test_syslog_filter_traceback(caplog):
     assert record.levelno == logging.WARNING
     assert record.msg == "random message"
     assert record.threadName == "traceback"
+
+
+def test_syslog_receiver_channels(caplog):
+    "Test that one receiver attributes datagrams to the right channel."
+    caplog.set_level(logging.DEBUG)
+    logging.getLogger("nextflow").addFilter(syslog_filter)
+
+    with SyslogReceiver() as receiver:
+        first = receiver.open_channel("first")
+        second = receiver.open_channel("second")
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            for _ in range(3):
+                sender.sendto(
+                    b"<134>Jan  3 12:00:25 host nextflow: INFO  [main] Mod - one",
+                    first.address,
+                )
+            sender.sendto(
+                b"<131>Jan  3 12:00:25 host nextflow: ERROR [main] Mod - two",
+                second.address,
+            )
+
+        # Closing a channel logs anything not yet received
+        receiver.close_channel(first)
+        receiver.close_channel(second)
+
+    assert first.message_count == 3
+    assert second.message_count == 1
+    assert first.first_message is not None
+
+    records = [record for record in caplog.records if record.name == "nextflow"]
+    assert sorted((record.case, record.msg) for record in records) == [
+        ("first", "one"),
+        ("first", "one"),
+        ("first", "one"),
+        ("second", "two"),
+    ]
+
+
+def test_syslog_receiver_stops_immediately():
+    "Test that stopping the receiver does not wait for a poll interval."
+    receiver = SyslogReceiver()
+    receiver.start()
+    receiver.open_channel("unused")
+
+    start_time = time.monotonic()
+    receiver.stop()
+    assert time.monotonic() - start_time < 0.5
+
+
+def test_syslog_receiver_survives_errors(caplog):
+    "Test that an error handling one datagram does not stop the receiver."
+    caplog.set_level(logging.DEBUG)
+    message = b"<134>Jan  3 12:00:25 host nextflow: INFO  [main] Mod - one"
+    handled = threading.Event()
+
+    def emit(*_, **__):
+        handled.set()
+        raise RuntimeError("bad datagram")
+
+    with SyslogReceiver() as receiver:
+        channel = receiver.open_channel("case")
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+            with mock.patch("nftest.syslog.emit_syslog", side_effect=emit):
+                sender.sendto(message, channel.address)
+                assert handled.wait(5)
+
+            # Channels opened and closed after the error are still served
+            for index in range(20):
+                receiver.close_channel(receiver.open_channel(f"other{index}"))
+            sender.sendto(message, channel.address)
+            receiver.close_channel(channel)
+
+    assert "Error receiving syslog messages" in caplog.text
+    assert [
+        record.msg for record in caplog.records if record.name == "nextflow"
+    ] == ["one"]
+
+
+# The original two-pass parser, which parse_syslog must agree with
+SYSLOG_RE = re.compile(
+    r"""
+    ^                               # Start of line
+    <(?P<priority>\d+)>             # Priority
+    (?P<month>\w{3})\s              # Month
+    (?P<day>(?:\s|\d)\d)\s          # Day (with optional leading space)
+    (?P<time>\d{2}:\d{2}:\d{2})\s   # Time
+    (?P<hostname>\S+)\s             # Hostname
+    (?P<message>.*)                 # Message
+    $                               # End of line
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+MESSAGE_RE = re.compile(r"^nextflow:\s+\w+\s+\[(?P<thread>.+?)\] \S+ - ")
+
+
+def reference_parse(data):
+    "Parse a datagram with the original regex-only implementation."
+    syslog_match = SYSLOG_RE.match(data.strip().decode("utf-8"))
+    if not syslog_match:
+        return None
+
+    level = LEVELS[int(syslog_match.group("priority")) % 8]
+    message = syslog_match.group("message")
+    thread_match = MESSAGE_RE.match(message)
+    if not thread_match:
+        return level, "traceback", message
+
+    return level, thread_match.group("thread"), MESSAGE_RE.sub("", message)
+
+
+def test_parse_syslog_benchmark(record_property):
+    "Benchmark the syslog parser against the regex-only parser."
+    corpus = [
+        line.encode("utf-8")
+        for line in (DATA_DIR / "nextflow_syslog.txt")
+        .read_text(encoding="utf-8")
+        .splitlines()
+    ]
+
+    # The fast path must give exactly the same results
+    assert [parse_syslog(data) for data in corpus] == [
+        reference_parse(data) for data in corpus
+    ]
+
+    rates = {}
+    for name, parser in (("parse_syslog", parse_syslog), ("regex", reference_parse)):
+        repeats = 200
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            for data in corpus:
+                parser(data)
+        rates[name] = repeats * len(corpus) / (time.perf_counter() - start_time)
+        record_property(f"{name}_messages_per_second", round(rates[name]))
@@ -0,0 +1,84 @@
+"""Test module for Nextflow trace files."""
+
+import pytest
+
+from nftest.trace import (
+    parse_duration,
+    parse_memory,
+    parse_percent,
+    read_trace,
+    summarize_trace,
+)
+
+
+@pytest.mark.parametrize(
+    "text,seconds",
+    [
+        ("350ms", 0.35),
+        ("2.5s", 2.5),
+        ("1m 2s", 62),
+        ("1h 2m 3s", 3723),
+        ("1d 1h", 90000),
+        ("-", None),
+    ],
+)
+def test_parse_duration(text, seconds):
+    "Durations are converted to seconds."
+    assert parse_duration(text) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize(
+    "text,size",
+    [
+        ("512 B", 512),
+        ("1.5 KB", 1536),
+        ("2 MB", 2 * 1024**2),
+        ("1 GB", 1024**3),
+        ("-", None),
+    ],
+)
+def test_parse_memory(text, size):
+    "Sizes are converted to bytes."
+    assert parse_memory(text) == size
+
+
+def test_parse_percent():
+    "Percentages are converted to numbers."
+    assert parse_percent("98.5%") == 98.5
+    assert parse_percent("-") is None
+
+
+def test_read_trace(tmp_path):
+    "Tasks are read from a trace and the slowest are summarized."
+    trace = tmp_path / "trace.txt"
+    trace.write_text(
+        "task_id\thash\tnative_id\tname\tstatus\texit\tsubmit\tduration"
+        "\trealtime\t%cpu\tpeak_rss\tpeak_vmem\trchar\twchar\n"
+        "1\tab/123456\t101\tALIGN (1)\tCOMPLETED\t0\t2024-01-01 00:00:00.000"
+        "\t1m 5s\t1m 2s\t390.5%\t1.5 GB\t2 GB\t1 GB\t500 MB\n"
+        "2\tcd/123456\t-\tSORT (1)\tCACHED\t0\t2024-01-01 00:00:00.000"
+        "\t3s\t2.5s\t99.0%\t100 MB\t200 MB\t10 MB\t10 MB\n"
+        "3\tef/123456\t103\tINDEX (1)\tFAILED\t-\t2024-01-01 00:00:00.000"
+        "\t-\t-\t-\t-\t-\t-\t-\n",
+        encoding="utf-8",
+    )
+
+    tasks = read_trace(trace)
+    assert tasks[0] == {
+        "name": "ALIGN (1)",
+        "hash": "ab/123456",
+        "status": "COMPLETED",
+        "exit": "0",
+        "cached": False,
+        "realtime": 62,
+        "cpu_percent": 390.5,
+        "peak_rss": int(1.5 * 1024**3),
+    }
+    assert tasks[1]["cached"]
+    assert tasks[2]["realtime"] is None
+
+    summary = summarize_trace(tasks, top=1)
+    assert summary["tasks"] == 3
+    assert summary["cached"] == 1
+    assert summary["realtime"] == pytest.approx(64.5)
+    assert [task["name"] for task in summary["slowest"]] == ["ALIGN (1)"]
@@ -0,0 +1,123 @@
+"""Test module for hashing outputs while Nextflow runs"""
+
+import os
+import time
+
+import pytest
+
+from nftest import watch
+from nftest.common import calculate_checksum
+from nftest.watch import OutputChecksums, OutputWatcher, glob_match
+
+
+def wait_for(predicate, timeout=5.0):
+    """Wait until predicate() is true, or fail after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out waiting for the watcher"
+        time.sleep(0.01)
+
+
+def write_old(path, contents):
+    """Write a file whose mtime is outside of the racy window."""
+    path.write_text(contents, encoding="utf-8")
+    os.utime(path, ns=(10**18, 10**18))
+
+
+@pytest.fixture(name="poll", params=[False, True], ids=["inotify", "poll"])
+def fixture_poll(request, monkeypatch):
+    """Watch with inotify, and by polling"""
+    if not request.param and watch._LIBC is None:  # pylint: disable=protected-access
+        pytest.skip("inotify is unavailable")
+    monkeypatch.setattr(watch, "POLL_INTERVAL", 0.05)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "pattern,path,expected",
+    [
+        ("/out/*.txt", "/out/a.txt", True),
+        ("/out/*/a.txt", "/out/sub/a.txt", True),
+        ("/out/*.txt", "/out/sub/a.txt", False),
+        ("/out/a.[ch]", "/out/a.c", True),
+        ("/out/./a.txt", "/out/a.txt", True),
+    ],
+)
+def test_glob_match(pattern, path, expected):
+    """Paths match globs a component at a time, like glob.glob"""
+    assert glob_match(pattern, path) is expected
+
+
+def test_output_hashed_while_running(tmp_path, poll):
+    """A matching output is hashed once it is written, and others are not"""
+    checksums = OutputChecksums()
+    output = tmp_path / "out.txt"
+    other = tmp_path / "other.log"
+
+    with OutputWatcher(
+        tmp_path, [(str(tmp_path / "*.txt"), "md5")], checksums, poll=poll
+    ) as watcher:
+        write_old(output, "first")
+        write_old(other, "ignored")
+        wait_for(lambda: checksums.signature(str(output), "md5") is not None)
+
+    # Setting the mtime may hash the output a second time
+    assert watcher.files_hashed >= 1
+    assert checksums.lookup(output, "md5") == calculate_checksum(output, "md5")
+    assert checksums.signature(str(other), "md5") is None
+    assert checksums.lookup(other, "md5") is None
+    assert checksums.hits == 1
+
+
+def test_rewritten_output_rehashed(tmp_path, poll):
+    """An output that is written again is hashed again"""
+    checksums = OutputChecksums()
+    output = tmp_path / "sub" / "out.txt"
+
+    with OutputWatcher(
+        tmp_path, [(str(tmp_path / "*" / "out.txt"), "sha512")], checksums, poll=poll
+    ):
+        output.parent.mkdir()
+        write_old(output, "first")
+        wait_for(lambda: checksums.signature(str(output), "sha512") is not None)
+
+        output.write_text("second version", encoding="utf-8")
+        os.utime(output, ns=(10**18 + 10**9, 10**18 + 10**9))
+        wait_for(
+            lambda: checksums.lookup(output, "sha512")
+            == calculate_checksum(output, "sha512")
+        )
+
+
+def test_changed_output_not_returned(tmp_path):
+    """A checksum is not returned once the file has changed"""
+    checksums = OutputChecksums()
+    output = tmp_path / "out.txt"
+
+    with OutputWatcher(tmp_path, [(str(output), "md5")], checksums, poll=True):
+        pass
+
+    write_old(output, "first")
+    checksums.store(str(output), "md5", (0, 0, 0, 0), "stale")
+    assert checksums.lookup(output, "md5") is None
+
+
+def test_published_symlink_hashed(tmp_path):
+    """An output linked into place by publishDir is hashed"""
+    if watch._LIBC is None:  # pylint: disable=protected-access
+        pytest.skip("inotify is unavailable")
+
+    work = tmp_path / "work"
+    work.mkdir()
+    target = work / "out.txt"
+    write_old(target, "published")
+
+    output_dir = tmp_path / "output"
+    checksums = OutputChecksums()
+    with OutputWatcher(output_dir, [(str(output_dir / "*.txt"), "md5")], checksums):
+        (output_dir / "out.txt").symlink_to(target)
+        wait_for(lambda: checksums.signature(str(output_dir / "out.txt"), "md5"))
+
+    assert checksums.lookup(output_dir / "out.txt", "md5") == calculate_checksum(
+        target, "md5"
+    )